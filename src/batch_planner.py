@@ -0,0 +1,256 @@
+import re
+import json
+import time
+import hashlib
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List
+
+from config import TABLE_NAME, RESULT_MODE, SQL_ROW_CAP, SHARED_SCAN_MIN_QUERIES
+from rollups import GRAIN_ORDER, aggregate_requirements, aggregate_select, get_available_rollups
+from rollups import rewrite_query_to_rollup
+from result_cache import get_data_version
+from workflow_functions import get_model_name, result_data_version
+
+# Template of the batch SQL generation prompt, one LLM call answers every request of a multi-query report
+BATCH_SQL_PROMPT_TEMPLATE = """
+    You are an assistant that creates SQL queries based on natural language requests.
+    For each numbered request below, generate a valid SQL query for the provided database.
+
+    Requests:
+    {user_requests}
+
+    Available tables and their schemas:
+
+    {schema}
+
+    Importante:
+    - Use only the tables and columns provided.
+    - Make sure the queries are compatible with DuckDB.
+    - Requests over the same grouping must group by the same columns.
+    - Return only a JSON array with one SQL query string per request, in the order of the requests.
+    - Do not use ``` or markdown markers in your response.
+    """
+
+
+@lru_cache(maxsize=1)
+def get_batch_sql_prompt() -> Any:
+    """
+    Returns the batch SQL generation prompt, built on first use so that importing the planner does not load LangChain.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_template(BATCH_SQL_PROMPT_TEMPLATE)
+
+
+def parse_batch_response(content: str, count: int) -> List[str]:
+    """
+    Extracts the SQL queries of a batch response.
+
+    Args:
+        content (str): Text answered by the LLM, a JSON array of SQL strings.
+        count (int): Number of requests of the prompt.
+    Returns:
+        list: One SQL query per request, or empty strings for every request if the response is malformed.
+    """
+    content = re.sub(r"```(json|sql)?", "", content.strip(), flags=re.IGNORECASE).strip()
+    try:
+        queries = json.loads(content)
+    except ValueError:
+        return [""] * count
+    if not isinstance(queries, list) or len(queries) != count:
+        return [""] * count
+    return [query.strip() if isinstance(query, str) else "" for query in queries]
+
+
+@dataclass
+class BatchPlan:
+    """
+    SQL and shared scans planned for the requests of a batch before their workflows run.
+
+    `sql_queries` holds the SQL found in the SQL cache or generated in the
+    batch LLM call, or an empty string for the requests the workflow plans
+    itself (e.g. after a malformed batch response). Each shared aggregate is a rollup-shaped
+    aggregate of the fact table answering several of the requests: its
+    'table' is the Arrow table computed once for all of them, or None when
+    only one of them still has to be executed.
+    """
+    sql_queries: List[str]
+    llm_usage: List[Dict[str, Any]]
+    sql_cache_hits: List[bool]
+    shared_aggregates: List[Dict[str, Any]] = field(default_factory=list)
+    llm_calls: int = 0
+
+    def planned(self, index: int) -> Dict[str, Any]:
+        """
+        Returns the planned SQL, LLM usage and shared aggregates of a request, to seed its workflow state.
+        """
+        return {"sql_query": self.sql_queries[index],
+                "sql_cache_hit": self.sql_cache_hits[index],
+                "llm_usage": self.llm_usage[index],
+                "shared_aggregates": [aggregate for aggregate in self.shared_aggregates
+                                      if index in aggregate['queries']]}
+
+    def describe(self) -> str:
+        """
+        Returns a one-line summary of the plan.
+        """
+        planned = sum(1 for sql_query, hit in zip(self.sql_queries, self.sql_cache_hits) if sql_query and not hit)
+        shared = sum(len(aggregate['queries']) for aggregate in self.shared_aggregates)
+        computed = sum(1 for aggregate in self.shared_aggregates if aggregate['table'] is not None)
+        return (f"Batch plan: {planned} SQL queries in {self.llm_calls} LLM call(s), "
+                f"{sum(self.sql_cache_hits)} from the SQL cache, "
+                f"{len(self.shared_aggregates)} shared aggregate(s) for {shared} queries ({computed} computed)")
+
+
+def plan_sql(user_requests: List[str], llm: Any, schema_catalog: Any) -> Dict[str, Any]:
+    """
+    Generates the SQL of several requests in a single LLM call.
+
+    Args:
+        user_requests (list): Natural language requests.
+        llm (Any): The LLM client.
+        schema_catalog (SchemaCatalog): Refreshed catalog describing the schema.
+    Returns:
+        dict: The SQL queries in 'sql_queries' (empty strings if the response is malformed),
+        and the time and tokens spent per request in 'llm_usage'.
+    """
+    # The schema is selected for all the requests at once
+    schema, _ = schema_catalog.describe(" ".join(user_requests))
+    numbered = "\n    ".join(f"{i+1}. {user_request}" for i, user_request in enumerate(user_requests))
+    prompt = get_batch_sql_prompt().format(user_requests=numbered, schema=schema)
+    start = time.perf_counter()
+    response = llm.invoke(prompt)
+    seconds = time.perf_counter() - start
+
+    # The cost of the call is shared evenly, so the SQL cache records a per-request cost
+    usage = getattr(response, 'usage_metadata', None) or {}
+    count = len(user_requests)
+    share = {"seconds": seconds / count,
+             **{key: usage.get(key, 0) // count for key in ("input_tokens", "output_tokens", "total_tokens")}}
+    return {"sql_queries": parse_batch_response(response.content, count), "llm_usage": share}
+
+
+def plan_shared_scans(conn: Any, db_path: str, sql_queries: List[str], use_rollups: bool = True,
+                      result_cache: Any = None, result_mode: str = RESULT_MODE, row_cap: Any = SQL_ROW_CAP,
+                      min_queries: int = SHARED_SCAN_MIN_QUERIES,
+                      fact_table: str = TABLE_NAME) -> List[Dict[str, Any]]:
+    """
+    Finds the queries grouping the fact table by the same columns and computes their aggregate once.
+
+    Only queries whose aggregates a rollup could answer are grouped, so
+    e.g. COUNT(InvoiceNo) or AVG(UnitPrice) stay on the fact table, and
+    queries a rollup table already answers are left out. The aggregate of
+    a group keeps the grouping columns and InvoiceDate at the finest grain
+    the group needs, so each query is rewritten to it like to a rollup
+    (see `rewrite_query_to_rollup`). Its name is derived from its definition
+    and the data version, so the rewritten queries hit the result cache of
+    earlier runs, and it is only computed when at least `min_queries` of
+    its queries are not in the result cache.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        db_path (str): Path of the database file, used to version databases without load metadata.
+        sql_queries (list): SQL of each request, an empty string if not known yet.
+        use_rollups (bool): Whether the workflow routes queries to the rollup tables.
+        result_cache (ResultCache): Result cache the workflow reads, if any.
+        result_mode (str): Result mode of the workflow, part of the result cache key.
+        row_cap (int): Row cap of the workflow, part of the result cache key.
+        min_queries (int): Minimum number of queries sharing an aggregate.
+        fact_table (str): Name of the fact table.
+    Returns:
+        list: Shared aggregates with their name, grain, dimensions, SQL, indexes of the queries
+        they answer, Arrow table (None if not computed) and number of rows.
+    """
+    rollups = get_available_rollups(conn) if use_rollups else []
+    groups = {}
+    for index, sql_query in enumerate(sql_queries):
+        requirements = aggregate_requirements(sql_query, fact_table) if sql_query else None
+        if requirements is None or rewrite_query_to_rollup(sql_query, rollups, fact_table)[1] is not None:
+            continue
+        grain, dimensions = requirements
+        groups.setdefault(tuple(sorted(dimensions)), []).append((index, grain))
+
+    data_version = get_data_version(conn, db_path)
+    shared_aggregates = []
+    for dimensions, members in groups.items():
+        if len(members) < min_queries:
+            continue
+        grains = [grain for _, grain in members if grain is not None]
+        grain = max(grains, key=GRAIN_ORDER.get) if grains else None
+        select = aggregate_select(fact_table, grain, list(dimensions))
+        digest = hashlib.sha256(f"{data_version}|{select}".encode()).hexdigest()[:16]
+        aggregate = {"name": f"shared_aggregate_{digest}", "grain": grain, "dimensions": list(dimensions),
+                     "sql": select, "queries": [index for index, _ in members], "table": None, "row_count": 0}
+
+        pending = len(members)
+        if result_cache is not None:
+            # The row cap only applies to the 'full' result mode, as in the workflow
+            version = result_data_version(conn, db_path, result_mode, row_cap if result_mode == "full" else None)
+            rewritten = [rewrite_query_to_rollup(sql_queries[index], [aggregate], fact_table)[0]
+                         for index, _ in members]
+            pending = sum(1 for sql_query in rewritten if result_cache.get_metadata(sql_query, version) is None)
+        if pending >= min_queries:
+            aggregate['table'] = conn.execute(select).to_arrow_table()
+            aggregate['row_count'] = aggregate['table'].num_rows
+        shared_aggregates.append(aggregate)
+    return shared_aggregates
+
+
+def plan_batch(user_requests: List[str], llm: Any, db: Any, schema_catalog: Any, sql_cache: Any = None,
+               result_cache: Any = None, use_rollups: bool = True, result_mode: str = RESULT_MODE,
+               row_cap: Any = SQL_ROW_CAP, min_shared_queries: int = SHARED_SCAN_MIN_QUERIES) -> BatchPlan:
+    """
+    Plans the SQL of a batch of requests in one LLM call and the scans they can share.
+
+    The requests found in the SQL cache are not sent to the LLM, and a
+    single missing request is left to its workflow. The workflows do not
+    look up the SQL cache again for the requests planned here. If the batch call fails
+    or its response is malformed, each workflow asks the LLM on its own.
+
+    Args:
+        user_requests (list): Natural language requests.
+        llm (Any): The LLM client.
+        db (DuckDBConnectionManager): Connection manager of the database.
+        schema_catalog (SchemaCatalog): Catalog describing the schema.
+        sql_cache (SQLCache): SQL cache of the workflow, if used.
+        result_cache (ResultCache): Result cache of the workflow, if used.
+        use_rollups (bool): Whether the workflow routes queries to the rollup tables.
+        result_mode (str): Result mode of the workflow.
+        row_cap (int): Row cap of the workflow.
+        min_shared_queries (int): Minimum number of queries sharing an aggregate.
+    Returns:
+        BatchPlan: The SQL and shared aggregates of the requests.
+    """
+    conn = db.cursor()
+    try:
+        fingerprint = schema_catalog.refresh(conn, db.db_path)
+        model_name = get_model_name(llm)
+        cached = [sql_cache.get(user_request, fingerprint, model_name) if sql_cache is not None else None
+                  for user_request in user_requests]
+    except Exception as e:
+        print(f"Schema introspection failed, planning each request separately: {e}")
+        return BatchPlan(sql_queries=[""] * len(user_requests), llm_usage=[{} for _ in user_requests],
+                         sql_cache_hits=[False] * len(user_requests))
+    plan = BatchPlan(sql_queries=[sql_query or "" for sql_query in cached], llm_usage=[{} for _ in user_requests],
+                     sql_cache_hits=[sql_query is not None for sql_query in cached])
+
+    missing = [i for i, sql_query in enumerate(cached) if sql_query is None]
+    if len(missing) > 1:
+        try:
+            planned = plan_sql([user_requests[i] for i in missing], llm, schema_catalog)
+            plan.llm_calls = 1
+            for i, sql_query in zip(missing, planned['sql_queries']):
+                if sql_query:
+                    plan.sql_queries[i] = sql_query
+                    plan.llm_usage[i] = dict(planned['llm_usage'])
+            if not any(planned['sql_queries']):
+                print("Malformed batch SQL response, planning each request separately")
+        except Exception as e:
+            print(f"Batch SQL planning failed, planning each request separately: {e}")
+
+    try:
+        plan.shared_aggregates = plan_shared_scans(conn, db.db_path, plan.sql_queries, use_rollups, result_cache,
+                                                   result_mode, row_cap, min_shared_queries)
+    except Exception as e:
+        print(f"Shared scan planning failed, running each query on its own: {e}")
+    return plan
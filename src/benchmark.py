@@ -0,0 +1,452 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import duckdb
+from config import TABLE_NAME, DATABASE_NAME, BENCHMARK_ROWS, BENCHMARK_QUERY_COUNTS, BENCHMARK_FOLDER, BATCH_PLANNING
+from db_connection import get_database_path
+from extract_and_write_data import connect_for_ingest, get_data_folder, load_file_into_duckdb
+from generate_multiple_business_report import generate_multi_query_report
+from llm_client import FakeLLM
+from report_engine import ReportEngine
+from tracing import max_rss_mb
+
+COUNTRIES = ["United Kingdom", "France", "Germany", "EIRE", "Spain", "Netherlands", "Belgium", "Portugal",
+             "Australia", "Norway", "Italy"]
+YEARS = [2010, 2011, 2012]
+PRODUCTS = 4000
+CUSTOMERS = 5000
+# Commands timed by the import benchmark, run with the interpreter from the src folder
+IMPORT_COMMANDS = {
+    "import workflow_functions": ["-c", "import workflow_functions"],
+    "import report_engine": ["-c", "import report_engine"],
+    "import generate_multiple_business_report": ["-c", "import generate_multiple_business_report"],
+    "generate_business_report.py --help": ["generate_business_report.py", "--help"],
+    "generate_multiple_business_report.py --help": ["generate_multiple_business_report.py", "--help"],
+    "report_server.py --help": ["report_server.py", "--help"],
+}
+
+
+def benchmark_folder() -> str:
+    """
+    Returns the folder holding the benchmark results, creating it if needed.
+    """
+    folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), BENCHMARK_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def generate_sales_data(path: str, rows: int) -> int:
+    """
+    Writes a synthetic sales dataset with the columns of the retail dataset to a Parquet file.
+
+    Values are derived from a hash of the row number, so the same size always
+    produces the same data. Invoices hold 5 lines and span YEARS.
+
+    Args:
+        path (str): Path of the Parquet file.
+        rows (int): Number of rows.
+    Returns:
+        int: Size of the file in bytes.
+    """
+    countries = "[" + ", ".join(f"'{country}'" for country in COUNTRIES) + "]"
+    minutes = len(YEARS) * 365 * 24 * 60
+    conn = duckdb.connect()
+    try:
+        conn.execute(f"""
+            COPY (
+                SELECT
+                    CAST(500000 + i // 5 AS VARCHAR) AS InvoiceNo,
+                    CAST(10000 + hash(i * 7) % {PRODUCTS} AS VARCHAR) AS StockCode,
+                    'Product ' || CAST(hash(i * 7) % {PRODUCTS} AS VARCHAR) AS Description,
+                    CAST(1 + hash(i * 13) % 24 AS BIGINT) AS Quantity,
+                    TIMESTAMP '{YEARS[0]}-01-01' + TO_MINUTES(CAST((i // 5) * {minutes} // {max(rows // 5, 1)} AS BIGINT))
+                        AS InvoiceDate,
+                    ROUND(0.5 + (hash(i * 7) % 2000) / 100.0, 2) AS UnitPrice,
+                    CAST(12000 + hash(i // 5) % {CUSTOMERS} AS DOUBLE) AS CustomerID,
+                    {countries}[1 + CAST(hash(i // 5) % {len(COUNTRIES)} AS BIGINT)] AS Country
+                FROM range({int(rows)}) t(i)
+            ) TO '{path.replace("'", "''")}' (FORMAT PARQUET)
+        """)
+    finally:
+        conn.close()
+    return os.path.getsize(path)
+
+
+def benchmark_queries(count: int) -> List[Tuple[str, str]]:
+    """
+    Returns `count` distinct requests together with the SQL the stub LLM answers them with.
+
+    Args:
+        count (int): Number of requests.
+    Returns:
+        list: Pairs of natural language request and SQL query.
+    """
+    queries = [
+        ("Show me the total Quantity per country",
+         f"SELECT Country, SUM(Quantity) AS total_quantity FROM {TABLE_NAME} "
+         f"GROUP BY Country ORDER BY total_quantity DESC"),
+        ("Show me the total sales per month",
+         f"SELECT DATE_TRUNC('month', InvoiceDate) AS month, SUM(Quantity * UnitPrice) AS total_sales "
+         f"FROM {TABLE_NAME} GROUP BY 1 ORDER BY 1"),
+    ]
+    j = 0
+    while len(queries) < count:
+        k, country, year = 2 + j // 4, COUNTRIES[j // 4 % len(COUNTRIES)], YEARS[j // 4 % len(YEARS)]
+        queries.append([
+            (f"Which are the top {k} countries by sales?",
+             f"SELECT Country, SUM(Quantity * UnitPrice) AS total_sales FROM {TABLE_NAME} "
+             f"GROUP BY Country ORDER BY total_sales DESC LIMIT {k}"),
+            (f"Top {k} products by quantity",
+             f"SELECT Description, SUM(Quantity) AS total_quantity FROM {TABLE_NAME} "
+             f"GROUP BY Description ORDER BY total_quantity DESC LIMIT {k}"),
+            (f"Show me the total sales per month in {country} in {year}",
+             f"SELECT DATE_TRUNC('month', InvoiceDate) AS month, SUM(Quantity * UnitPrice) AS total_sales "
+             f"FROM {TABLE_NAME} WHERE Country = '{country}' AND YEAR(InvoiceDate) = {year} GROUP BY 1 ORDER BY 1"),
+            (f"Show me the total Quantity per day in {country} in {year}",
+             f"SELECT DATE_TRUNC('day', InvoiceDate) AS day, SUM(Quantity) AS total_quantity "
+             f"FROM {TABLE_NAME} WHERE Country = '{country}' AND YEAR(InvoiceDate) = {year} GROUP BY 1 ORDER BY 1"),
+        ][j % 4])
+        j += 1
+    return queries[:count]
+
+
+def summarize_spans(trace_path: str) -> Dict[str, Dict[str, float]]:
+    """
+    Aggregates the records of a trace file by span name.
+
+    Returns:
+        dict: For each span, its number of calls and the mean, median, p95 and total of its wall and CPU time in ms.
+    """
+    spans = {}
+    with open(trace_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            spans.setdefault(record["span"], []).append(record)
+
+    summary = {}
+    for name, records in spans.items():
+        wall = sorted(record["wall_seconds"] * 1000 for record in records)
+        summary[name] = {"calls": len(records),
+                         "wall_mean_ms": round(statistics.mean(wall), 3),
+                         "wall_p50_ms": round(statistics.median(wall), 3),
+                         "wall_p95_ms": round(wall[min(len(wall) - 1, int(0.95 * len(wall)))], 3),
+                         "wall_total_ms": round(sum(wall), 3),
+                         "cpu_total_ms": round(sum(record["cpu_seconds"] for record in records) * 1000, 3)}
+    return summary
+
+
+def git_commit() -> Tuple[str, bool]:
+    """
+    Returns the current commit of the repository and whether the working tree has uncommitted changes.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def imported_modules(arguments: List[str]) -> List[Tuple[str, int, float]]:
+    """
+    Runs a command with `-X importtime` and returns each imported module with its depth and cumulative time in ms.
+    """
+    src_folder = os.path.dirname(os.path.abspath(__file__))
+    stderr = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=src_folder,
+                            capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        modules.append((name.strip(), (len(name) - len(name.lstrip()) - 1) // 2, int(parts[1]) / 1000))
+    return modules
+
+
+def heaviest_imports(arguments: List[str], top: int = 5) -> List[Tuple[str, float]]:
+    """
+    Returns the modules imported directly by a command that take the most time, with their cumulative time in ms.
+    """
+    # Modules imported by the interpreter start-up are not the command's
+    startup = {name for name, _, _ in imported_modules(["-c", "pass"])}
+    target = arguments[1].split()[-1] if arguments[0] == "-c" else "__main__"
+    # With -c the command's module is the top level, its direct imports are one level below it
+    depth = 1 if arguments[0] == "-c" else 0
+    imports = [(name, round(ms, 1)) for name, level, ms in imported_modules(arguments)
+               if level == depth and name not in startup and name != target]
+    return sorted(imports, key=lambda entry: entry[1], reverse=True)[:top]
+
+
+def benchmark_imports(repeat: int = 5) -> Dict[str, Dict[str, Any]]:
+    """
+    Times the start of a fresh interpreter importing each module of the pipeline or printing a CLI's help.
+
+    Args:
+        repeat (int): Number of runs of each command, the median is reported.
+    Returns:
+        dict: For each command of IMPORT_COMMANDS, its median and minimum time in ms and its heaviest imports.
+    """
+    src_folder = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, arguments in IMPORT_COMMANDS.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *arguments], cwd=src_folder, capture_output=True, check=True)
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = {"median_ms": round(statistics.median(timings), 1),
+                         "min_ms": round(min(timings), 1),
+                         "heaviest_imports": heaviest_imports(arguments)}
+        heaviest = ", ".join(f"{module} {ms:.0f} ms" for module, ms in results[name]["heaviest_imports"])
+        print(f"{name:<45} median {results[name]['median_ms']:>7.1f} ms | {heaviest or '-'}")
+    return results
+
+
+def run_pipeline_benchmark(db_path: str, queries: List[Tuple[str, str]], run_folder: str, max_workers: int,
+                           stream: bool, use_rollups: bool, llm_latency: float,
+                           batch_plan: bool = BATCH_PLANNING) -> Dict[str, Any]:
+    """
+    Times `generate_multi_query_report` on a set of requests with cold caches and traces its nodes.
+
+    Args:
+        db_path (str): Path of the benchmark database.
+        queries (list): Pairs of request and SQL (see `benchmark_queries`).
+        run_folder (str): Folder receiving the trace file and the PDF of the run.
+        max_workers (int): Maximum number of queries processed at the same time.
+        stream (bool): Use the streaming PDF mode.
+        use_rollups (bool): Let the workflow answer queries from the rollup tables.
+        llm_latency (float): Simulated latency of the stub LLM in seconds.
+        batch_plan (bool): Plan the SQL in one LLM call and share the scans of common groupings.
+    Returns:
+        dict: End-to-end time, throughput, errors, peak RSS and per-node statistics of the run.
+    """
+    trace_path = os.path.join(run_folder, f"trace_{len(queries)}.jsonl")
+    pdf_path = os.path.join(run_folder, f"report_{len(queries)}.pdf")
+    for path in (trace_path, pdf_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    llm = FakeLLM(latency_seconds=llm_latency, responses=dict(queries))
+    # Caches are disabled so that every run measures the full pipeline
+    with ReportEngine(llm=llm, use_sql_cache=False, use_result_cache=False, db_path=db_path,
+                      use_rollups=use_rollups, trace_path=trace_path) as engine:
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            final_states = generate_multi_query_report([request for request, _ in queries], filename=pdf_path,
+                                                       max_workers=max_workers, engine=engine,
+                                                       use_result_cache=False, stream=stream,
+                                                       batch_plan=batch_plan)
+        elapsed = time.perf_counter() - start
+
+    result = {"queries": len(queries),
+              "e2e_seconds": round(elapsed, 3),
+              "queries_per_second": round(len(queries) / elapsed, 3),
+              "errors": sum(1 for state in final_states if state['errors']),
+              "llm_calls": llm.calls,
+              "pdf_bytes": os.path.getsize(pdf_path) if os.path.exists(pdf_path) else 0,
+              "max_rss_mb": max_rss_mb(),
+              "nodes": summarize_spans(trace_path)}
+    if os.path.exists(pdf_path):
+        os.remove(pdf_path)
+    return result
+
+
+def run_benchmark(rows: List[int] = BENCHMARK_ROWS, query_counts: List[int] = BENCHMARK_QUERY_COUNTS,
+                  max_workers: int = 4, stream: bool = False, use_rollups: bool = True,
+                  llm_latency: float = 0.0, keep_data: bool = False,
+                  batch_plan: bool = BATCH_PLANNING) -> Dict[str, Any]:
+    """
+    Runs the offline benchmark and saves its results, keyed by the current commit, in the benchmark folder.
+
+    The import time of the modules and CLIs is measured first. Then, for each
+    dataset size, a synthetic dataset is generated, ingested into its
+    own database (rollup tables included) and the multi-query report is
+    generated for each number of requests with the stub LLM.
+
+    Args:
+        rows (list): Dataset sizes in rows.
+        query_counts (list): Numbers of requests per report.
+        max_workers (int): Maximum number of queries processed at the same time.
+        stream (bool): Use the streaming PDF mode.
+        use_rollups (bool): Let the workflow answer queries from the rollup tables.
+        llm_latency (float): Simulated latency of the stub LLM in seconds.
+        keep_data (bool): Keep the generated Parquet files and databases, and reuse the files in later runs.
+        batch_plan (bool): Plan the SQL in one LLM call and share the scans of common groupings.
+    Returns:
+        dict: The benchmark results, also written to a JSON file.
+    """
+    results = new_results({"max_workers": max_workers, "stream": stream, "use_rollups": use_rollups,
+                           "llm_latency": llm_latency, "batch_plan": batch_plan})
+    results["imports"] = benchmark_imports()
+    run_folder = os.path.join(benchmark_folder(), "runs")
+    os.makedirs(run_folder, exist_ok=True)
+    queries = benchmark_queries(max(query_counts))
+
+    for size in rows:
+        data_path = os.path.join(get_data_folder(), f"benchmark_{size}.parquet")
+        database_name = f"{DATABASE_NAME}_benchmark_{size}"
+        db_path = get_database_path(database_name)
+        dataset = {"rows": size}
+
+        if keep_data and os.path.exists(data_path):
+            dataset["generate_seconds"] = None
+        else:
+            start = time.perf_counter()
+            generate_sales_data(data_path, size)
+            dataset["generate_seconds"] = round(time.perf_counter() - start, 3)
+        dataset["parquet_bytes"] = os.path.getsize(data_path)
+
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        start = time.perf_counter()
+        conn = connect_for_ingest(database_name)
+        try:
+            load_file_into_duckdb(data_path, conn, TABLE_NAME, mode="create")
+        finally:
+            conn.close()
+        dataset["ingest_seconds"] = round(time.perf_counter() - start, 3)
+        dataset["ingest_rows_per_second"] = round(size / dataset["ingest_seconds"])
+        dataset["db_bytes"] = os.path.getsize(db_path)
+        print(f"{size:,} rows: generated in {dataset['generate_seconds']}s, ingested in {dataset['ingest_seconds']}s")
+
+        dataset["runs"] = []
+        for count in query_counts:
+            run = run_pipeline_benchmark(db_path, queries[:count], run_folder, max_workers, stream, use_rollups,
+                                         llm_latency, batch_plan)
+            dataset["runs"].append(run)
+            print(f"{size:,} rows, {count} queries: {run['e2e_seconds']}s ({run['queries_per_second']} queries/s, "
+                  f"{run['errors']} errors)")
+            for name, node in run["nodes"].items():
+                print(f"  {name:<32} calls {node['calls']:>4} | mean {node['wall_mean_ms']:>9.1f} ms"
+                      f" | p95 {node['wall_p95_ms']:>9.1f} ms | total {node['wall_total_ms']:>10.1f} ms")
+        results["datasets"].append(dataset)
+
+        if not keep_data:
+            os.remove(data_path)
+            os.remove(db_path)
+
+    save_results(results)
+    return results
+
+
+def new_results(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns an empty results document, identified by the current commit and describing the machine.
+    """
+    commit, dirty = git_commit()
+    return {"commit": commit,
+            "dirty": dirty,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "machine": {"python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(),
+                        "duckdb": duckdb.__version__},
+            "settings": settings,
+            "datasets": [],
+            "imports": {}}
+
+
+def save_results(results: Dict[str, Any]) -> str:
+    """
+    Writes a results document to the benchmark folder, in a file named after its start time and commit.
+    """
+    started_at = datetime.fromisoformat(results["started_at"])
+    results_path = os.path.join(benchmark_folder(), f"{started_at.strftime('%Y%m%dT%H%M%S')}_{results['commit']}"
+                                                    f"{'-dirty' if results['dirty'] else ''}.json")
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved as {results_path}")
+    return results_path
+
+
+def flatten_results(results: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Returns the comparable metrics of a results file, keyed by dataset size, number of queries and node.
+    """
+    metrics = {f"{name} ms": command["median_ms"] for name, command in results.get("imports", {}).items()}
+    for dataset in results["datasets"]:
+        prefix = f"{dataset['rows']:,} rows"
+        metrics[f"{prefix} | ingest s"] = dataset["ingest_seconds"]
+        for run in dataset["runs"]:
+            run_prefix = f"{prefix} | {run['queries']} queries"
+            metrics[f"{run_prefix} | e2e s"] = run["e2e_seconds"]
+            for name, node in run["nodes"].items():
+                metrics[f"{run_prefix} | {name} mean ms"] = node["wall_mean_ms"]
+    return metrics
+
+
+def compare_results(paths: List[str]) -> None:
+    """
+    Prints the metrics of several results files side by side, with the change against the first one.
+
+    Args:
+        paths (list): Paths of results files written by `run_benchmark`, the baseline first.
+    """
+    runs = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            results = json.load(f)
+        runs.append((f"{results['commit']}{'*' if results['dirty'] else ''}", flatten_results(results)))
+
+    names = list(dict.fromkeys(name for _, metrics in runs for name in metrics))
+    width = max(len(name) for name in names)
+    print(f"{'metric':<{width}} | " + " | ".join(f"{label:>18}" for label, _ in runs))
+    for name in names:
+        baseline = runs[0][1].get(name)
+        cells = []
+        for _, metrics in runs:
+            value = metrics.get(name)
+            if value is None:
+                cells.append(f"{'-':>18}")
+            elif baseline and metrics is not runs[0][1]:
+                cells.append(f"{value:>9.1f} ({(value - baseline) / baseline:+6.1%})")
+            else:
+                cells.append(f"{value:>18.1f}")
+        print(f"{name:<{width}} | " + " | ".join(cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of ingestion and report generation")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(BENCHMARK_ROWS),
+                        help="Sizes of the synthetic datasets, e.g. 1000000 10000000 100000000")
+    parser.add_argument("--queries", type=int, nargs="+", default=list(BENCHMARK_QUERY_COUNTS),
+                        help="Numbers of requests per report")
+    parser.add_argument("--max_workers", type=int, default=4, help="Maximum number of queries processed at the same time")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming PDF mode")
+    parser.add_argument("--no_rollups", action="store_true", help="Always query the fact table")
+    parser.add_argument("--no_batch_plan", action="store_true",
+                        help="Generate the SQL of each request in its own LLM call and run every scan separately")
+    parser.add_argument("--llm_latency", type=float, default=0.0, help="Simulated latency of the stub LLM in seconds")
+    parser.add_argument("--keep_data", action="store_true",
+                        help="Keep the generated datasets and databases, and reuse the datasets in later runs")
+    parser.add_argument("--imports", action="store_true",
+                        help="Only time the imports of the pipeline modules and the start of the CLIs")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS",
+                        help="Compare results files instead of running the benchmark, the baseline first")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(args.compare)
+        sys.exit(0)
+    if args.imports:
+        results = new_results({})
+        results["imports"] = benchmark_imports()
+        save_results(results)
+        sys.exit(0)
+    run_benchmark(args.rows, args.queries, max_workers=args.max_workers, stream=args.stream,
+                  use_rollups=not args.no_rollups, llm_latency=args.llm_latency, keep_data=args.keep_data,
+                  batch_plan=not args.no_batch_plan)
@@ -0,0 +1,357 @@
+import io
+import os
+import json
+import time
+import argparse
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+from config import CHART_MAX_ROWS, CHART_MAX_POINTS, CHART_CACHE_MAX_ENTRIES, CHART_WORKERS, CHART_POOL_START_METHOD
+
+
+def build_chart_spec(query_result: pd.DataFrame,
+                     user_request: str,
+                     figsize: tuple = (10, 6)) -> Optional[Dict[str, Any]]:
+    """
+    Chooses the chart that represents a query result.
+
+    Args:
+        query_result (pd.DataFrame): The query result.
+        user_request (str): The user's natural language request, may ask for a pie or bar chart.
+        figsize (tuple): Size of the figure in inches.
+    Returns:
+        Optional[dict]: Chart kind, columns, labels and size, or None if the result cannot be charted.
+    """
+    if query_result is None or query_result.empty or len(query_result.columns) < 2:
+        return None
+    numeric_cols = query_result.select_dtypes(include=['number']).columns.tolist()
+    datetime_cols = [col for col in query_result.columns
+                     if pd.api.types.is_datetime64_any_dtype(query_result[col])]
+
+    # Determine visualization type based on available columns
+    if 'Description' in query_result.columns:
+        x_col, kind = 'Description', 'bar'
+    elif 'Country' in query_result.columns:
+        x_col, kind = 'Country', 'bar'
+    elif datetime_cols:
+        x_col, kind = datetime_cols[0], 'line'
+    else:
+        x_col = query_result.columns[0]
+        kind = 'scatter' if x_col in numeric_cols else 'bar'
+
+    y_col = next((col for col in numeric_cols if col != x_col), None)
+    if y_col is None:
+        return None
+
+    # Check if the request suggests a specific chart type
+    request = user_request.lower()
+    if "pizza" in request or "pie" in request:
+        kind, figsize = 'pie', (8, 8)
+    elif "barra" in request or "bar" in request:
+        kind = 'bar'
+
+    return {
+        "kind": kind,
+        "x": x_col,
+        "y": y_col,
+        "title": user_request,
+        "xlabel": x_col,
+        "ylabel": y_col.replace("_", " ").title(),
+        "figsize": list(figsize),
+        "max_rows": CHART_MAX_ROWS if kind in ('bar', 'pie') else CHART_MAX_POINTS,
+    }
+
+
+def chart_data(query_result: pd.DataFrame, spec: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Returns the columns and rows of the query result drawn by a chart.
+    """
+    return query_result[[spec['x'], spec['y']]].head(spec['max_rows'])
+
+
+def render_chart(data: pd.DataFrame, spec: Dict[str, Any], dpi: int = 300, fmt: str = "png") -> bytes:
+    """
+    Draws a chart and returns the image bytes.
+
+    The figure is not managed by pyplot, so rendering is safe from several
+    threads, and it is cleared as soon as the image is written.
+
+    Args:
+        data (pd.DataFrame): Data drawn by the chart (see `chart_data`).
+        spec (dict): Chart specification (see `build_chart_spec`).
+        dpi (int): Resolution of the image.
+        fmt (str): Image format, 'png' or 'svg'.
+    Returns:
+        bytes: The image.
+    """
+    # matplotlib is only loaded by the processes that draw charts
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=tuple(spec['figsize']))
+    try:
+        ax = fig.subplots()
+        x, y = data[spec['x']], data[spec['y']]
+        if spec['kind'] == 'pie':
+            ax.pie(y, labels=x.astype(str), autopct='%1.1f%%')
+            ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle
+        elif spec['kind'] == 'line':
+            ax.plot(x, y)
+            ax.tick_params(axis='x', labelrotation=45)
+        elif spec['kind'] == 'scatter':
+            ax.scatter(x, y)
+        else:
+            ax.bar(x.astype(str), y)
+            ax.tick_params(axis='x', labelrotation=45)
+            for label in ax.get_xticklabels():
+                label.set_horizontalalignment('right')
+
+        ax.set_title(spec['title'])
+        if spec['kind'] != 'pie':
+            ax.set_xlabel(spec['xlabel'])
+            ax.set_ylabel(spec['ylabel'])
+        fig.tight_layout()
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, dpi=dpi)
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+def chart_key(data: pd.DataFrame, spec: Dict[str, Any], dpi: int, fmt: str) -> str:
+    """
+    Hashes the chart data, specification and output settings.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([spec, dpi, fmt, list(map(str, data.columns)),
+                              list(map(str, data.dtypes))], sort_keys=True).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+class ChartCache:
+    """
+    In-memory LRU cache of rendered chart images, keyed by `chart_key`.
+    """
+
+    def __init__(self, max_entries: int = CHART_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: str, image: bytes) -> None:
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit/miss counters and the size of the cache.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._images),
+                "bytes": sum(len(image) for image in self._images.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def render_chart_cached(data: pd.DataFrame,
+                        spec: Dict[str, Any],
+                        dpi: int = 300,
+                        fmt: str = "png",
+                        cache: Optional[ChartCache] = None) -> bytes:
+    """
+    Renders a chart, reusing the image cached for the same data and specification.
+
+    Args:
+        data (pd.DataFrame): Data drawn by the chart (see `chart_data`).
+        spec (dict): Chart specification (see `build_chart_spec`).
+        dpi (int): Resolution of the image.
+        fmt (str): Image format, 'png' or 'svg'.
+        cache (ChartCache): Cache of rendered images, no caching when None.
+    Returns:
+        bytes: The image.
+    """
+    if cache is None:
+        return render_chart(data, spec, dpi, fmt)
+    key = chart_key(data, spec, dpi, fmt)
+    image = cache.get(key)
+    if image is None:
+        image = render_chart(data, spec, dpi, fmt)
+        cache.put(key, image)
+    return image
+
+
+class ChartRenderPool:
+    """
+    Renders charts in a pool of worker processes.
+
+    Matplotlib rendering is CPU-bound and holds the GIL, so charts rendered in
+    threads use a single core. Workers receive the small chart data plus its
+    spec and return the image bytes. The pool is created on first use and
+    reused until `close` is called.
+    """
+
+    def __init__(self, workers: int = CHART_WORKERS, start_method: str = CHART_POOL_START_METHOD):
+        self.workers = workers
+        self.start_method = start_method
+        self._executor = None
+        self._executor_workers = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self, workers: int) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._executor_workers != workers:
+                if self._executor is not None:
+                    self._executor.shutdown()
+                # Spawned workers do not inherit the threads and open DuckDB handles of the parent
+                self._executor = ProcessPoolExecutor(max_workers=workers,
+                                                     mp_context=multiprocessing.get_context(self.start_method))
+                self._executor_workers = workers
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        # A pool whose worker died rejects every new job, the next call starts a new one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render_many(self,
+                    jobs: List[Tuple[pd.DataFrame, Dict[str, Any]]],
+                    dpi: int = 300,
+                    fmt: str = "png",
+                    cache: Optional[ChartCache] = None,
+                    workers: Optional[int] = None) -> List[Union[bytes, Exception]]:
+        """
+        Renders several charts, in parallel when more than one worker is used.
+
+        A chart that fails to render does not affect the others: its exception
+        takes the place of its image in the result. If a worker process dies,
+        the pool is discarded and the next call starts a new one.
+
+        Args:
+            jobs (list): Pairs of chart data and chart spec.
+            dpi (int): Resolution of the images.
+            fmt (str): Image format, 'png' or 'svg'.
+            cache (ChartCache): Cache of rendered images, no caching when None.
+            workers (int): Number of worker processes, the pool size by default.
+        Returns:
+            list: The images, or the exception of the charts that failed, in the same order as the jobs.
+        """
+        workers = self.workers if workers is None else workers
+        keys = [chart_key(data, spec, dpi, fmt) for data, spec in jobs]
+        images = {}
+        if cache is not None:
+            for key in keys:
+                image = cache.get(key)
+                if image is not None:
+                    images[key] = image
+
+        # Identical charts are only rendered once
+        pending = {key: job for key, job in zip(keys, jobs) if key not in images}
+        rendered = {}
+        if workers <= 1 or len(pending) <= 1:
+            for key, (data, spec) in pending.items():
+                try:
+                    rendered[key] = render_chart(data, spec, dpi, fmt)
+                except Exception as e:
+                    rendered[key] = e
+        else:
+            executor = self._get_executor(workers)
+            futures = {}
+            for key, (data, spec) in pending.items():
+                try:
+                    futures[key] = executor.submit(render_chart, data, spec, dpi, fmt)
+                except BrokenProcessPool as e:
+                    rendered[key] = e
+            for key, future in futures.items():
+                try:
+                    rendered[key] = future.result()
+                except Exception as e:
+                    rendered[key] = e
+            if any(isinstance(image, BrokenProcessPool) for image in rendered.values()):
+                self._discard_executor(executor)
+
+        for key, image in rendered.items():
+            images[key] = image
+            if cache is not None and not isinstance(image, Exception):
+                cache.put(key, image)
+        return [images[key] for key in keys]
+
+    def close(self) -> None:
+        """
+        Shuts down the worker processes.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def benchmark_chart_rendering(charts: int = 16, dpi: int = 300, workers: Optional[List[int]] = None) -> None:
+    """
+    Prints the time to render a batch of synthetic charts with increasing numbers of worker processes.
+
+    Args:
+        charts (int): Number of charts in the batch.
+        dpi (int): Resolution of the images.
+        workers (list): Worker counts to time, powers of two up to the CPU count by default.
+    """
+    if workers is None:
+        workers, count = [], 1
+        while count <= (os.cpu_count() or 1):
+            workers.append(count)
+            count *= 2
+    jobs = []
+    for i in range(charts):
+        data = pd.DataFrame({"Country": [f"Country {j}" for j in range(CHART_MAX_ROWS)],
+                             "total_sales": [float((i + 1) * (j + 1)) for j in range(CHART_MAX_ROWS)]})
+        spec = build_chart_spec(data, f"Total sales per country #{i}")
+        jobs.append((chart_data(data, spec), spec))
+
+    baseline = None
+    for count in workers:
+        pool = ChartRenderPool(count)
+        try:
+            # The first batch starts the worker processes, only the second one is timed
+            pool.render_many(jobs[:count], dpi=dpi)
+            start = time.perf_counter()
+            pool.render_many(jobs, dpi=dpi)
+            elapsed = time.perf_counter() - start
+        finally:
+            pool.close()
+        baseline = baseline or elapsed
+        print(f"workers: {count} | {charts} charts in {elapsed:.2f}s | {charts / elapsed:.1f} charts/s"
+              f" | speedup: {baseline / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the chart rendering process pool")
+    parser.add_argument("--charts", type=int, default=16, help="Number of charts rendered per run")
+    parser.add_argument("--dpi", type=int, default=300, help="Resolution of the charts")
+    parser.add_argument("--workers", type=int, nargs="+", default=None, help="Worker counts to benchmark")
+    args = parser.parse_args()
+    benchmark_chart_rendering(args.charts, args.dpi, args.workers)
@@ -1,4 +1,88 @@
+import os
+
 URL: str = "https://archive.ics.uci.edu/ml/machine-learning-databases/00352/Online%20Retail.xlsx"
 FILE_NAME: str = "retail_data.csv"
 DATABASE_NAME: str = "sales"
-TABLE_NAME: str = "sales_data"
\ No newline at end of file
+TABLE_NAME: str = "sales_data"
+MAX_CONCURRENT_QUERIES: int = 4
+SQL_CACHE_NAME: str = "sql_cache"
+SQL_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+SQL_CACHE_MAX_ENTRIES: int = 1000
+LLM_MODEL_NAME: str = "gpt-5-mini"
+CHART_DPI: int = 300
+DUCKDB_THREADS: int | None = None
+DUCKDB_MEMORY_LIMIT: str | None = None
+# How long a reader waits for a loader holding the write lock of the database file before failing
+DUCKDB_LOCK_WAIT_SECONDS: float = 30.0
+# "duckdb" queries db/sales.duckdb, "parquet" queries its Hive-partitioned Parquet export in db/parquet
+STORAGE_BACKEND: str = "duckdb"
+PARQUET_STORAGE_FOLDER: str = "parquet"
+PARQUET_PARTITION_BY_COUNTRY: bool = False
+# Columns added to the Parquet export of the sales table as its Hive partitions, with the expression they hold
+PARQUET_PARTITION_COLUMNS: dict = {"InvoiceYear": "YEAR(InvoiceDate)", "InvoiceMonth": "MONTH(InvoiceDate)"}
+# Exported versions kept, at least 2 so queries still running on the previous version can finish
+PARQUET_KEEP_VERSIONS: int = 2
+EXCEL_CHUNK_ROWS: int = 50000
+LOAD_MODES: tuple = ("create", "replace", "append", "upsert")
+LOAD_METADATA_TABLE: str = "load_metadata"
+UPSERT_KEY_COLUMNS: list = ["InvoiceNo", "StockCode"]
+WATERMARK_COLUMN: str = "InvoiceDate"
+ROLLUP_METADATA_TABLE: str = "rollup_metadata"
+USE_ROLLUPS: bool = True
+# Multi-query reports plan the SQL of all their requests in one LLM call and share the scans of common groupings
+BATCH_PLANNING: bool = True
+SHARED_SCAN_MIN_QUERIES: int = 2
+RESULT_CACHE_FOLDER: str = "result_cache"
+RESULT_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+CHART_FORMAT: str = "png"
+CHART_DRAFT_DPI: int = 100
+CHART_MAX_ROWS: int = 10
+CHART_MAX_POINTS: int = 1000
+CHART_CACHE_MAX_ENTRIES: int = 128
+CHART_WORKERS: int = min(4, os.cpu_count() or 1)
+CHART_POOL_START_METHOD: str = "spawn"
+REPORT_TABLE_ROWS: int = 10
+REPORT_FORMATS: tuple = ("markdown",)
+SCHEMA_MAX_DISTINCT_VALUES: int = 50
+SCHEMA_MAX_TABLES: int = 3
+SCHEMA_MAX_COLUMNS: int = 30
+# Request words mapped to the column name words they refer to
+SCHEMA_SYNONYMS: dict = {
+    "sale": ["quantity", "price"],
+    "revenue": ["quantity", "price"],
+    "product": ["description", "stock"],
+    "item": ["description", "stock"],
+    "customer": ["customer"],
+    "client": ["customer"],
+    "order": ["invoice"],
+    "day": ["date"],
+    "week": ["date"],
+    "month": ["date"],
+    "year": ["date"],
+}
+SQL_MAX_ATTEMPTS: int = 3
+SQL_ROW_CAP: int | None = 100000
+# "preview" keeps the full result in DuckDB and only fetches its first rows, "full" fetches every row
+RESULT_MODE: str = "preview"
+RESULT_PREVIEW_ROWS: int = 1000
+SUMMARY_MAX_VALUES: int = 10
+LLM_RATE_PER_SECOND: float = 2.0
+LLM_BURST: float = 5
+LLM_MAX_RETRIES: int = 5
+LLM_BACKOFF_BASE_SECONDS: float = 0.5
+LLM_BACKOFF_MAX_SECONDS: float = 30.0
+LLM_TIMEOUT_SECONDS: float = 60.0
+LLM_MAX_CONNECTIONS: int = 20
+# JSON lines file receiving one record per workflow node and PDF step, None disables tracing
+TRACE_FILE: str | None = None
+TRACE_IN_REPORT: bool = False
+TRACE_MEMORY: bool = False
+BENCHMARK_ROWS: tuple = (1_000_000,)
+BENCHMARK_QUERY_COUNTS: tuple = (1, 10, 100)
+BENCHMARK_FOLDER: str = "benchmarks"
+SERVER_HOST: str = "127.0.0.1"
+SERVER_PORT: int = 8000
+SERVER_WORKERS: int = 2
+JOB_QUEUE_NAME: str = "report_jobs"
+JOB_POLL_SECONDS: float = 1.0
+JOB_RETENTION_SECONDS: int = 7 * 24 * 60 * 60
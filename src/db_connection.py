@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from typing import Optional
+
+import duckdb
+from config import DATABASE_NAME, DUCKDB_THREADS, DUCKDB_MEMORY_LIMIT, DUCKDB_LOCK_WAIT_SECONDS, STORAGE_BACKEND
+
+
+def get_database_path(database_name: str = DATABASE_NAME) -> str:
+    """
+    Returns the path of the DuckDB database file, creating the 'db' folder if needed.
+
+    Args:
+        database_name (str): Name of the DuckDB database (without extension).
+    Returns:
+        str: Path of the database file.
+    """
+    db_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db')
+    os.makedirs(db_folder, exist_ok=True)
+    return os.path.join(db_folder, f"{database_name}.duckdb")
+
+
+class DuckDBConnectionManager:
+    """
+    Opens the DuckDB database once and hands out one cursor per thread.
+
+    The database is opened in read-only mode by default, so several report
+    processes can query the same file without fighting over the write lock,
+    and every query reuses the cursor of its thread instead of reconnecting.
+    Even a read-only connection keeps a loader from taking the write lock of
+    the file, so long-lived users call `refresh()` whenever no query runs:
+    the file is closed and reopened by the next `cursor()` call, which also
+    makes the newly loaded data visible.
+
+    With the 'parquet' storage backend the tables are views over the Parquet
+    export in an in-memory database instead (see `parquet_storage`): no
+    database file is locked, and a newly published export is attached to a
+    new in-memory database by the next `cursor()` call, so queries still
+    running on the previous version are not affected by the switch.
+    """
+
+    def __init__(self,
+                 db_path: Optional[str] = None,
+                 read_only: bool = True,
+                 threads: Optional[int] = DUCKDB_THREADS,
+                 memory_limit: Optional[str] = DUCKDB_MEMORY_LIMIT,
+                 storage: str = STORAGE_BACKEND,
+                 parquet_folder: Optional[str] = None,
+                 lock_wait_seconds: float = DUCKDB_LOCK_WAIT_SECONDS):
+        if storage not in ("duckdb", "parquet"):
+            raise ValueError(f"Unsupported storage backend '{storage}'. Supported backends: duckdb, parquet")
+        self.storage = storage
+        if storage == "duckdb":
+            self.db_path = db_path or get_database_path()
+            if read_only and not os.path.exists(self.db_path):
+                raise FileNotFoundError(
+                    f"DuckDB database not found at {self.db_path}. Run extract_and_write_data.py first."
+                )
+
+        config = {}
+        if threads is not None:
+            config['threads'] = threads
+        if memory_limit is not None:
+            config['memory_limit'] = memory_limit
+
+        self.read_only = read_only
+        self.lock_wait_seconds = lock_wait_seconds
+        self._config = config
+        self._local = threading.local()
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        # Incremented by refresh() and by a Parquet version switch, so threads drop the cursors of a replaced connection
+        self._generation = 0
+        if storage == "parquet":
+            from parquet_storage import get_parquet_folder
+
+            self.parquet_folder = parquet_folder or get_parquet_folder()
+            # The database the export was taken from, only read to warn about a stale export
+            self.source_db_path = db_path or get_database_path()
+            self._conn = None
+            self.parquet_version = None
+            self._attach_parquet()
+        else:
+            self._conn = self._open()
+
+    def _open(self) -> duckdb.DuckDBPyConnection:
+        # A loader holds the write lock for the duration of its transaction, wait for it to finish
+        deadline = time.monotonic() + self.lock_wait_seconds
+        while True:
+            try:
+                return duckdb.connect(database=self.db_path, read_only=self.read_only, config=self._config)
+            except duckdb.IOException as e:
+                if "lock" not in str(e).lower() or time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _attach_parquet(self) -> None:
+        from parquet_storage import MANIFEST_FILE, attach_parquet_storage, current_version, stale_export_warning
+
+        if current_version(self.parquet_folder) == self.parquet_version:
+            return
+        with self._lock:
+            if self._closed or current_version(self.parquet_folder) == self.parquet_version:
+                return
+            # The views of the new version are created in a new in-memory database instead of being
+            # replaced under the queries running on the cursors of the previous one, which keep it open
+            conn = duckdb.connect(database=":memory:", config=self._config)
+            manifest = attach_parquet_storage(conn, self.parquet_folder)
+            self._conn = conn
+            self._generation += 1
+            self.parquet_version = manifest['version']
+            # The manifest versions the data when the export has no load metadata
+            self.db_path = os.path.join(self.parquet_folder, self.parquet_version, MANIFEST_FILE)
+        warning = stale_export_warning(manifest, self.source_db_path)
+        if warning:
+            print(warning)
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """
+        Returns the cursor of the calling thread, creating it on first use.
+
+        Returns:
+            duckdb.DuckDBPyConnection: Cursor sharing the open database.
+        """
+        if self.storage == "parquet" and not self._closed:
+            self._attach_parquet()
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None or self._local.generation != self._generation:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("The DuckDB connection manager is closed.")
+                if self._conn is None:
+                    self._conn = self._open()
+                # Cursors of finished threads (e.g. of a previous worker pool) are released
+                for thread in [thread for thread in self._cursors if not thread.is_alive()]:
+                    self._cursors.pop(thread).close()
+                previous = self._cursors.pop(threading.current_thread(), None)
+                if previous is not None:
+                    # Cursor of the connection replaced by a Parquet version switch
+                    previous.close()
+                cursor = self._conn.cursor()
+                self._cursors[threading.current_thread()] = cursor
+                self._local.generation = self._generation
+            self._local.cursor = cursor
+        return cursor
+
+    def refresh(self) -> None:
+        """
+        Closes the database file until the next `cursor()` call, so loaders can
+        write to it and the next queries see their data.
+
+        Every cursor handed out is closed, so it must only be called while no
+        query runs. With the 'parquet' storage backend nothing is locked and
+        the in-memory database is kept, only a newly published export is attached.
+        """
+        if self.storage == "parquet":
+            if not self._closed:
+                self._attach_parquet()
+            return
+        with self._lock:
+            if self._closed or self._conn is None:
+                return
+            for cursor in self._cursors.values():
+                cursor.close()
+            self._cursors.clear()
+            self._conn.close()
+            self._conn = None
+            self._generation += 1
+
+    def close(self) -> None:
+        """
+        Closes every cursor handed out and the database connection.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for cursor in self._cursors.values():
+                cursor.close()
+            self._cursors.clear()
+            if self._conn is not None:
+                self._conn.close()
+
+    def __enter__(self) -> "DuckDBConnectionManager":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -3,9 +3,17 @@ import requests
 from io import BytesIO
 from tqdm import tqdm
 import argparse
+import csv
 import duckdb
 import os
-from config import URL, FILE_NAME, DATABASE_NAME, TABLE_NAME
+import sys
+import time
+from urllib.parse import urlparse, unquote
+from config import URL, FILE_NAME, DATABASE_NAME, TABLE_NAME, DUCKDB_THREADS, DUCKDB_MEMORY_LIMIT, EXCEL_CHUNK_ROWS
+from config import LOAD_MODES, LOAD_METADATA_TABLE, UPSERT_KEY_COLUMNS, WATERMARK_COLUMN, STORAGE_BACKEND
+from db_connection import get_database_path
+from rollups import build_rollups, refresh_rollups, rollups_supported
+from parquet_storage import export_to_parquet
 
 def download_online_retail_data(url: str = None) -> pd.DataFrame:
     """
@@ -41,7 +49,10 @@ def download_online_retail_data(url: str = None) -> pd.DataFrame:
 
 def save_as_duckdb_table(df: pd.DataFrame, 
                          database_name:str = DATABASE_NAME,
-                         table_name: str = TABLE_NAME) -> None:
+                         table_name: str = TABLE_NAME,
+                         mode: str = "create",
+                         key_columns: list = UPSERT_KEY_COLUMNS,
+                         watermark_column: str = WATERMARK_COLUMN) -> int:
     """
     Save a DataFrame as a DuckDB table.
     
@@ -49,37 +60,382 @@ def save_as_duckdb_table(df: pd.DataFrame,
         df (pd.DataFrame): Data to save.
         database_name (str): Name of the DuckDB database (without extension).
         table_name (str): Name of the table to create.
+        mode (str): Load mode, one of LOAD_MODES (see `write_to_table`).
+        key_columns (list): Key columns used by the 'upsert' mode.
+        watermark_column (str): Column holding the high-water mark used by the 'append' mode.
     Returns:
-        duckdb.DuckDBPyConnection: Connection to the DuckDB database.
+        int: Number of rows written.
     """
-    # Ensure parent 'db' folder exists
-    db_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db')
-    os.makedirs(db_folder, exist_ok=True)
-    db_path = os.path.join(db_folder, f"{database_name}.duckdb")
-    conn = duckdb.connect(database=db_path)
-    conn.execute(f"CREATE TABLE {table_name} AS SELECT * FROM df")
-    conn.close()
+    conn = connect_for_ingest(database_name)
+    try:
+        conn.register("incoming_df", df)
+        return write_to_table(conn, "incoming_df", table_name, mode, key_columns, watermark_column,
+                              source="DataFrame")
+    finally:
+        conn.close()
 
-    return None
 
+def connect_for_ingest(database_name: str = DATABASE_NAME) -> duckdb.DuckDBPyConnection:
+    """
+    Opens a read-write connection to the DuckDB database with the configured threads/memory limit.
+    """
+    config = {}
+    if DUCKDB_THREADS is not None:
+        config['threads'] = DUCKDB_THREADS
+    if DUCKDB_MEMORY_LIMIT is not None:
+        config['memory_limit'] = DUCKDB_MEMORY_LIMIT
+    return duckdb.connect(database=get_database_path(database_name), config=config)
+
+
+def table_exists(conn: duckdb.DuckDBPyConnection, table_name: str) -> bool:
+    """
+    Checks whether a table exists in the DuckDB database.
+    """
+    return conn.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [table_name]
+    ).fetchone()[0] > 0
+
+
+def record_load(conn: duckdb.DuckDBPyConnection,
+                table_name: str,
+                mode: str,
+                source: str,
+                rows_loaded: int,
+                watermark_column: str) -> int:
+    """
+    Stores the bookkeeping information of a load in the load metadata table.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        table_name (str): Name of the loaded table.
+        mode (str): Load mode used.
+        source (str): File or object the data came from.
+        rows_loaded (int): Number of rows written by the load.
+        watermark_column (str): Column holding the high-water mark of the table.
+    Returns:
+        int: Identifier of the load.
+    """
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {LOAD_METADATA_TABLE} (
+            load_id BIGINT,
+            table_name VARCHAR,
+            mode VARCHAR,
+            source VARCHAR,
+            rows_loaded BIGINT,
+            total_rows BIGINT,
+            high_water_mark VARCHAR,
+            loaded_at TIMESTAMP
+        )
+        """
+    )
+    load_id = conn.execute(f"SELECT COALESCE(MAX(load_id), 0) + 1 FROM {LOAD_METADATA_TABLE}").fetchone()[0]
+    total_rows = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    columns = [row[0] for row in conn.execute(f"DESCRIBE {table_name}").fetchall()]
+    high_water_mark = None
+    if watermark_column in columns:
+        high_water_mark = conn.execute(f"SELECT CAST(MAX({watermark_column}) AS VARCHAR) FROM {table_name}").fetchone()[0]
+    conn.execute(
+        f"INSERT INTO {LOAD_METADATA_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, current_localtimestamp())",
+        [load_id, table_name, mode, source, rows_loaded, total_rows, high_water_mark],
+    )
+    return load_id
+
+
+def write_to_table(conn: duckdb.DuckDBPyConnection,
+                   source_relation: str,
+                   table_name: str = TABLE_NAME,
+                   mode: str = "create",
+                   key_columns: list = UPSERT_KEY_COLUMNS,
+                   watermark_column: str = WATERMARK_COLUMN,
+                   source: str = "") -> int:
+    """
+    Write the rows of a DuckDB relation into a table according to the load mode.
+
+    Modes:
+        - create: create the table, fails if it already exists.
+        - replace: replace the table with the new rows.
+        - append: insert only rows newer than the high-water mark (max of `watermark_column`).
+        - upsert: replace the rows whose `key_columns` appear in the new rows and insert the others.
+          The keys do not need to be unique (an invoice can list the same StockCode
+          twice): every existing row of a key is replaced by all the new rows of that
+          key, and NULL key values match each other.
+    'append' and 'upsert' create the table when it does not exist yet. Every load
+    is recorded in the load metadata table and the rollup tables of the sales
+    table are kept up to date in the same transaction.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        source_relation (str): SQL relation with the new rows (table, view or table function).
+        table_name (str): Name of the target table.
+        mode (str): Load mode, one of LOAD_MODES.
+        key_columns (list): Key columns used by the 'upsert' mode.
+        watermark_column (str): Column holding the high-water mark used by the 'append' mode.
+        source (str): Description of the data source, stored in the load metadata.
+    Returns:
+        int: Number of rows written.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unsupported load mode '{mode}'. Supported modes: {', '.join(LOAD_MODES)}")
+
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        high_water_mark = None
+        if mode == "create" or (mode in ("append", "upsert") and not table_exists(conn, table_name)):
+            conn.execute(f"CREATE TABLE {table_name} AS SELECT * FROM {source_relation}")
+            rows_loaded = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        elif mode == "replace":
+            conn.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM {source_relation}")
+            rows_loaded = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        elif mode == "append":
+            high_water_mark = conn.execute(f"SELECT MAX({watermark_column}) FROM {table_name}").fetchone()[0]
+            if high_water_mark is None:
+                rows_loaded = conn.execute(
+                    f"INSERT INTO {table_name} BY NAME SELECT * FROM {source_relation}"
+                ).fetchone()[0]
+            else:
+                rows_loaded = conn.execute(
+                    f"INSERT INTO {table_name} BY NAME SELECT * FROM {source_relation} WHERE {watermark_column} > ?",
+                    [high_water_mark],
+                ).fetchone()[0]
+        else:
+            # IS NOT DISTINCT FROM also matches NULL keys, which a plain IN/= comparison never does
+            keys = ", ".join(key_columns)
+            matches = " AND ".join(f"{table_name}.{key} IS NOT DISTINCT FROM incoming.{key}" for key in key_columns)
+            conn.execute(
+                f"DELETE FROM {table_name} USING (SELECT DISTINCT {keys} FROM {source_relation}) AS incoming "
+                f"WHERE {matches}"
+            )
+            rows_loaded = conn.execute(
+                f"INSERT INTO {table_name} BY NAME SELECT * FROM {source_relation}"
+            ).fetchone()[0]
+
+        load_id = record_load(conn, table_name, mode, source, rows_loaded, watermark_column)
+        if table_name == TABLE_NAME and rollups_supported(conn, table_name):
+            # Appends only touch the periods after the previous high-water mark
+            if mode == "append" and high_water_mark is not None and watermark_column == "InvoiceDate":
+                refresh_rollups(conn, high_water_mark, table_name, load_id)
+            else:
+                build_rollups(conn, table_name, load_id)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows_loaded
+
+
+def get_data_folder() -> str:
+    """
+    Returns the 'data' folder for raw and converted files, creating it if needed.
+    """
+    data_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+    os.makedirs(data_folder, exist_ok=True)
+    return data_folder
+
+
+def download_to_spool_file(url: str, spool_path: str = None) -> str:
+    """
+    Stream a file from a URL to a local spool file, without holding it in memory.
+
+    Args:
+        url (str): The URL to download the data from.
+        spool_path (str): Path of the local file, by default the URL file name in the 'data' folder.
+    Returns:
+        str: Path of the downloaded file.
+    """
+    if spool_path is None:
+        spool_path = os.path.join(get_data_folder(), unquote(os.path.basename(urlparse(url).path)))
+
+    resp = requests.get(url, stream=True)
+    resp.raise_for_status()
+    total = int(resp.headers.get("content-length", 0))
+
+    chunk_size = 1024 * 1024
+    tmp_path = f"{spool_path}.part"
+    with open(tmp_path, "wb") as f, tqdm(total=total, unit="B", unit_scale=True, desc="downloading...") as pbar:
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+            pbar.update(len(chunk))
+    # Only complete downloads replace the spool file
+    os.replace(tmp_path, spool_path)
+    return spool_path
+
+
+def convert_excel_to_csv(excel_path: str, csv_path: str, chunk_rows: int = EXCEL_CHUNK_ROWS) -> int:
+    """
+    Convert an Excel workbook to CSV sheet by sheet, streaming the rows.
+
+    The first sheet defines the header; other sheets with the same header are
+    appended, sheets with a different header are skipped.
+
+    Args:
+        excel_path (str): Path of the .xlsx file.
+        csv_path (str): Path of the CSV file to write.
+        chunk_rows (int): Number of rows written at a time.
+    Returns:
+        int: Number of data rows written.
+    """
+    from openpyxl import load_workbook
+
+    # read_only mode parses the sheets lazily instead of loading the whole workbook
+    workbook = load_workbook(excel_path, read_only=True, data_only=True)
+    header = None
+    num_rows = 0
+    try:
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            for sheet in workbook.worksheets:
+                rows = sheet.iter_rows(values_only=True)
+                sheet_header = next(rows, None)
+                if sheet_header is None:
+                    continue
+                if header is None:
+                    header = sheet_header
+                    writer.writerow(header)
+                elif sheet_header != header:
+                    print(f"Skipping sheet '{sheet.title}': its columns differ from the first sheet")
+                    continue
+
+                chunk = []
+                for row in tqdm(rows, desc=f"converting sheet '{sheet.title}'...", unit=" rows"):
+                    chunk.append(row)
+                    if len(chunk) >= chunk_rows:
+                        writer.writerows(chunk)
+                        num_rows += len(chunk)
+                        chunk = []
+                writer.writerows(chunk)
+                num_rows += len(chunk)
+    finally:
+        workbook.close()
+    return num_rows
+
+
+def load_file_into_duckdb(file_path: str,
+                          conn: duckdb.DuckDBPyConnection,
+                          table_name: str = TABLE_NAME,
+                          mode: str = "create",
+                          key_columns: list = UPSERT_KEY_COLUMNS,
+                          watermark_column: str = WATERMARK_COLUMN) -> int:
+    """
+    Load a CSV or Parquet file into a DuckDB table with DuckDB's native readers,
+    so the data never goes through pandas.
+
+    Args:
+        file_path (str): Path of the .csv or .parquet file.
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        table_name (str): Name of the target table.
+        mode (str): Load mode, one of LOAD_MODES (see `write_to_table`).
+        key_columns (list): Key columns used by the 'upsert' mode.
+        watermark_column (str): Column holding the high-water mark used by the 'append' mode.
+    Returns:
+        int: Number of rows written.
+    """
+    path_literal = "'" + file_path.replace("'", "''") + "'"
+    if file_path.endswith(".csv"):
+        # A full sample avoids wrong type guesses on columns such as InvoiceNo ('C536379')
+        source_relation = f"read_csv({path_literal}, header = true, sample_size = -1)"
+    elif file_path.endswith(".parquet"):
+        source_relation = f"read_parquet({path_literal})"
+    else:
+        raise ValueError("Unsupported file format. Supported formats: .csv, .parquet")
+    return write_to_table(conn, source_relation, table_name, mode, key_columns, watermark_column,
+                          source=file_path)
+
+
+def stream_ingest(url: str,
+                  saved_file_name: str = FILE_NAME,
+                  database_name: str = DATABASE_NAME,
+                  table_name: str = TABLE_NAME,
+                  mode: str = "create",
+                  key_columns: list = UPSERT_KEY_COLUMNS,
+                  watermark_column: str = WATERMARK_COLUMN) -> int:
+    """
+    Download a dataset to a spool file and load it into DuckDB with bounded memory.
+
+    Excel files are first converted to CSV (saved as `saved_file_name` in the
+    'data' folder); CSV and Parquet files are loaded directly.
+
+    Args:
+        url (str): The URL to download the data from.
+        saved_file_name (str): Name of the CSV file written when converting Excel files.
+        database_name (str): Name of the DuckDB database (without extension).
+        table_name (str): Name of the target table.
+        mode (str): Load mode, one of LOAD_MODES (see `write_to_table`).
+        key_columns (list): Key columns used by the 'upsert' mode.
+        watermark_column (str): Column holding the high-water mark used by the 'append' mode.
+    Returns:
+        int: Number of rows written.
+    """
+    if not url.endswith((".xlsx", ".xls", ".csv", ".parquet")):
+        raise ValueError("Unsupported file format. Supported formats: .csv, .xlsx, .xls, .parquet")
+    spool_path = download_to_spool_file(url)
+
+    if spool_path.endswith((".xlsx", ".xls")):
+        if spool_path.endswith(".xls"):
+            raise ValueError("Streaming ingestion of .xls files is not supported, use --in_memory")
+        csv_path = os.path.join(get_data_folder(), saved_file_name)
+        convert_excel_to_csv(spool_path, csv_path)
+        spool_path = csv_path
+
+    conn = connect_for_ingest(database_name)
+    try:
+        return load_file_into_duckdb(spool_path, conn, table_name, mode, key_columns, watermark_column)
+    finally:
+        conn.close()
+
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident set size of the process in MB.
+    """
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
 
 
 def main():
     """
     Main entry point: parses arguments, downloads data, saves to DuckDB.
     
-    Inputs: command-line arguments --url and --saved_file_name
+    Inputs: command-line arguments --url, --saved_file_name, --mode, --key_columns,
+            --watermark_column, --in_memory, --profile and --parquet
     Outputs: Prints confirmation and creates DuckDB table from downloaded data
     """
     parser = argparse.ArgumentParser(description="Download online retail dataset")
     parser.add_argument("--url", default=URL, help="Dataset URL")
     parser.add_argument("--saved_file_name", default=FILE_NAME, help="File name to be written with format e.g: data.csv")
+    parser.add_argument("--mode", default="create", choices=LOAD_MODES,
+                        help="create a new table, replace it, append rows newer than the high-water mark or upsert on key columns")
+    parser.add_argument("--key_columns", nargs="+", default=UPSERT_KEY_COLUMNS, help="Key columns used by --mode upsert")
+    parser.add_argument("--watermark_column", default=WATERMARK_COLUMN, help="High-water mark column used by --mode append")
+    parser.add_argument("--in_memory", action="store_true", help="Load the whole dataset with pandas instead of streaming it")
+    parser.add_argument("--profile", action="store_true", help="Print the peak RSS and rows/sec of the ingestion")
+    parser.add_argument("--parquet", action="store_true", default=STORAGE_BACKEND == "parquet",
+                        help="Also export the database as Hive-partitioned Parquet for the 'parquet' storage backend")
     args = parser.parse_args()
 
-    df = download_online_retail_data(url = args.url)
-    
-    save_as_duckdb_table(df, table_name="sales_data")
-    print("DuckDB in-memory database created with table 'sales_data'")
+    start = time.perf_counter()
+    if args.in_memory:
+        df = download_online_retail_data(url = args.url)
+        num_rows = save_as_duckdb_table(df, table_name=TABLE_NAME, mode=args.mode,
+                                        key_columns=args.key_columns, watermark_column=args.watermark_column)
+    else:
+        num_rows = stream_ingest(args.url, saved_file_name=args.saved_file_name, table_name=TABLE_NAME,
+                                 mode=args.mode, key_columns=args.key_columns, watermark_column=args.watermark_column)
+    elapsed = time.perf_counter() - start
+
+    print(f"DuckDB table '{TABLE_NAME}' loaded in '{args.mode}' mode ({num_rows} rows written)")
+    if args.profile:
+        print(f"Ingestion: {elapsed:.2f}s, {num_rows / elapsed:,.0f} rows/sec, peak RSS {peak_rss_mb():.1f} MB")
+    if args.parquet:
+        conn = connect_for_ingest()
+        try:
+            manifest = export_to_parquet(conn)
+        finally:
+            conn.close()
+        print(f"Parquet version {manifest['version']} exported, partitioned by {', '.join(manifest['partition_by'])}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,64 +1,57 @@
 
 import os
+import atexit
 import argparse
+from typing import TYPE_CHECKING
 
-import pandas as pd
-from dotenv import load_dotenv
-from langchain_openai.chat_models import ChatOpenAI
-from langgraph.graph import StateGraph, START, END
-from workflow_functions import (
-    parse_user_request,
-    connect_and_execute_sql_query,
-    generate_visualization,
-    generate_report,
-    State
-)
+from llm_client import FakeLLM
+from config import CHART_FORMAT, CHART_DPI, CHART_DRAFT_DPI, REPORT_FORMATS, STORAGE_BACKEND
+
+if TYPE_CHECKING:
+    # The workflow and its dependencies are only imported once a report is generated, so --help stays fast
+    from workflow_functions import State
+    from report_engine import ReportEngine
 
 user_request = "Show me the total Quantity per country"
 
-load_dotenv()
+_engine = None
 
-os.environ["OPENAI_API_KEY"] = os.getenv('OPENAI_API_KEY')
 
-llm = ChatOpenAI(model_name="gpt-5-mini", temperature=0)
+def get_report_engine(llm=None, **engine_options) -> "ReportEngine":
+    """
+    Returns the shared report engine, creating it on first use.
 
+    Args:
+        llm: LLM client of the engine when it is created (e.g. a FakeLLM), the OpenAI model by default.
+        **engine_options: Other ReportEngine arguments used when it is created (e.g. trace_path).
+    Returns:
+        ReportEngine: Engine holding the compiled workflow and shared resources.
+    """
+    global _engine
+    if _engine is None:
+        from report_engine import ReportEngine
+        _engine = ReportEngine(llm=llm, **engine_options)
+        atexit.register(_engine.close)
+    return _engine
 
 
-def generate_business_report(user_request: str) -> State:
+def generate_business_report(user_request: str, use_sql_cache: bool = True, use_result_cache: bool = True,
+                             chart_config: dict = None, report_formats: list = None) -> "State":
     """
     Generate a business report based on a user request.
     
     Args:
         user_request (str): The user's natural language request.
+        use_sql_cache (bool): Reuse the SQL cached for the same request instead of calling the LLM.
+        use_result_cache (bool): Reuse the cached result of the same SQL on the same data.
+        chart_config (dict): Overrides of the chart settings (dpi, format, figsize).
+        report_formats (list): Text formats of the report ('markdown', 'html'), REPORT_FORMATS by default.
     Returns:
         State: The final state containing the report and other details.
     """
-
-    workflow = StateGraph(State)
-    workflow.add_node("parse_user_request", parse_user_request)
-    workflow.add_node("connect_and_execute_sql_query", connect_and_execute_sql_query)
-    workflow.add_node("generate_visualization", generate_visualization)
-    workflow.add_node("generate_report", generate_report)
-
-    workflow.add_edge(START, "parse_user_request")
-    workflow.add_edge("parse_user_request", "connect_and_execute_sql_query")
-    workflow.add_edge("connect_and_execute_sql_query", "generate_visualization")
-    workflow.add_edge("generate_visualization", "generate_report")
-    workflow.add_edge("generate_report", END)
-
-    app = workflow.compile()
-
-    initial_state: State = {
-        "user_request": user_request,
-        "llm": llm,
-        "sql_query": "",
-        "query_result": pd.DataFrame(),
-        "report": "",
-        "visualization": None,
-        "errors": []
-    }
-
-    final_state = app.invoke(initial_state)
+    final_state = get_report_engine().run(user_request, use_sql_cache=use_sql_cache,
+                                          use_result_cache=use_result_cache, chart_config=chart_config,
+                                          report_formats=report_formats)
     print(f"Errors processing the request {user_request}: {final_state['errors']}")
     return final_state
 
@@ -66,5 +59,41 @@ def generate_business_report(user_request: str) -> State:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate_business_report")
     parser.add_argument("--user_request", default=user_request, help="User request for the business report")
+    parser.add_argument("--no_sql_cache", action="store_true", help="Always ask the LLM for a new SQL query")
+    parser.add_argument("--no_result_cache", action="store_true", help="Always execute the SQL query against DuckDB")
+    parser.add_argument("--chart_format", default=CHART_FORMAT, choices=["png", "svg"], help="Format of the chart image")
+    parser.add_argument("--draft", action="store_true", help="Render the chart at the draft resolution")
+    parser.add_argument("--report_format", nargs="*", default=list(REPORT_FORMATS), choices=["markdown", "html"],
+                        help="Text formats of the report saved in /reports")
+    parser.add_argument("--export", default=None,
+                        help="Also export every row of the result to this Parquet or CSV file")
+    parser.add_argument("--fake_llm", action="store_true", help="Generate the SQL offline with the fake LLM")
+    parser.add_argument("--trace", default=None, help="Append a JSON line per workflow step to this file")
+    parser.add_argument("--trace_in_report", action="store_true", help="Append the run trace table to the report")
+    parser.add_argument("--storage", default=STORAGE_BACKEND, choices=["duckdb", "parquet"],
+                        help="Query the DuckDB file or its Parquet export")
     args = parser.parse_args()
-    generate_business_report(args.user_request)
\ No newline at end of file
+    get_report_engine(FakeLLM() if args.fake_llm else None, trace_path=args.trace,
+                      trace_in_report=args.trace_in_report, storage=args.storage)
+    state = generate_business_report(args.user_request,
+                                     use_sql_cache=not args.no_sql_cache,
+                                     use_result_cache=not args.no_result_cache,
+                                     chart_config={"format": args.chart_format,
+                                                   "dpi": CHART_DRAFT_DPI if args.draft else CHART_DPI},
+                                     report_formats=args.report_format)
+    reports_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'reports')
+    os.makedirs(reports_folder, exist_ok=True)
+    for report_format, report in (state.get('reports') or {}).items():
+        report_path = os.path.join(reports_folder, f"report.{'md' if report_format == 'markdown' else report_format}")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(report)
+        print(f"Report saved as {report_path}")
+    if state.get('visualization') is not None:
+        chart_path = os.path.join(reports_folder, f"visualization.{state['visualization_format']}")
+        with open(chart_path, "wb") as f:
+            f.write(state['visualization'])
+        print(f"Visualization saved as {chart_path}")
+    if args.export and not state['errors']:
+        print(f"Full result exported to {get_report_engine().export(state['sql_query'], args.export)}")
+    print(f"SQL cache: {get_report_engine().sql_cache.stats()}")
+    print(f"Result cache: {get_report_engine().result_cache.stats()}")
\ No newline at end of file
@@ -1,58 +1,75 @@
 
 import os
+import hashlib
 import argparse
+from contextlib import nullcontext
+import time
 
-import matplotlib
-matplotlib.use('Agg')  # Use o backend Agg para evitar problemas com o display
-import matplotlib.pyplot as plt
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-import io
-import re
-from reportlab.platypus import Image as ReportLabImage
-
-import pandas as pd
-from dotenv import load_dotenv
-from langchain_openai.chat_models import ChatOpenAI
-from langgraph.graph import StateGraph, START, END
-from workflow_functions import (
-    parse_user_request,
-    connect_and_execute_sql_query,
-    generate_visualization,
-    generate_report,
-    State
-)
-from generate_business_report import generate_business_report
+# ReportLab and the workflow are imported by the functions that use them, so --help stays fast
+from generate_business_report import get_report_engine
+from llm_client import FakeLLM
+from config import MAX_CONCURRENT_QUERIES, CHART_DPI, CHART_DRAFT_DPI, STORAGE_BACKEND, BATCH_PLANNING
 
 user_request = ["Show me the total Quantity per country", "Show me the total sales per month", "Which are the top 10 countries by sales?"]
 
-load_dotenv()
 
-os.environ["OPENAI_API_KEY"] = os.getenv('OPENAI_API_KEY')
+def add_query_section(elements, index, query, state, styles):
+    """
+    Appends the PDF flowables of a single query to the report elements.
 
-llm = ChatOpenAI(model_name="gpt-5-mini", temperature=0)
+    Args:
+        elements (list): List of flowables of the PDF document.
+        index (int): Position of the query in the report.
+        query (str): Query in natural language.
+        state (State): Final state of the query workflow, holding its report model.
+        styles (StyleSheet1): ReportLab styles used in the document.
+    """
+    from report_renderers import render_pdf_section
 
+    elements.extend(render_pdf_section(state['report_model'], index, styles))
 
 
-def generate_multi_query_report(queries, filename="Report_multiple_queries.pdf", title="Consolidated Analytical Report"):
+def pdf_span(engine, name, **fields):
     """
-    Generates a PDF report containing multiple queries and their visualizations.
-    
+    Returns a span of the engine tracer around a PDF assembly step, or a no-op context without tracer.
+    """
+    return engine.tracer.span(name, **fields) if engine.tracer is not None else nullcontext({})
+
+
+def plan_queries(engine, queries, use_result_cache, batch_plan):
+    """
+    Plans the SQL and shared scans of the queries in one pass, or returns None when batch planning is off.
+    """
+    if not batch_plan or len(queries) < 2:
+        return None
+    plan = engine.plan_batch(queries, use_result_cache=use_result_cache)
+    print(plan.describe())
+    return plan
+
+
+def build_multi_query_report(queries, pdf_path, title, max_workers, engine, use_result_cache, draft, chart_workers,
+                             batch_plan=BATCH_PLANNING):
+    """
+    Runs every query and builds the PDF in one pass once all of them have completed.
+
     Args:
         queries (list): List of strings with queries in natural language.
-        filename (str): Name of the PDF file to be generated.
+        pdf_path (str): Path of the PDF file.
         title (str): Main title of the report.
-    
+        max_workers (int): Maximum number of queries processed at the same time.
+        engine (ReportEngine): Engine used to run the queries.
+        use_result_cache (bool): Reuse the cached results of queries already executed on the same data.
+        draft (bool): Render the charts at the draft resolution instead of the print resolution.
+        chart_workers (int): Number of processes rendering the charts, the engine's chart_workers by default.
+        batch_plan (bool): Generate the SQL of every query in one LLM call and share the scans of common groupings.
+
     Returns:
         list: List of final states for each query.
     """
-    # Create PDF document
-    pdf_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'reports')
-    os.makedirs(pdf_folder, exist_ok=True)
-    pdf_path = os.path.join(pdf_folder, filename)
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
 
     doc = SimpleDocTemplate(pdf_path, pagesize=letter)
     styles = getSampleStyleSheet()
@@ -61,10 +78,6 @@ def generate_multi_query_report(queries, filename="Report_multiple_queries.pdf",
     title_style = styles['Title']
     title_style.alignment = 1  # Centered
     
-    heading1_style = styles['Heading1']
-    heading2_style = styles['Heading2']
-    normal_style = styles['Normal']
-    
     # List of elements for the PDF
     elements = []
     
@@ -72,141 +85,27 @@ def generate_multi_query_report(queries, filename="Report_multiple_queries.pdf",
     elements.append(Paragraph(title, title_style))
     elements.append(Spacer(1, 0.5*inch))
     
-    # List to store final states
-    final_states = []
+    # Process the queries concurrently, final states keep the query order
+    # The PDF embeds PNG charts, rendered in a process pool when several chart workers are used
+    chart_workers = engine.chart_pool.workers if chart_workers is None else chart_workers
+    chart_config = {"format": "png", "dpi": CHART_DRAFT_DPI if draft else CHART_DPI, "defer": chart_workers > 1}
+    plan = plan_queries(engine, queries, use_result_cache, batch_plan)
+    final_states = engine.batch(queries, max_concurrency=max_workers, use_result_cache=use_result_cache,
+                                chart_config=chart_config, report_formats=[], plan=plan)
+    if chart_config['defer']:
+        chart_start = time.perf_counter()
+        engine.render_charts(final_states, chart_config, workers=chart_workers)
+        print(f"Charts rendered in {time.perf_counter() - chart_start:.2f}s (chart_workers={chart_workers})")
     
-    # Process each query
-    for i, query in enumerate(queries):
-        print(f"Processing query {i+1}/{len(queries)}: {query}")
-        
-        # Generate report for this query
-        state = generate_business_report(query)
-        final_states.append(state)
-        
+    for i, (query, state) in enumerate(zip(queries, final_states)):
         if state['errors']:
             print(f"Errors in query {i+1}:")
             for error in state['errors']:
                 print(f"- {error}")
             continue
-        
-        # Add section title (query number)
-        elements.append(Paragraph(f"Analysis {i+1}: {query}", heading1_style))
-        elements.append(Spacer(1, 0.25*inch))
-        
-        # Process the report
-        report_text = state['report']
-        
-        # Extract the executed SQL query
-        sql_match = re.search(r'\*\*Executed SQL query:\*\*\n```sql\n(.*?)\n```', report_text, re.DOTALL)
-        if sql_match:
-            elements.append(Paragraph("<b>Executed SQL query:</b>", normal_style))
-            sql_code = sql_match.group(1)
-            elements.append(Paragraph(f"<font face='Courier'>{sql_code}</font>", normal_style))
-            elements.append(Spacer(1, 0.1*inch))
-        
-        # Add data summary
-        elements.append(Paragraph("Data Summary", heading2_style))
-        
-        # Extract summary items
-        summary_section = re.search(r'## Data Summary\n\n(.*?)(?=\n\n##|\Z)', report_text, re.DOTALL)
-        if summary_section:
-            summary_items = re.findall(r'- (.*?)\n', summary_section.group(1))
-            for item in summary_items:
-                elements.append(Paragraph(f"• {item}", normal_style))
-        
-        elements.append(Spacer(1, 0.2*inch))
-        
-        # Add detailed data
-        elements.append(Paragraph("Detailed Data", heading2_style))
-        
-        # Extract data table
-        if state.get('query_result') is not None and not state['query_result'].empty:
-            df = state['query_result'].head(10)
-            
-            # Create table
-            table_data = [df.columns.tolist()]  # Header
-            for i, row in df.iterrows():
-                table_data.append([str(x) for x in row.tolist()])
-            
-            # Format the table
-            table = Table(table_data, repeatRows=1)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ]))
-            
-            elements.append(table)
-            
-            if len(state['query_result']) > 10:
-                elements.append(Paragraph(f"*Showing 10 of {len(state['query_result'])} records*", normal_style))
-        
-        # Add visualization created from raw data
-        if state.get('query_result') is not None and not state['query_result'].empty:
-            try:
-                elements.append(Spacer(1, 0.3*inch))
-                elements.append(Paragraph("Visualization", heading2_style))
-                
-                # Create a new figure
-                plt.figure(figsize=(10, 6))
-                
-                # Determine chart type based on report
-                df = state['query_result']
-                
-                # Limit to 10 items for better visualization
-                if len(df) > 10:
-                    df = df.head(10)
-                
-                # Determine columns for x and y
-                if len(df.columns) >= 2:
-                    x_col = df.columns[0]
-                    y_col = df.columns[1]
-                    
-                    # Check if the request suggests a specific chart type
-                    if "pizza" in query.lower() or "pie" in query.lower():
-                        plt.figure(figsize=(8, 8))
-                        plt.pie(df[y_col], labels=df[x_col], autopct='%1.1f%%')
-                        plt.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle
-                    elif "barra" in query.lower() or "bar" in query.lower():
-                        plt.bar(df[x_col], df[y_col])
-                        plt.xticks(rotation=45, ha='right')
-                    else:
-                        # Check if the data is numeric to decide chart type
-                        if df[x_col].dtype.kind in 'ifc' and df[y_col].dtype.kind in 'ifc':
-                            # Both are numeric, use scatter plot
-                            plt.scatter(df[x_col], df[y_col])
-                        else:
-                            # Use bar chart as default
-                            plt.bar(df[x_col], df[y_col])
-                            plt.xticks(rotation=45, ha='right')
-                    
-                    plt.title(query)
-                    plt.xlabel(x_col)
-                    plt.ylabel(y_col)
-                    plt.tight_layout()
-                    
-                    # Save the figure to a memory buffer
-                    img_data = io.BytesIO()
-                    plt.savefig(img_data, format='png', dpi=300)
-                    img_data.seek(0)
-                    
-                    # Create an image for ReportLab
-                    img = ReportLabImage(img_data, width=6*inch, height=4*inch)
-                    elements.append(img)
-                    
-                    # Close the figure to free memory
-                    plt.close()
-                
-            except Exception as e:
-                print(f"Error creating visualization: {str(e)}")
-                elements.append(Paragraph(f"Error adding visualization: {str(e)}", normal_style))
+
+        with pdf_span(engine, "pdf_section", section=i+1, run_id=state.get('run_id')):
+            add_query_section(elements, i, query, state, styles)
         
         # Add page break after each query (except the last)
         if i < len(queries) - 1:
@@ -214,10 +113,223 @@ def generate_multi_query_report(queries, filename="Report_multiple_queries.pdf",
     
     # Build the PDF
     try:
-        doc.build(elements)
-        print(f"Multiple report saved as {filename}")
+        with pdf_span(engine, "pdf_build", sections=len(queries)) as record:
+            doc.build(elements)
+            record["pages"] = doc.page
+        print(f"Multiple report saved as {os.path.basename(pdf_path)}")
     except Exception as e:
         print(f"Error generating PDF: {str(e)}")
+    return final_states
+
+
+def write_pdf(path, elements):
+    """
+    Builds a PDF from a list of flowables, replacing the file only once it is complete.
+
+    Args:
+        path (str): Path of the PDF file.
+        elements (list): Flowables of the document.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate
+
+    tmp_path = f"{path}.tmp"
+    SimpleDocTemplate(tmp_path, pagesize=letter).build(elements)
+    os.replace(tmp_path, path)
+
+
+def merge_pdfs(section_paths, pdf_path):
+    """
+    Concatenates PDF files into a single PDF.
+
+    pypdf keeps the page objects of the merged document in memory until it is
+    written, so the merge needs memory in proportion to the final PDF.
+
+    Args:
+        section_paths (list): Paths of the PDF files, in order.
+        pdf_path (str): Path of the merged PDF.
+    """
+    try:
+        from pypdf import PdfWriter
+    except ImportError as e:
+        raise ImportError("Merging the PDF sections requires pypdf: pip install pypdf") from e
+
+    writer = PdfWriter()
+    for section_path in section_paths:
+        writer.append(section_path)
+    tmp_path = f"{pdf_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        writer.write(f)
+    writer.close()
+    os.replace(tmp_path, pdf_path)
+
+
+def slim_state(state):
+    """
+    Returns the fields of a final state still needed once its section is written.
+
+    The query result, chart and report model are dropped, so a long streaming
+    run does not keep every result in memory until the merge.
+    """
+    # The query result is only a preview of the rows counted in the statistics
+    stats = state.get('result_stats') or {}
+    query_result = state.get('query_result')
+    return {
+        "user_request": state['user_request'],
+        "sql_query": state.get('sql_query', ""),
+        "errors": state['errors'],
+        "row_count": stats.get('rows', len(query_result) if query_result is not None else 0),
+        "elapsed_seconds": state['elapsed_seconds'],
+        "run_id": state.get('run_id'),
+    }
+
+
+def section_path(sections_folder, index, query):
+    """
+    Returns the path of the PDF section of a query, keyed on its position and text.
+    """
+    digest = hashlib.sha1(query.encode()).hexdigest()[:12]
+    return os.path.join(sections_folder, f"section_{index+1:04d}_{digest}.pdf")
+
+
+def stream_multi_query_report(queries, pdf_path, title, max_workers, engine, use_result_cache, chart_config,
+                              keep_sections=False, resume=False, batch_plan=BATCH_PLANNING):
+    """
+    Writes each query's section to its own PDF as soon as the query completes and merges them at the end.
+
+    At most `max_workers` queries are in flight and one section is held in
+    memory at a time; once written, a section only keeps a slim state (see
+    `slim_state`). The sections are kept in a folder next to the report until
+    the merge succeeds, so after a crash the sections already written are not
+    lost, and `resume` skips their queries.
+
+    Args:
+        queries (list): List of strings with queries in natural language.
+        pdf_path (str): Path of the merged PDF.
+        title (str): Main title of the report.
+        max_workers (int): Maximum number of queries processed at the same time.
+        engine (ReportEngine): Engine used to run the queries.
+        use_result_cache (bool): Reuse the cached results of queries already executed on the same data.
+        chart_config (dict): Chart settings of the PDF (png format and dpi).
+        keep_sections (bool): Keep the section PDFs after they are merged.
+        resume (bool): Reuse the sections written by a previous run instead of running their queries.
+        batch_plan (bool): Generate the SQL of every query in one LLM call and share the scans of common groupings.
+
+    Returns:
+        list: List of slim final states for each query, a state without results for resumed sections.
+    """
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph
+    from report_renderers import render_pdf_section
+
+    sections_folder = f"{os.path.splitext(pdf_path)[0]}_sections"
+    os.makedirs(sections_folder, exist_ok=True)
+    styles = getSampleStyleSheet()
+    title_style = styles['Title']
+    title_style.alignment = 1  # Centered
+
+    title_path = os.path.join(sections_folder, "section_0000_title.pdf")
+    with pdf_span(engine, "pdf_section", section=0):
+        write_pdf(title_path, [Paragraph(title, title_style)])
+
+    paths = [section_path(sections_folder, i, query) for i, query in enumerate(queries)]
+    final_states = [None] * len(queries)
+    pending = []
+    for i, query in enumerate(queries):
+        if resume and os.path.exists(paths[i]):
+            final_states[i] = {"user_request": query, "errors": [], "resumed": True, "elapsed_seconds": 0.0}
+        else:
+            # A section left by an earlier run must not be merged if this run's query fails
+            if os.path.exists(paths[i]):
+                os.remove(paths[i])
+            pending.append(i)
+    if resume:
+        print(f"Resuming: {len(queries) - len(pending)} sections already written")
+
+    # Charts are rendered in the consumer loop, while the remaining queries keep running
+    chart_config = {**chart_config, "defer": False}
+    plan = plan_queries(engine, [queries[i] for i in pending], use_result_cache, batch_plan)
+    for j, state in engine.iter_batch([queries[i] for i in pending], max_concurrency=max_workers,
+                                      use_result_cache=use_result_cache, chart_config=chart_config,
+                                      report_formats=[], plan=plan):
+        i = pending[j]
+        if state['errors']:
+            print(f"Errors in query {i+1}:")
+            for error in state['errors']:
+                print(f"- {error}")
+        else:
+            with pdf_span(engine, "pdf_section", section=i+1, run_id=state.get('run_id')):
+                write_pdf(paths[i], render_pdf_section(state['report_model'], i, styles))
+            print(f"Section {i+1} written to {paths[i]}")
+        final_states[i] = slim_state(state)
+
+    written = [path for path in paths if os.path.exists(path)]
+    with pdf_span(engine, "pdf_merge", sections=len(written)):
+        merge_pdfs([title_path] + written, pdf_path)
+    if not keep_sections:
+        for path in [title_path] + written:
+            os.remove(path)
+        if not os.listdir(sections_folder):
+            os.rmdir(sections_folder)
+    return final_states
+
+
+def generate_multi_query_report(queries, filename="Report_multiple_queries.pdf", title="Consolidated Analytical Report",
+                                max_workers=MAX_CONCURRENT_QUERIES, engine=None, use_result_cache=True,
+                                draft=False, chart_workers=None, stream=False, keep_sections=False, resume=False,
+                                batch_plan=BATCH_PLANNING):
+    """
+    Generates a PDF report containing multiple queries and their visualizations.
+    
+    The queries are processed concurrently, while the PDF sections keep the
+    original order of the queries.
+
+    Args:
+        queries (list): List of strings with queries in natural language.
+        filename (str): Name of the PDF file to be generated.
+        title (str): Main title of the report.
+        max_workers (int): Maximum number of queries processed at the same time.
+        engine (ReportEngine): Engine used to run the queries, the shared engine by default.
+        use_result_cache (bool): Reuse the cached results of queries already executed on the same data.
+        draft (bool): Render the charts at the draft resolution instead of the print resolution.
+        chart_workers (int): Number of processes rendering the charts, the engine's chart_workers by default.
+        stream (bool): Write each section to disk as soon as its query completes (see `stream_multi_query_report`).
+        keep_sections (bool): Keep the section PDFs of the streaming mode after they are merged.
+        resume (bool): In streaming mode, reuse the sections written by an interrupted run.
+        batch_plan (bool): Generate the SQL of every query in one LLM call and share the scans of common groupings.
+    
+    Returns:
+        list: List of final states for each query.
+    """
+    total_start = time.perf_counter()
+
+    # Create PDF document
+    pdf_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'reports')
+    os.makedirs(pdf_folder, exist_ok=True)
+    pdf_path = os.path.join(pdf_folder, filename)
+
+    engine = engine or get_report_engine()
+    print(f"Processing {len(queries)} queries (max_workers={max_workers})")
+    if stream:
+        # The PDF embeds PNG charts
+        chart_config = {"format": "png", "dpi": CHART_DRAFT_DPI if draft else CHART_DPI}
+        final_states = stream_multi_query_report(queries, pdf_path, title, max_workers, engine, use_result_cache,
+                                                 chart_config, keep_sections=keep_sections, resume=resume,
+                                                 batch_plan=batch_plan)
+        print(f"Multiple report saved as {filename}")
+    else:
+        final_states = build_multi_query_report(queries, pdf_path, title, max_workers, engine, use_result_cache,
+                                                draft, chart_workers, batch_plan=batch_plan)
+
+    # Report wall-clock times to measure the speedup of the concurrent execution
+    for i, state in enumerate(final_states):
+        print(f"Query {i+1} took {state['elapsed_seconds']:.2f}s")
+    print(f"Total time for {len(queries)} queries: {time.perf_counter() - total_start:.2f}s "
+          f"(max_workers={max_workers})")
+    if engine.sql_cache is not None:
+        print(f"SQL cache: {engine.sql_cache.stats()}")
+    if engine.result_cache is not None and use_result_cache:
+        print(f"Result cache: {engine.result_cache.stats()}")
     
     return final_states
 
@@ -228,5 +340,50 @@ if __name__ == "__main__":
                         nargs="+", 
                         default=user_request, 
                         help="User request for the business report")
+    parser.add_argument("--max_workers",
+                        type=int,
+                        default=MAX_CONCURRENT_QUERIES,
+                        help="Maximum number of queries processed at the same time")
+    parser.add_argument("--no_result_cache",
+                        action="store_true",
+                        help="Always execute the SQL queries against DuckDB")
+    parser.add_argument("--chart_workers",
+                        type=int,
+                        default=None,
+                        help="Number of processes rendering the charts")
+    parser.add_argument("--draft",
+                        action="store_true",
+                        help="Render the charts at the draft resolution")
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help="Write each query's section as soon as it completes and merge them at the end")
+    parser.add_argument("--keep_sections",
+                        action="store_true",
+                        help="Keep the section PDFs of the streaming mode after merging them")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Reuse the sections written by an interrupted streaming run")
+    parser.add_argument("--fake_llm",
+                        action="store_true",
+                        help="Generate the SQL offline with the fake LLM")
+    parser.add_argument("--trace",
+                        default=None,
+                        help="Append a JSON line per workflow step and PDF step to this file")
+    parser.add_argument("--trace_in_report",
+                        action="store_true",
+                        help="Append the run trace table to each query's section")
+    parser.add_argument("--no_batch_plan",
+                        action="store_true",
+                        help="Generate the SQL of each query in its own LLM call and run every scan separately")
+    parser.add_argument("--storage",
+                        default=STORAGE_BACKEND,
+                        choices=["duckdb", "parquet"],
+                        help="Query the DuckDB file or its Parquet export")
     args = parser.parse_args()
-    generate_multi_query_report(args.user_request)
\ No newline at end of file
+    get_report_engine(FakeLLM() if args.fake_llm else None, trace_path=args.trace,
+                      trace_in_report=args.trace_in_report, storage=args.storage)
+    generate_multi_query_report(args.user_request, max_workers=args.max_workers,
+                                use_result_cache=not args.no_result_cache, draft=args.draft,
+                                chart_workers=args.chart_workers, stream=args.stream,
+                                keep_sections=args.keep_sections, resume=args.resume,
+                                batch_plan=not args.no_batch_plan)
\ No newline at end of file
@@ -0,0 +1,250 @@
+import os
+import json
+import uuid
+import socket
+import sqlite3
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from config import JOB_QUEUE_NAME, JOB_RETENTION_SECONDS
+from sql_cache import normalize_request
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+
+def job_key(kind: str, payload: Dict[str, Any]) -> str:
+    """
+    Returns the deduplication key of a job: identical requests with identical options share it.
+    """
+    requests = payload.get('user_request')
+    requests = [normalize_request(r) for r in requests] if isinstance(requests, list) else normalize_request(requests)
+    raw = json.dumps({"kind": kind, **payload, "user_request": requests}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    Queue of report jobs stored in a local SQLite table.
+
+    Any process can submit jobs, and the workers of one or more server
+    processes claim them in submission order. A job whose identical request
+    is already queued or running is not added again: its submitter gets the
+    id of the in-flight job instead.
+    """
+
+    def __init__(self, path: Optional[str] = None, retention_seconds: float = JOB_RETENTION_SECONDS):
+        if path is None:
+            db_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db')
+            os.makedirs(db_folder, exist_ok=True)
+            path = os.path.join(db_folder, f"{JOB_QUEUE_NAME}.sqlite")
+        self.path = path
+        self.retention_seconds = retention_seconds
+        # Wakes up the workers and waiting clients of this process when a job is submitted or finishes
+        self.changed = threading.Condition()
+
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    job_key TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    worker TEXT,
+                    submissions INTEGER NOT NULL DEFAULT 1,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (job_key, status)")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # One short-lived connection per operation; IMMEDIATE takes the write lock up front,
+        # so two workers never claim the same job
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _notify(self) -> None:
+        with self.changed:
+            self.changed.notify_all()
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> Tuple[str, bool]:
+        """
+        Adds a job to the queue, unless an identical job is already queued or running.
+
+        Args:
+            kind (str): 'report' for a single request, 'multi' for a multi-query PDF.
+            payload (dict): The request(s) and options of the job.
+        Returns:
+            tuple: The job id, and whether it is an existing in-flight job.
+        """
+        key = job_key(kind, payload)
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT job_id FROM jobs WHERE job_key = ? AND status IN ('queued', 'running') "
+                "ORDER BY created_at LIMIT 1",
+                [key],
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET submissions = submissions + 1 WHERE job_id = ?", [row[0]])
+                return row[0], True
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (job_id, job_key, kind, payload, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                [job_id, key, kind, json.dumps(payload), time.time()],
+            )
+        self._notify()
+        return job_id, False
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Marks the oldest queued job as running and returns it, or None when the queue is empty.
+        """
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ? WHERE job_id = ?",
+                [worker_id(), time.time(), row[0]],
+            )
+        return self.get(row[0])
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                [status, None if result is None else json.dumps(result, default=str), error, time.time(), job_id],
+            )
+        self._notify()
+
+    def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._finish(job_id, "done", result, None)
+
+    def fail(self, job_id: str, error: str, result: Optional[Dict[str, Any]] = None) -> None:
+        self._finish(job_id, "failed", result, error)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a job with its status, timings and result, or None if it does not exist.
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", [job_id]).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = None if job['result'] is None else json.loads(job['result'])
+        return job
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Returns a job once it is finished, or in its current status after `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job['status'] in ("queued", "running"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Jobs finished by another process are only seen by polling
+            with self.changed:
+                self.changed.wait(min(remaining, 1.0))
+            job = self.get(job_id)
+        return job
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Returns the most recent jobs, without their results.
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.row_factory = sqlite3.Row
+            query = "SELECT job_id, kind, status, error, submissions, created_at, started_at, finished_at FROM jobs"
+            params = []
+            if status is not None:
+                query += " WHERE status = ?"
+                params.append(status)
+            rows = conn.execute(query + " ORDER BY created_at DESC LIMIT ?", params + [limit]).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns the number of jobs in each status.
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        finally:
+            conn.close()
+        return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+    def recover(self) -> Tuple[int, List[str]]:
+        """
+        Requeues the running jobs of dead processes of this host and removes finished jobs past their retention.
+
+        Returns:
+            tuple: Number of jobs requeued and ids of the removed jobs.
+        """
+        host = socket.gethostname()
+        requeued = 0
+        with self._transaction() as conn:
+            for job_id, worker in conn.execute(
+                "SELECT job_id, worker FROM jobs WHERE status = 'running'"
+            ).fetchall():
+                worker_host, _, pid = (worker or "").rpartition(":")
+                if worker_host == host and pid.isdigit() and not process_alive(int(pid)):
+                    conn.execute("UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL "
+                                 "WHERE job_id = ?", [job_id])
+                    requeued += 1
+            expired = [job_id for (job_id,) in conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                [time.time() - self.retention_seconds],
+            ).fetchall()]
+            conn.executemany("DELETE FROM jobs WHERE job_id = ?", [[job_id] for job_id in expired])
+        return requeued, expired
+
+
+def process_alive(pid: int) -> bool:
+    """
+    Tells whether a process of this host is still running.
+    """
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
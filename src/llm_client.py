@@ -0,0 +1,289 @@
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from config import (LLM_RATE_PER_SECOND, LLM_BURST, LLM_MAX_RETRIES, LLM_BACKOFF_BASE_SECONDS,
+                    LLM_BACKOFF_MAX_SECONDS, LLM_TIMEOUT_SECONDS, LLM_MAX_CONNECTIONS,
+                    MAX_CONCURRENT_QUERIES, TABLE_NAME)
+
+# Errors of the OpenAI client and httpx that are worth retrying when they carry no status code
+RETRYABLE_ERROR_NAMES = {"APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError",
+                         "TimeoutException", "ConnectError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError"}
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter shared by threads and coroutines.
+
+    Tokens are added at `rate` per second up to `capacity`; every call takes
+    one token and waits until one is available, which allows short bursts
+    while keeping the average rate under the provider limit.
+    """
+
+    def __init__(self, rate: float = LLM_RATE_PER_SECOND, capacity: float = LLM_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        # Takes the tokens now and returns how long the caller must wait for them
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1) -> None:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1) -> None:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Tells whether an LLM call failed because of rate limiting, a timeout or a transient server error.
+    """
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)) \
+        or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Returns the delay asked by the provider in its Retry-After header, if any.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitedLLM:
+    """
+    Wraps a LangChain chat model with rate limiting, retries and timeouts.
+
+    It exposes the `invoke`/`ainvoke`/`batch`/`abatch` methods used by the
+    workflow, so it can be placed in State['llm'] in place of the model.
+    Failed calls are retried with exponential backoff and full jitter when
+    they hit a 429, a timeout or a 5xx error.
+    """
+
+    def __init__(self,
+                 llm: Any,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE_SECONDS,
+                 backoff_max: float = LLM_BACKOFF_MAX_SECONDS,
+                 timeout: Optional[float] = LLM_TIMEOUT_SECONDS):
+        self.llm = llm
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucket()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.retries = 0
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.llm, 'model_name', None) or getattr(self.llm, 'model', None) or type(self.llm).__name__
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        self.retries += 1
+        return delay
+
+    def invoke(self, prompt: Any, **kwargs) -> Any:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return self.llm.invoke(prompt, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(self._backoff(attempt, e))
+
+    async def ainvoke(self, prompt: Any, **kwargs) -> Any:
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.aacquire()
+            try:
+                return await asyncio.wait_for(self.llm.ainvoke(prompt, **kwargs), self.timeout)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+
+    def batch(self, prompts: List[Any], max_concurrency: int = MAX_CONCURRENT_QUERIES) -> List[Any]:
+        """
+        Sends several prompts at once, keeping their order.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(prompts) or 1))) as executor:
+            return list(executor.map(self.invoke, prompts))
+
+    async def abatch(self, prompts: List[Any], max_concurrency: int = MAX_CONCURRENT_QUERIES) -> List[Any]:
+        """
+        Asynchronous version of `batch`.
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def invoke_limited(prompt):
+            async with semaphore:
+                return await self.ainvoke(prompt)
+
+        return list(await asyncio.gather(*(invoke_limited(prompt) for prompt in prompts)))
+
+
+class FakeLLM:
+    """
+    Offline stand-in for the chat model, to test and benchmark the pipeline without an API key.
+
+    It answers the SQL prompt with a query chosen from keywords of the user
+    request (or from `responses`, a mapping of request substrings to SQL),
+    and the batch prompt with a JSON array of such queries, after an
+    optional simulated latency, and reports approximate token usage.
+    """
+
+    model_name = "fake-llm"
+
+    def __init__(self, latency_seconds: float = 0.0, responses: Optional[Dict[str, str]] = None):
+        self.latency_seconds = latency_seconds
+        self.responses = responses or {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_sql(self, prompt: str) -> str:
+        batch = re.search(r"Requests:\s*(.*?)\n\s*\n", prompt, re.DOTALL)
+        if batch:
+            requests = re.findall(r"^\s*\d+\.\s*(.*)$", batch.group(1), re.MULTILINE)
+            return json.dumps([self.sql_for_request(request.strip()) for request in requests])
+        match = re.search(r"User request:\s*(.*?)\n\s*\n", prompt, re.DOTALL)
+        return self.sql_for_request((match.group(1) if match else prompt).strip())
+
+    def sql_for_request(self, request: str) -> str:
+        if request in self.responses:
+            return self.responses[request]
+        for key, sql_query in self.responses.items():
+            if key.lower() in request.lower():
+                return sql_query
+
+        request = request.lower()
+        limit = re.search(r"top (\d+)", request)
+        limit = f" LIMIT {limit.group(1)}" if limit else ""
+        measure = ("SUM(Quantity) AS total_quantity" if "quantity" in request
+                   else "SUM(Quantity * UnitPrice) AS total_sales")
+        order = "total_quantity" if "quantity" in request else "total_sales"
+        if "month" in request:
+            return (f"SELECT DATE_TRUNC('month', InvoiceDate) AS month, {measure} FROM {TABLE_NAME} "
+                    f"GROUP BY 1 ORDER BY 1{limit}")
+        if "product" in request or "description" in request:
+            return (f"SELECT Description, {measure} FROM {TABLE_NAME} "
+                    f"GROUP BY Description ORDER BY {order} DESC{limit or ' LIMIT 10'}")
+        return f"SELECT Country, {measure} FROM {TABLE_NAME} GROUP BY Country ORDER BY {order} DESC{limit}"
+
+    def _response(self, prompt: Any) -> Any:
+        from langchain_core.messages import AIMessage
+
+        prompt = str(prompt)
+        with self._lock:
+            self.calls += 1
+        sql_query = self.generate_sql(prompt)
+        input_tokens, output_tokens = len(prompt) // 4, len(sql_query) // 4
+        return AIMessage(content=sql_query, usage_metadata={"input_tokens": input_tokens,
+                                                            "output_tokens": output_tokens,
+                                                            "total_tokens": input_tokens + output_tokens})
+
+    def invoke(self, prompt: Any, **kwargs) -> Any:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return self._response(prompt)
+
+    async def ainvoke(self, prompt: Any, **kwargs) -> Any:
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        return self._response(prompt)
+
+
+class PerLoopAsyncTransport:
+    """
+    httpx async transport keeping one connection pool per event loop.
+
+    An async connection pool can only be used from the event loop that opened
+    its connections, so a single pool shared by the process fails with
+    "Event loop is closed" in the second `asyncio.run` (e.g. a second
+    `ReportEngine.abatch`). Each running loop gets its own pool, bounded by
+    `limits`, and the pools of closed loops are dropped.
+    """
+
+    def __init__(self, limits: Any):
+        self.limits = limits
+        self._transports = {}
+        self._lock = threading.Lock()
+
+    def _transport(self) -> Any:
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for closed in [other for other in self._transports if other.is_closed()]:
+                del self._transports[closed]
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(limits=self.limits)
+            return transport
+
+    async def handle_async_request(self, request: Any) -> Any:
+        return await self._transport().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """
+        Closes the connection pool of the running event loop.
+        """
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+    async def __aenter__(self) -> "PerLoopAsyncTransport":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+
+_http_clients = None
+_http_clients_lock = threading.Lock()
+
+
+def get_http_clients():
+    """
+    Returns the HTTP clients shared by every LLM client of the process, creating them on first use.
+
+    Returns:
+        tuple: The synchronous and asynchronous httpx clients, with a bounded connection pool
+        (one per event loop for the asynchronous client, see `PerLoopAsyncTransport`).
+    """
+    global _http_clients
+    with _http_clients_lock:
+        if _http_clients is None:
+            import httpx
+            limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+            _http_clients = (httpx.Client(limits=limits, timeout=LLM_TIMEOUT_SECONDS),
+                             httpx.AsyncClient(transport=PerLoopAsyncTransport(limits), timeout=LLM_TIMEOUT_SECONDS))
+        return _http_clients
@@ -0,0 +1,240 @@
+import os
+import json
+import shutil
+import argparse
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import duckdb
+from config import DATABASE_NAME, TABLE_NAME, LOAD_METADATA_TABLE, PARQUET_STORAGE_FOLDER, PARQUET_PARTITION_BY_COUNTRY
+from config import PARQUET_PARTITION_COLUMNS, PARQUET_KEEP_VERSIONS
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+
+
+def get_parquet_folder(folder_name: str = PARQUET_STORAGE_FOLDER) -> str:
+    """
+    Returns the folder of the Parquet storage, under the 'db' folder, creating it if needed.
+
+    Args:
+        folder_name (str): Name of the storage folder.
+    Returns:
+        str: Path of the storage folder.
+    """
+    folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db', folder_name)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def current_version(folder: str) -> Optional[str]:
+    """
+    Returns the name of the published Parquet version, or None if nothing was exported yet.
+    """
+    try:
+        with open(os.path.join(folder, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_manifest(folder: str, version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Returns the manifest of a Parquet version, the published one by default.
+    """
+    version = version or current_version(folder)
+    if version is None:
+        raise FileNotFoundError(
+            f"No Parquet export found in {folder}. Run parquet_storage.py or extract_and_write_data.py --parquet first."
+        )
+    with open(os.path.join(folder, version, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def export_to_parquet(conn: duckdb.DuckDBPyConnection,
+                      folder: Optional[str] = None,
+                      table_name: str = TABLE_NAME,
+                      partition_by_country: bool = PARQUET_PARTITION_BY_COUNTRY,
+                      keep_versions: int = PARQUET_KEEP_VERSIONS) -> Dict[str, Any]:
+    """
+    Exports the sales table as Hive-partitioned Parquet and the other tables as single Parquet files.
+
+    The sales rows are partitioned by the PARQUET_PARTITION_COLUMNS (year and
+    month of InvoiceDate), and by Country if requested, and sorted by
+    InvoiceDate within each file: filters on the partition columns skip whole
+    files and the row group min/max statistics let date filters skip most of
+    the rest. Each export is written to a new version folder and published by
+    replacing the CURRENT file, so readers never see a half-written export.
+    The manifest records the load the export was taken from.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        folder (str): Storage folder, `get_parquet_folder()` by default.
+        table_name (str): Name of the sales table.
+        partition_by_country (bool): Also partition the sales rows by Country.
+        keep_versions (int): Number of exported versions kept, including the new one.
+    Returns:
+        dict: The manifest of the new version.
+    """
+    folder = folder or get_parquet_folder()
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    version_folder = os.path.join(folder, version)
+    os.makedirs(version_folder)
+
+    columns = [row[0] for row in conn.execute(f"DESCRIBE {table_name}").fetchall()]
+    partition_by = list(PARQUET_PARTITION_COLUMNS) + (["Country"] if partition_by_country else [])
+    partitions = ", ".join(f"{expression} AS {column}" for column, expression in PARQUET_PARTITION_COLUMNS.items())
+    order_by = "Country, InvoiceDate" if partition_by_country else "InvoiceDate"
+    sales_folder = os.path.join(version_folder, table_name)
+    conn.execute(
+        f"""
+        COPY (
+            SELECT *, {partitions}
+            FROM {table_name} ORDER BY {order_by}
+        ) TO '{sales_folder}' (FORMAT PARQUET, PARTITION_BY ({', '.join(partition_by)}))
+        """
+    )
+
+    # Metadata and rollup tables are small and are exported whole
+    tables = [row[0] for row in conn.execute(
+        "SELECT table_name FROM information_schema.tables WHERE table_type = 'BASE TABLE' AND table_name <> ?",
+        [table_name],
+    ).fetchall()]
+    os.makedirs(os.path.join(version_folder, "tables"))
+    for name in tables:
+        conn.execute(f"COPY {name} TO '{os.path.join(version_folder, 'tables', name + '.parquet')}' (FORMAT PARQUET)")
+
+    manifest = {
+        "version": version,
+        "table": table_name,
+        "columns": columns,
+        "partition_by": partition_by,
+        "rows": conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0],
+        "load_id": latest_load_id(conn),
+        "tables": sorted(tables),
+        "created_at": time.time(),
+    }
+    with open(os.path.join(version_folder, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Publish the new version atomically, then drop the oldest ones
+    pointer = os.path.join(folder, CURRENT_FILE)
+    with open(pointer + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+    prune_versions(folder, keep_versions)
+    return manifest
+
+
+def latest_load_id(conn: duckdb.DuckDBPyConnection) -> Optional[int]:
+    """
+    Returns the id of the latest load recorded in the database, or None without load metadata.
+    """
+    tables = {row[0] for row in conn.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+    if LOAD_METADATA_TABLE not in tables:
+        return None
+    return conn.execute(f"SELECT MAX(load_id) FROM {LOAD_METADATA_TABLE}").fetchone()[0]
+
+
+def stale_export_warning(manifest: Dict[str, Any], db_path: str) -> Optional[str]:
+    """
+    Compares the load an export was taken from with the latest load of the DuckDB database.
+
+    The database is only read if it is not being written to, a locked file is not waited for.
+
+    Args:
+        manifest (dict): Manifest of the export.
+        db_path (str): Path of the DuckDB database the export was taken from.
+    Returns:
+        str: A warning if the database holds a newer load than the export, None otherwise.
+    """
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = duckdb.connect(database=db_path, read_only=True)
+    except duckdb.IOException:
+        return None
+    try:
+        load_id = latest_load_id(conn)
+    finally:
+        conn.close()
+    if load_id is None or load_id == manifest.get('load_id'):
+        return None
+    return (f"Warning: the Parquet export {manifest['version']} was taken from load {manifest.get('load_id')} "
+            f"but {db_path} holds load {load_id}. Run parquet_storage.py to export the new data.")
+
+
+def prune_versions(folder: str, keep_versions: int = PARQUET_KEEP_VERSIONS) -> List[str]:
+    """
+    Removes the oldest exported versions, never the published one.
+
+    Returns:
+        list: Names of the removed versions.
+    """
+    current = current_version(folder)
+    # Ordered by export time, the names of the versions exported within the same second do not sort
+    versions = sorted((name for name in os.listdir(folder)
+                       if os.path.isfile(os.path.join(folder, name, MANIFEST_FILE))),
+                      key=lambda name: load_manifest(folder, name)['created_at'])
+    removed = [name for name in versions[:-max(keep_versions, 1)] if name != current]
+    for name in removed:
+        shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+    return removed
+
+
+def attach_parquet_storage(conn: duckdb.DuckDBPyConnection, folder: str) -> Dict[str, Any]:
+    """
+    Creates views over the published Parquet version, named like the original tables.
+
+    The sales view has the columns of the sales table, so queries written for
+    the DuckDB file run unchanged, plus the partition columns of the export:
+    only filters on them let DuckDB skip whole partitions.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection (usually in-memory) receiving the views.
+        folder (str): Storage folder.
+    Returns:
+        dict: The manifest of the attached version.
+    """
+    manifest = load_manifest(folder)
+    version_folder = os.path.join(folder, manifest['version'])
+    columns = ", ".join(f'"{column}"' for column in manifest['columns'] + list(PARQUET_PARTITION_COLUMNS))
+    files = os.path.join(version_folder, manifest['table'], "**", "*.parquet")
+    conn.execute(
+        f"CREATE OR REPLACE VIEW {manifest['table']} AS SELECT {columns} "
+        f"FROM read_parquet('{files}', hive_partitioning = true)"
+    )
+    for name in manifest['tables']:
+        path = os.path.join(version_folder, "tables", name + ".parquet")
+        conn.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM read_parquet('{path}')")
+    return manifest
+
+
+def main():
+    """
+    Exports the DuckDB database to the Parquet storage.
+    """
+    from db_connection import get_database_path
+
+    parser = argparse.ArgumentParser(description="Export the sales database as Hive-partitioned Parquet")
+    parser.add_argument("--database_name", default=DATABASE_NAME, help="Name of the DuckDB database to export")
+    parser.add_argument("--folder", default=None, help="Storage folder (default: db/parquet)")
+    parser.add_argument("--partition_by_country", action="store_true", default=PARQUET_PARTITION_BY_COUNTRY,
+                        help="Also partition the sales rows by Country")
+    parser.add_argument("--keep_versions", type=int, default=PARQUET_KEEP_VERSIONS,
+                        help="Number of exported versions kept")
+    args = parser.parse_args()
+
+    conn = duckdb.connect(database=get_database_path(args.database_name), read_only=True)
+    try:
+        manifest = export_to_parquet(conn, args.folder, partition_by_country=args.partition_by_country,
+                                     keep_versions=args.keep_versions)
+    finally:
+        conn.close()
+    print(f"Exported {manifest['rows']} rows of '{manifest['table']}' as version {manifest['version']}, "
+          f"partitioned by {', '.join(manifest['partition_by'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import os
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+import duckdb
+import pandas as pd
+from config import RESULT_PREVIEW_ROWS, SUMMARY_MAX_VALUES
+
+NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER",
+                 "UBIGINT", "FLOAT", "DOUBLE", "DECIMAL")
+TEXT_TYPES = ("VARCHAR",)
+
+
+def quote(identifier: str) -> str:
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def arrow_to_dataframe(table: Any) -> pd.DataFrame:
+    """
+    Converts an Arrow table to pandas, with DECIMAL and HUGEINT columns (e.g. the
+    SUM of an integer column) as floats, as DuckDB's own conversion does, instead
+    of Python Decimal objects that pandas does not treat as numeric.
+    """
+    import pyarrow as pa
+    for i, column in enumerate(table.schema):
+        if pa.types.is_decimal(column.type):
+            table = table.set_column(i, column.name, table.column(i).cast(pa.float64()))
+    return table.to_pandas()
+
+
+def fetch_dataframe(conn: duckdb.DuckDBPyConnection, sql_query: str) -> pd.DataFrame:
+    """
+    Fetches a small result through Arrow, falling back to DuckDB's DataFrame conversion without pyarrow.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return conn.execute(sql_query).df()
+    return arrow_to_dataframe(conn.execute(sql_query).to_arrow_table())
+
+
+def read_preview(conn: duckdb.DuckDBPyConnection, sql_query: str, preview_rows: int) -> Tuple[Any, bool]:
+    """
+    Reads the first rows of a query, stopping the query once they are read.
+
+    Returns:
+        tuple: The rows (an Arrow table, or a DataFrame without pyarrow) and whether they are the whole result.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        rows = conn.execute(f"SELECT * FROM ({sql_query}) AS query_result LIMIT {int(preview_rows) + 1}").df()
+        return rows.head(preview_rows), len(rows) <= preview_rows
+    reader = conn.execute(sql_query).to_arrow_reader(max(int(preview_rows), 1))
+    batches, count = [], 0
+    try:
+        while count <= preview_rows:
+            batch = reader.read_next_batch()
+            batches.append(batch)
+            count += batch.num_rows
+    except StopIteration:
+        pass
+    finally:
+        reader.close()
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    return table.slice(0, preview_rows), count <= preview_rows
+
+
+def fetch_preview(conn: duckdb.DuckDBPyConnection, sql_query: str,
+                  preview_rows: int = RESULT_PREVIEW_ROWS) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Returns the first rows of a query and the summary statistics of its full result.
+
+    The result is streamed and only `preview_rows` rows are kept, whatever
+    its size. When the preview holds the whole result, the statistics are
+    computed on it; otherwise they are computed in DuckDB by a second,
+    aggregate-only run of the query, so the full result is never materialized.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        sql_query (str): The SQL query.
+        preview_rows (int): Number of rows returned, in the order of the query.
+    Returns:
+        tuple: The preview DataFrame and the statistics of the full result (see `result_stats`).
+    """
+    preview, complete = read_preview(conn, sql_query, preview_rows)
+    if complete:
+        name = f"query_result_{uuid.uuid4().hex}"
+        conn.register(name, preview)
+        try:
+            stats = result_stats(conn, name)
+        finally:
+            conn.unregister(name)
+    else:
+        stats = result_stats(conn, f"({sql_query}) AS query_result")
+    return (preview if isinstance(preview, pd.DataFrame) else arrow_to_dataframe(preview)), stats
+
+
+def result_stats(conn: duckdb.DuckDBPyConnection, relation: str,
+                 max_values: int = SUMMARY_MAX_VALUES) -> Dict[str, Any]:
+    """
+    Computes the statistics of a result in DuckDB: the row count, the sum and
+    mean of numeric columns, and the distinct values of text columns.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        relation (str): Table, view or aliased subquery holding the result.
+        max_values (int): Text columns with fewer distinct values also list them.
+    Returns:
+        dict: The row count in 'rows' and the statistics of each column in 'columns'.
+    """
+    columns = conn.execute(f"DESCRIBE SELECT * FROM {relation}").fetchall()
+    expressions = ["COUNT(*)"]
+    for name, data_type, *_ in columns:
+        if data_type.startswith(NUMERIC_TYPES):
+            expressions += [f"SUM({quote(name)})", f"AVG({quote(name)})"]
+        elif data_type.startswith(TEXT_TYPES):
+            expressions.append(f"COUNT(DISTINCT {quote(name)})")
+    values = iter(conn.execute(f"SELECT {', '.join(expressions)} FROM {relation}").fetchone())
+
+    stats = {"rows": next(values), "columns": {}}
+    for name, data_type, *_ in columns:
+        if data_type.startswith(NUMERIC_TYPES):
+            total, mean = next(values), next(values)
+            stats["columns"][name] = {"sum": None if total is None else float(total),
+                                      "mean": None if mean is None else float(mean)}
+        elif data_type.startswith(TEXT_TYPES):
+            distinct = next(values)
+            column = {"distinct": distinct}
+            if distinct < max_values:
+                # Values in order of first appearance, as pandas' unique(); ROW_NUMBER() OVER () is streamed
+                column["values"] = [value for (value,) in conn.execute(
+                    f"SELECT {quote(name)} FROM (SELECT {quote(name)}, ROW_NUMBER() OVER () AS position__ "
+                    f"FROM {relation}) WHERE {quote(name)} IS NOT NULL GROUP BY {quote(name)} ORDER BY MIN(position__)"
+                ).fetchall()]
+            stats["columns"][name] = column
+    return stats
+
+
+def dataframe_stats(df: pd.DataFrame, max_values: int = SUMMARY_MAX_VALUES) -> Dict[str, Any]:
+    """
+    Computes the same statistics as `result_stats` for a result fetched in full.
+    """
+    stats = {"rows": len(df), "columns": {}}
+    for name in df.columns:
+        series = df[name]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            stats["columns"][name] = {"sum": float(series.sum()), "mean": float(series.mean())}
+        elif pd.api.types.is_string_dtype(series) or pd.api.types.is_object_dtype(series):
+            distinct = series.nunique()
+            column = {"distinct": int(distinct)}
+            if distinct < max_values:
+                column["values"] = series.dropna().unique().tolist()
+            stats["columns"][name] = column
+    return stats
+
+
+def export_query_result(conn: duckdb.DuckDBPyConnection, sql_query: str, path: str,
+                        file_format: Optional[str] = None) -> str:
+    """
+    Streams every row of a query to a Parquet or CSV file with DuckDB's COPY, without going through pandas.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        sql_query (str): The SQL query.
+        path (str): Path of the exported file.
+        file_format (str): 'parquet' or 'csv', inferred from the file extension by default.
+    Returns:
+        str: The path of the exported file.
+    """
+    file_format = (file_format or os.path.splitext(path)[1].lstrip(".") or "parquet").lower()
+    if file_format not in ("parquet", "csv"):
+        raise ValueError(f"Unsupported export format: {file_format}")
+    options = "FORMAT PARQUET" if file_format == "parquet" else "FORMAT CSV, HEADER"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    escaped_path = path.replace("'", "''")
+    conn.execute(f"COPY ({sql_query}) TO '{escaped_path}' ({options})")
+    return path
@@ -0,0 +1,410 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, START, END
+from workflow_functions import (
+    lookup_cached_sql_query,
+    route_after_cache_lookup,
+    parse_user_request,
+    aparse_user_request,
+    validate_sql_query,
+    route_after_validation,
+    rewrite_sql_query_to_rollup,
+    connect_and_execute_sql_query,
+    generate_visualization,
+    generate_report,
+    render_reports,
+    State
+)
+from sql_cache import SQLCache
+from llm_client import RateLimitedLLM, get_http_clients
+from schema_catalog import SchemaCatalog
+from result_cache import ResultCache
+from query_results import export_query_result
+from tracing import Tracer
+from batch_planner import BatchPlan, plan_batch
+from charts import ChartCache, ChartRenderPool, chart_data
+from db_connection import DuckDBConnectionManager
+from config import LLM_MODEL_NAME, CHART_DPI, CHART_FORMAT, MAX_CONCURRENT_QUERIES, DUCKDB_THREADS, DUCKDB_MEMORY_LIMIT, USE_ROLLUPS
+from config import CHART_WORKERS, REPORT_FORMATS, SQL_ROW_CAP, RESULT_MODE, LLM_TIMEOUT_SECONDS
+from config import TRACE_FILE, TRACE_IN_REPORT, TRACE_MEMORY, STORAGE_BACKEND
+
+
+def create_llm(model_name: str = LLM_MODEL_NAME) -> RateLimitedLLM:
+    """
+    Creates the chat model used to translate requests into SQL.
+
+    Args:
+        model_name (str): Name of the OpenAI model.
+    Returns:
+        RateLimitedLLM: The LLM client, reading the API key from the environment/.env file, with rate
+        limiting and retries, and sharing the process HTTP connection pool.
+    """
+    # The OpenAI client is only loaded when no other LLM is given to the engine
+    from dotenv import load_dotenv
+    from langchain_openai.chat_models import ChatOpenAI
+
+    load_dotenv()
+    http_client, http_async_client = get_http_clients()
+    # Retries are handled by RateLimitedLLM, with backoff and jitter
+    llm = ChatOpenAI(model_name=model_name, temperature=0, timeout=LLM_TIMEOUT_SECONDS, max_retries=0,
+                     http_client=http_client, http_async_client=http_async_client)
+    return RateLimitedLLM(llm)
+
+
+def build_workflow(tracer: Optional[Tracer] = None):
+    """
+    Builds and compiles the report generation workflow.
+
+    Args:
+        tracer (Tracer): Records every node call when given.
+    Returns:
+        CompiledStateGraph: The compiled LangGraph workflow.
+    """
+    def node(name, function):
+        return tracer.wrap(name, function) if tracer is not None else function
+
+    workflow = StateGraph(State)
+    workflow.add_node("lookup_cached_sql_query", node("lookup_cached_sql_query", lookup_cached_sql_query))
+    # The LLM node has an async variant, so `ainvoke` does not block the event loop on the API call
+    workflow.add_node("parse_user_request", RunnableLambda(
+        node("parse_user_request", parse_user_request),
+        afunc=tracer.awrap("parse_user_request", aparse_user_request) if tracer is not None else aparse_user_request))
+    workflow.add_node("validate_sql_query", node("validate_sql_query", validate_sql_query))
+    workflow.add_node("rewrite_sql_query_to_rollup", node("rewrite_sql_query_to_rollup", rewrite_sql_query_to_rollup))
+    workflow.add_node("connect_and_execute_sql_query",
+                      node("connect_and_execute_sql_query", connect_and_execute_sql_query))
+    workflow.add_node("generate_visualization", node("generate_visualization", generate_visualization))
+    workflow.add_node("generate_report", node("generate_report", generate_report))
+
+    workflow.add_edge(START, "lookup_cached_sql_query")
+    workflow.add_conditional_edges("lookup_cached_sql_query", route_after_cache_lookup,
+                                   ["parse_user_request", "validate_sql_query"])
+    workflow.add_edge("parse_user_request", "validate_sql_query")
+    # Invalid queries go back to the LLM with their error, up to SQL_MAX_ATTEMPTS
+    workflow.add_conditional_edges("validate_sql_query", route_after_validation,
+                                   ["rewrite_sql_query_to_rollup", "parse_user_request", END])
+    workflow.add_edge("rewrite_sql_query_to_rollup", "connect_and_execute_sql_query")
+    workflow.add_edge("connect_and_execute_sql_query", "generate_visualization")
+    workflow.add_edge("generate_visualization", "generate_report")
+    workflow.add_edge("generate_report", END)
+
+    return workflow.compile()
+
+
+class ReportEngine:
+    """
+    Reusable report generator.
+
+    The workflow is compiled once and the LLM client, SQL cache, read-only
+    DuckDB connection and plotting configuration are shared by every request,
+    so a long-running process only pays their setup cost once.
+    """
+
+    def __init__(self,
+                 llm: Any = None,
+                 sql_cache: Optional[SQLCache] = None,
+                 use_sql_cache: bool = True,
+                 result_cache: Optional[ResultCache] = None,
+                 use_result_cache: bool = True,
+                 db_path: Optional[str] = None,
+                 duckdb_threads: Optional[int] = DUCKDB_THREADS,
+                 duckdb_memory_limit: Optional[str] = DUCKDB_MEMORY_LIMIT,
+                 storage: str = STORAGE_BACKEND,
+                 chart_config: Optional[Dict[str, Any]] = None,
+                 use_rollups: bool = USE_ROLLUPS,
+                 chart_workers: int = CHART_WORKERS,
+                 result_mode: str = RESULT_MODE,
+                 trace_path: Optional[str] = TRACE_FILE,
+                 trace_in_report: bool = TRACE_IN_REPORT,
+                 trace_memory: bool = TRACE_MEMORY):
+        self.llm = llm if llm is not None else create_llm()
+        self.sql_cache = (sql_cache if sql_cache is not None else SQLCache()) if use_sql_cache else None
+        self.result_cache = (result_cache if result_cache is not None else ResultCache()) if use_result_cache else None
+        self.db = DuckDBConnectionManager(db_path, threads=duckdb_threads, memory_limit=duckdb_memory_limit,
+                                          storage=storage)
+        self.chart_config = {"dpi": CHART_DPI, "format": CHART_FORMAT, "figsize": (10, 6), **(chart_config or {})}
+        self.chart_cache = ChartCache()
+        self.chart_pool = ChartRenderPool(chart_workers)
+        self.schema_catalog = SchemaCatalog()
+        self.use_rollups = use_rollups
+        self.result_mode = result_mode
+        # Nodes are only wrapped when their records are written somewhere
+        self.tracer = Tracer(trace_path, trace_memory) if trace_path or trace_in_report else None
+        self.trace_in_report = trace_in_report
+        self.app = build_workflow(self.tracer)
+
+    def initial_state(self, user_request: str, use_sql_cache: bool = True,
+                      use_result_cache: bool = True, chart_config: Optional[Dict[str, Any]] = None,
+                      report_formats: Optional[List[str]] = None,
+                      planned: Optional[Dict[str, Any]] = None) -> State:
+        """
+        Builds the initial workflow state of a request.
+
+        Args:
+            user_request (str): The user's natural language request.
+            use_sql_cache (bool): Reuse the SQL cached for the same request instead of calling the LLM.
+            use_result_cache (bool): Reuse the cached result of the same SQL on the same data.
+            chart_config (dict): Overrides of the engine chart settings (dpi, format, figsize).
+            report_formats (list): Text formats rendered from the report model ('markdown', 'html').
+            planned (dict): SQL, LLM usage and shared aggregates planned for the request (see `BatchPlan.planned`).
+        Returns:
+            State: The initial state.
+        """
+        planned = planned or {}
+        return {
+            "user_request": user_request,
+            "llm": self.llm,
+            "sql_query": planned.get('sql_query', ""),
+            "query_result": pd.DataFrame(),
+            "report": "",
+            "visualization": None,
+            "errors": [],
+            "sql_cache": self.sql_cache if use_sql_cache else None,
+            "result_cache": self.result_cache if use_result_cache else None,
+            "result_cache_hit": False,
+            "sql_cache_hit": planned.get('sql_cache_hit', False),
+            "schema_fingerprint": "",
+            "schema_catalog": self.schema_catalog,
+            "prompt_tables": [],
+            "llm_usage": planned.get('llm_usage', {}),
+            "db": self.db,
+            "chart_config": {**self.chart_config, **(chart_config or {})},
+            "chart_cache": self.chart_cache,
+            "chart_spec": None,
+            "visualization_format": "",
+            "use_rollups": self.use_rollups,
+            "original_sql_query": "",
+            "rollup_table": "",
+            "query_seconds": 0.0,
+            # SQL generated in the batch LLM call counts as the first attempt
+            "sql_attempts": 1 if planned.get('sql_query') and not planned.get('sql_cache_hit') else 0,
+            "sql_validation_error": "",
+            "row_cap": SQL_ROW_CAP,
+            "row_cap_hit": False,
+            "result_mode": self.result_mode,
+            "result_stats": {},
+            "report_model": None,
+            "report_formats": list(REPORT_FORMATS if report_formats is None else report_formats),
+            "reports": {},
+            "run_id": uuid.uuid4().hex,
+            "trace": [],
+            "trace_in_report": self.trace_in_report,
+            "shared_aggregates": planned.get('shared_aggregates', [])
+        }
+
+    def run(self, user_request: str, use_sql_cache: bool = True, use_result_cache: bool = True,
+            chart_config: Optional[Dict[str, Any]] = None, report_formats: Optional[List[str]] = None,
+            planned: Optional[Dict[str, Any]] = None) -> State:
+        """
+        Generates the report of a single request.
+
+        Args:
+            user_request (str): The user's natural language request.
+            use_sql_cache (bool): Reuse the SQL cached for the same request instead of calling the LLM.
+            use_result_cache (bool): Reuse the cached result of the same SQL on the same data.
+            chart_config (dict): Overrides of the engine chart settings (dpi, format, figsize).
+            report_formats (list): Text formats rendered from the report model, REPORT_FORMATS by default.
+            planned (dict): SQL, LLM usage and shared aggregates planned for the request (see `BatchPlan.planned`).
+        Returns:
+            State: The final state, with the wall-clock time in 'elapsed_seconds'.
+        """
+        start = time.perf_counter()
+        try:
+            initial_state = self.initial_state(user_request, use_sql_cache, use_result_cache, chart_config,
+                                               report_formats, planned)
+            final_state = self.app.invoke(initial_state)
+        except Exception as e:
+            final_state = {"user_request": user_request, "errors": [f"Error while processing the request: {e}"]}
+        final_state['elapsed_seconds'] = time.perf_counter() - start
+        return final_state
+
+    async def arun(self, user_request: str, use_sql_cache: bool = True,
+                   use_result_cache: bool = True, chart_config: Optional[Dict[str, Any]] = None,
+                   report_formats: Optional[List[str]] = None,
+                   planned: Optional[Dict[str, Any]] = None) -> State:
+        """
+        Asynchronous version of `run`.
+        """
+        start = time.perf_counter()
+        try:
+            initial_state = self.initial_state(user_request, use_sql_cache, use_result_cache, chart_config,
+                                               report_formats, planned)
+            final_state = await self.app.ainvoke(initial_state)
+        except Exception as e:
+            final_state = {"user_request": user_request, "errors": [f"Error while processing the request: {e}"]}
+        final_state['elapsed_seconds'] = time.perf_counter() - start
+        return final_state
+
+    def batch(self, user_requests: List[str], max_concurrency: int = MAX_CONCURRENT_QUERIES,
+              use_sql_cache: bool = True, use_result_cache: bool = True,
+              chart_config: Optional[Dict[str, Any]] = None,
+              report_formats: Optional[List[str]] = None,
+              plan: Optional[BatchPlan] = None) -> List[State]:
+        """
+        Generates the reports of several requests on a bounded worker pool.
+
+        Each request runs in its own workflow, so a failing request only fills
+        its own state['errors'] and does not affect the others.
+
+        Args:
+            user_requests (list): List of natural language requests.
+            max_concurrency (int): Maximum number of requests processed at the same time.
+            use_sql_cache (bool): Reuse the SQL cached for the same request instead of calling the LLM.
+            use_result_cache (bool): Reuse the cached result of the same SQL on the same data.
+            chart_config (dict): Overrides of the engine chart settings (dpi, format, figsize).
+            report_formats (list): Text formats rendered from the report model, REPORT_FORMATS by default.
+            plan (BatchPlan): SQL and shared scans planned for the requests (see `plan_batch`).
+        Returns:
+            list: List of final states, in the same order as the requests.
+        """
+        if not user_requests:
+            return []
+        max_concurrency = max(1, min(max_concurrency, len(user_requests)))
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(self.run, user_request, use_sql_cache, use_result_cache, chart_config,
+                                       report_formats, plan.planned(index) if plan is not None else None)
+                       for index, user_request in enumerate(user_requests)]
+            return [future.result() for future in futures]
+
+    def iter_batch(self, user_requests: List[str], max_concurrency: int = MAX_CONCURRENT_QUERIES,
+                   use_sql_cache: bool = True, use_result_cache: bool = True,
+                   chart_config: Optional[Dict[str, Any]] = None,
+                   report_formats: Optional[List[str]] = None,
+                   plan: Optional[BatchPlan] = None) -> Iterator[Tuple[int, State]]:
+        """
+        Version of `batch` yielding each final state as soon as its request completes.
+
+        Only `max_concurrency` requests are submitted at a time and the next one
+        is submitted when a state is yielded, so finished states never pile up
+        while the consumer is busy with an earlier one.
+
+        Returns:
+            Iterator: Pairs of request index and final state, in completion order.
+        """
+        if not user_requests:
+            return
+        max_concurrency = max(1, min(max_concurrency, len(user_requests)))
+        requests = iter(enumerate(user_requests))
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            def submit(count):
+                for index, user_request in islice(requests, count):
+                    future = executor.submit(self.run, user_request, use_sql_cache, use_result_cache, chart_config,
+                                             report_formats, plan.planned(index) if plan is not None else None)
+                    futures[future] = index
+
+            futures = {}
+            submit(max_concurrency)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures.pop(future)
+                    submit(1)
+                    yield index, future.result()
+
+    async def abatch(self, user_requests: List[str], max_concurrency: int = MAX_CONCURRENT_QUERIES,
+                     use_sql_cache: bool = True, use_result_cache: bool = True,
+                     chart_config: Optional[Dict[str, Any]] = None,
+                     report_formats: Optional[List[str]] = None,
+                     plan: Optional[BatchPlan] = None) -> List[State]:
+        """
+        Asynchronous version of `batch`.
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run_limited(index, user_request):
+            async with semaphore:
+                return await self.arun(user_request, use_sql_cache, use_result_cache, chart_config, report_formats,
+                                       plan.planned(index) if plan is not None else None)
+
+        return list(await asyncio.gather(*(run_limited(index, user_request)
+                                           for index, user_request in enumerate(user_requests))))
+
+    def plan_batch(self, user_requests: List[str], use_sql_cache: bool = True,
+                   use_result_cache: bool = True) -> BatchPlan:
+        """
+        Plans the SQL of several requests in one LLM call and the scans they can share, before `batch` runs them.
+
+        Args:
+            user_requests (list): List of natural language requests.
+            use_sql_cache (bool): Reuse the SQL cached for the same requests instead of calling the LLM.
+            use_result_cache (bool): Skip the shared scans of queries whose results are cached.
+        Returns:
+            BatchPlan: The plan, passed to `batch` or `iter_batch` with the same requests.
+        """
+        span = self.tracer.span("plan_batch", requests=len(user_requests)) if self.tracer else nullcontext({})
+        with span as record:
+            plan = plan_batch(user_requests, self.llm, self.db, self.schema_catalog,
+                              sql_cache=self.sql_cache if use_sql_cache else None,
+                              result_cache=self.result_cache if use_result_cache else None,
+                              use_rollups=self.use_rollups, result_mode=self.result_mode)
+            record["llm_calls"] = plan.llm_calls
+            record["shared_scans"] = sum(1 for aggregate in plan.shared_aggregates if aggregate['table'] is not None)
+        return plan
+
+    def render_charts(self, states: List[State], chart_config: Optional[Dict[str, Any]] = None,
+                      workers: Optional[int] = None) -> List[State]:
+        """
+        Renders the charts deferred by the workflow (chart_config 'defer') in the process pool.
+
+        Args:
+            states (list): Final states of the requests.
+            chart_config (dict): Overrides of the engine chart settings (dpi, format).
+            workers (int): Number of worker processes, the engine's chart_workers by default.
+        Returns:
+            list: The same states, with the rendered images in 'visualization' and in their report
+            model. A chart that fails to render leaves 'visualization' empty and adds its error to the state.
+        """
+        chart_config = {**self.chart_config, **(chart_config or {})}
+        pending = [state for state in states
+                   if state.get('chart_spec') is not None and state.get('visualization') is None]
+        jobs = [(chart_data(state['query_result'], state['chart_spec']), state['chart_spec']) for state in pending]
+        images = self.chart_pool.render_many(jobs,
+                                             dpi=chart_config['dpi'],
+                                             fmt=chart_config['format'],
+                                             cache=self.chart_cache,
+                                             workers=workers)
+        for state, image in zip(pending, images):
+            if isinstance(image, Exception):
+                state['errors'].append(f"Error generating visualization: {image}")
+                continue
+            state['visualization'] = image
+            state['visualization_format'] = chart_config['format']
+            if state.get('report_model') is not None:
+                state['report_model'].chart = image
+                state['report_model'].chart_format = chart_config['format']
+                render_reports(state)
+        return states
+
+    def export(self, sql_query: str, path: str, file_format: Optional[str] = None) -> str:
+        """
+        Streams every row of a query to a Parquet or CSV file, e.g. the validated 'sql_query' of a final state.
+
+        Args:
+            sql_query (str): The SQL query.
+            path (str): Path of the exported file.
+            file_format (str): 'parquet' or 'csv', inferred from the file extension by default.
+        Returns:
+            str: The path of the exported file.
+        """
+        return export_query_result(self.db.cursor(), sql_query, path, file_format)
+
+    def close(self) -> None:
+        """
+        Closes the shared DuckDB connection and the chart worker processes.
+        """
+        self.chart_pool.close()
+        self.db.close()
+
+    def __enter__(self) -> "ReportEngine":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
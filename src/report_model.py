@@ -0,0 +1,94 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+from config import REPORT_TABLE_ROWS
+from query_results import dataframe_stats
+from tracing import summarize_trace
+
+
+@dataclass
+class ReportModel:
+    """
+    Structured content of the report of a single request.
+
+    The workflow builds it once from the query result, and every output
+    format (markdown, HTML, PDF) is rendered from it.
+    """
+    user_request: str
+    sql_query: str
+    summary: List[Tuple[str, str]]
+    table: pd.DataFrame
+    total_rows: int
+    rollup_table: str = ""
+    chart: Optional[bytes] = None
+    chart_format: str = ""
+    chart_figsize: Tuple[float, float] = (10, 6)
+    trace: List[Dict[str, str]] = field(default_factory=list)
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def truncated(self) -> bool:
+        """
+        Whether the table only shows the first rows of the query result.
+        """
+        return self.total_rows > len(self.table)
+
+
+def summarize_result(stats: Dict[str, Any], rollup_table: str = "",
+                     row_cap_hit: bool = False) -> List[Tuple[str, str]]:
+    """
+    Formats the summary statistics of a query result.
+
+    Args:
+        stats (dict): Statistics of the full result (see `query_results.result_stats`).
+        rollup_table (str): Rollup table the query was answered from, if any.
+        row_cap_hit (bool): Whether the result was truncated by the row cap.
+    Returns:
+        list: Pairs of label and formatted value, in display order.
+    """
+    columns = stats['columns']
+    summary = [("Total records", str(stats['rows']))]
+    if row_cap_hit:
+        summary.append(("Row cap reached", f"only the first {stats['rows']} rows were fetched"))
+    if rollup_table:
+        summary.append(("Answered from rollup table", rollup_table))
+
+    # Add specific statistics based on available columns
+    if columns.get('total_quantity', {}).get('sum') is not None:
+        summary.append(("Total quantity", f"{columns['total_quantity']['sum']:.2f}"))
+        summary.append(("Average quantity", f"{columns['total_quantity']['mean']:.2f}"))
+
+    if 'values' in columns.get('Description', {}):
+        summary.append(("Included descriptions", ', '.join(map(str, columns['Description']['values']))))
+
+    if 'values' in columns.get('Country', {}):
+        summary.append(("Included countries", ', '.join(map(str, columns['Country']['values']))))
+    return summary
+
+
+def build_report_model(state: Dict[str, Any], table_rows: int = REPORT_TABLE_ROWS) -> ReportModel:
+    """
+    Builds the report model of a final workflow state.
+
+    Args:
+        state (State): State holding the request, SQL, query result and chart.
+        table_rows (int): Number of rows of the query result shown in the table.
+    Returns:
+        ReportModel: The report content.
+    """
+    query_result = state['query_result']
+    # The query result may only be a preview, the statistics describe the full result
+    stats = state.get('result_stats') or dataframe_stats(query_result)
+    spec = state.get('chart_spec') or {}
+    return ReportModel(user_request=state['user_request'],
+                       sql_query=state['sql_query'],
+                       summary=summarize_result(stats, state.get('rollup_table', ""),
+                                                state.get('row_cap_hit', False)),
+                       table=query_result.head(table_rows),
+                       total_rows=stats['rows'],
+                       rollup_table=state.get('rollup_table', ""),
+                       chart=state.get('visualization'),
+                       chart_format=state.get('visualization_format', ""),
+                       chart_figsize=tuple(spec.get('figsize', (10, 6))),
+                       trace=summarize_trace(state.get('trace') or []) if state.get('trace_in_report') else [])
@@ -0,0 +1,163 @@
+import io
+import base64
+import html
+from functools import lru_cache
+from xml.sax.saxutils import escape
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+from report_model import ReportModel
+
+
+def render_markdown(model: ReportModel) -> str:
+    """
+    Renders a report as markdown.
+
+    Args:
+        model (ReportModel): The report content.
+    Returns:
+        str: The markdown report.
+    """
+    report = f"# Report Generated Based on Request\n\n"
+    report += f"**Original request:** {model.user_request}\n\n"
+    report += f"**Executed SQL query:**\n```sql\n{model.sql_query}\n```\n\n"
+
+    report += f"## Data Summary\n\n"
+    report += "".join(f"- {label}: {value}\n" for label, value in model.summary)
+
+    report += f"\n## Detailed Data\n\n"
+    report += model.table.to_markdown() + "\n"
+    if model.truncated:
+        report += f"\n*Showing {len(model.table)} of {model.total_rows} records*\n"
+    if model.trace:
+        report += f"\n## Run Trace\n\n"
+        report += pd.DataFrame(model.trace).to_markdown(index=False) + "\n"
+    return report
+
+
+def render_html(model: ReportModel) -> str:
+    """
+    Renders a report as a standalone HTML document, with the chart embedded.
+
+    Args:
+        model (ReportModel): The report content.
+    Returns:
+        str: The HTML report.
+    """
+    parts = [
+        "<!DOCTYPE html>",
+        "<html><head><meta charset='utf-8'>",
+        f"<title>{html.escape(model.user_request)}</title></head><body>",
+        "<h1>Report Generated Based on Request</h1>",
+        f"<p><b>Original request:</b> {html.escape(model.user_request)}</p>",
+        f"<p><b>Executed SQL query:</b></p><pre><code>{html.escape(model.sql_query)}</code></pre>",
+        "<h2>Data Summary</h2>",
+        "<ul>" + "".join(f"<li>{html.escape(label)}: {html.escape(value)}</li>"
+                         for label, value in model.summary) + "</ul>",
+        "<h2>Detailed Data</h2>",
+        model.table.to_html(index=False, border=1),
+    ]
+    if model.truncated:
+        parts.append(f"<p><i>Showing {len(model.table)} of {model.total_rows} records</i></p>")
+    if model.chart is not None:
+        parts.append("<h2>Visualization</h2>")
+        if model.chart_format == 'svg':
+            parts.append(model.chart.decode())
+        else:
+            parts.append(f"<img alt='Visualization' src='data:image/{model.chart_format};base64,"
+                         f"{base64.b64encode(model.chart).decode()}'>")
+    if model.trace:
+        parts.append("<h2>Run Trace</h2>")
+        parts.append(pd.DataFrame(model.trace).to_html(index=False, border=1))
+    parts.append("</body></html>")
+    return "\n".join(parts)
+
+
+def render_pdf_section(model: ReportModel, index: int, styles: Any) -> List[Any]:
+    """
+    Renders a report as the PDF flowables of one section of a multi-query report.
+
+    Args:
+        model (ReportModel): The report content.
+        index (int): Position of the section in the PDF.
+        styles (StyleSheet1): ReportLab styles used in the document.
+    Returns:
+        list: ReportLab flowables of the section.
+    """
+    # ReportLab is only loaded by the PDF reports
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, Spacer, Table
+    from reportlab.platypus import Image as ReportLabImage
+
+    heading1_style = styles['Heading1']
+    heading2_style = styles['Heading2']
+    normal_style = styles['Normal']
+
+    # Add section title (query number)
+    elements = [Paragraph(f"Analysis {index+1}: {escape(model.user_request)}", heading1_style),
+                Spacer(1, 0.25*inch)]
+
+    elements.append(Paragraph("<b>Executed SQL query:</b>", normal_style))
+    elements.append(Paragraph(f"<font face='Courier'>{escape(model.sql_query)}</font>", normal_style))
+    elements.append(Spacer(1, 0.1*inch))
+
+    elements.append(Paragraph("Data Summary", heading2_style))
+    for label, value in model.summary:
+        elements.append(Paragraph(f"• {escape(label)}: {escape(value)}", normal_style))
+    elements.append(Spacer(1, 0.2*inch))
+
+    elements.append(Paragraph("Detailed Data", heading2_style))
+    # Header and rows are converted column-wise, not row by row
+    table_data = [list(map(str, model.table.columns))] + model.table.astype(str).values.tolist()
+    table = Table(table_data, repeatRows=1)
+    table.setStyle(table_style())
+    elements.append(table)
+    if model.truncated:
+        elements.append(Paragraph(f"*Showing {len(model.table)} of {model.total_rows} records*", normal_style))
+
+    # Add the chart rendered by the workflow
+    if model.chart is not None:
+        elements.append(Spacer(1, 0.3*inch))
+        elements.append(Paragraph("Visualization", heading2_style))
+        if model.chart_format == 'png':
+            width, height = model.chart_figsize
+            elements.append(ReportLabImage(io.BytesIO(model.chart), width=6*inch, height=6*inch*height/width))
+        else:
+            elements.append(Paragraph("The PDF report can only embed PNG charts.", normal_style))
+
+    if model.trace:
+        elements.append(Spacer(1, 0.3*inch))
+        elements.append(Paragraph("Run Trace", heading2_style))
+        trace = Table([list(model.trace[0])] + [list(row.values()) for row in model.trace], repeatRows=1)
+        trace.setStyle(table_style())
+        elements.append(trace)
+    return elements
+
+
+@lru_cache(maxsize=1)
+def table_style() -> Any:
+    """
+    Returns the style of the PDF tables.
+    """
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+    ])
+
+
+# Text renderers by report format, used by the workflow and the CLIs
+TEXT_RENDERERS: Dict[str, Callable[[ReportModel], str]] = {
+    "markdown": render_markdown,
+    "html": render_html,
+}
@@ -0,0 +1,371 @@
+import os
+import json
+import shutil
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from job_queue import JobQueue
+from llm_client import FakeLLM
+from generate_multiple_business_report import generate_multi_query_report
+from config import SERVER_HOST, SERVER_PORT, SERVER_WORKERS, JOB_POLL_SECONDS, MAX_CONCURRENT_QUERIES
+from config import CHART_FORMAT, CHART_DPI, CHART_DRAFT_DPI, REPORT_FORMATS, STORAGE_BACKEND
+
+if TYPE_CHECKING:
+    # The engine is only imported by `serve`, so `submit` and `status` start quickly
+    from report_engine import ReportEngine
+
+
+def jobs_folder() -> str:
+    """
+    Returns the folder holding the files produced by the jobs (PDFs, charts), creating it if needed.
+    """
+    folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'reports', 'jobs')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def parse_job(body: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Validates the body of a job submission.
+
+    A single request (`user_request` as a string) gives a 'report' job, whose
+    text reports and chart are returned; a list of requests gives a 'multi'
+    job, which writes a multi-query PDF.
+
+    Args:
+        body (dict): `user_request` and the optional `report_formats`, `chart_format`, `draft`,
+            `use_result_cache` and, for a single request, `use_sql_cache` or, for a list, `title` and `stream`.
+    Returns:
+        tuple: The job kind and its payload, holding every option with its default.
+    """
+    user_request = body.get('user_request')
+    if isinstance(user_request, str) and user_request.strip():
+        payload = {"user_request": user_request.strip(),
+                   "report_formats": list(body.get('report_formats', REPORT_FORMATS)),
+                   "chart_format": body.get('chart_format', CHART_FORMAT),
+                   "use_sql_cache": bool(body.get('use_sql_cache', True))}
+        unsupported = set(payload['report_formats']) - {"markdown", "html"}
+        if unsupported:
+            raise ValueError(f"Unsupported report formats: {', '.join(sorted(unsupported))}")
+        if payload['chart_format'] not in ("png", "svg"):
+            raise ValueError(f"Unsupported chart format: {payload['chart_format']}")
+        kind = "report"
+    elif isinstance(user_request, list) and user_request and all(isinstance(r, str) and r.strip()
+                                                                  for r in user_request):
+        payload = {"user_request": [r.strip() for r in user_request],
+                   "title": str(body.get('title', "Consolidated Analytical Report")),
+                   "stream": bool(body.get('stream', False))}
+        kind = "multi"
+    else:
+        raise ValueError("'user_request' must be a non-empty string or list of strings")
+    payload.update({"draft": bool(body.get('draft', False)),
+                    "use_result_cache": bool(body.get('use_result_cache', True))})
+    return kind, payload
+
+
+class ReportWorkers:
+    """
+    Worker threads running the queued jobs on one warm report engine.
+
+    The engine keeps the compiled workflow, the LLM client and the caches
+    for the lifetime of the process, so a job only pays for its own queries.
+    The DuckDB database stays open while jobs run and is released as soon as
+    no job is running, so `extract_and_write_data.py` can load new data
+    between jobs and the next job sees it. Workers are woken up when a job is
+    submitted in this process and poll the queue for jobs submitted by other processes.
+    """
+
+    def __init__(self,
+                 engine: "ReportEngine",
+                 queue: JobQueue,
+                 workers: int = SERVER_WORKERS,
+                 poll_seconds: float = JOB_POLL_SECONDS,
+                 max_concurrent_queries: int = MAX_CONCURRENT_QUERIES):
+        self.engine = engine
+        self.queue = queue
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.max_concurrent_queries = max_concurrent_queries
+        self._stop = threading.Event()
+        self._threads = []
+        self._running = 0
+        self._running_lock = threading.Lock()
+
+    def start(self) -> None:
+        requeued, expired = self.queue.recover()
+        for job_id in expired:
+            shutil.rmtree(os.path.join(jobs_folder(), job_id), ignore_errors=True)
+        if requeued:
+            print(f"Requeued {requeued} jobs interrupted by a previous server")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"report-worker-{i+1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """
+        Stops the workers once their current job is finished.
+        """
+        self._stop.set()
+        with self.queue.changed:
+            self.queue.changed.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                with self.queue.changed:
+                    self.queue.changed.wait(self.poll_seconds)
+                continue
+            with self._running_lock:
+                self._running += 1
+            try:
+                result, errors = self.run_job(job)
+            except Exception as e:
+                self.queue.fail(job['job_id'], f"Error while running the job: {e}")
+                continue
+            finally:
+                with self._running_lock:
+                    self._running -= 1
+                    if self._running == 0:
+                        # No query runs: release the database file to loaders until the next job
+                        self.engine.db.refresh()
+            if errors:
+                self.queue.fail(job['job_id'], "; ".join(errors), result)
+            else:
+                self.queue.complete(job['job_id'], result)
+
+    def run_job(self, job: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Runs a claimed job on the engine.
+
+        Args:
+            job (dict): The job, as returned by `JobQueue.claim`.
+        Returns:
+            tuple: The job result and the errors of its requests.
+        """
+        payload = job['payload']
+        output_folder = os.path.join(jobs_folder(), job['job_id'])
+        os.makedirs(output_folder, exist_ok=True)
+        dpi = CHART_DRAFT_DPI if payload['draft'] else CHART_DPI
+
+        if job['kind'] == "multi":
+            pdf_path = os.path.join(output_folder, "report.pdf")
+            start = time.perf_counter()
+            final_states = generate_multi_query_report(payload['user_request'], filename=pdf_path,
+                                                       title=payload['title'],
+                                                       max_workers=self.max_concurrent_queries,
+                                                       engine=self.engine,
+                                                       use_result_cache=payload['use_result_cache'],
+                                                       draft=payload['draft'], stream=payload['stream'])
+            result = {"pdf_path": pdf_path if os.path.exists(pdf_path) else None,
+                      "elapsed_seconds": round(time.perf_counter() - start, 3),
+                      "queries": [{"user_request": state['user_request'],
+                                   "sql_query": state.get('sql_query', ""),
+                                   "errors": state['errors'],
+                                   "elapsed_seconds": round(state['elapsed_seconds'], 3)}
+                                  for state in final_states]}
+            errors = [error for state in final_states for error in state['errors']]
+            return result, errors
+
+        state = self.engine.run(payload['user_request'],
+                                use_sql_cache=payload['use_sql_cache'],
+                                use_result_cache=payload['use_result_cache'],
+                                chart_config={"format": payload['chart_format'], "dpi": dpi},
+                                report_formats=payload['report_formats'])
+        chart_path = None
+        if state.get('visualization') is not None:
+            chart_path = os.path.join(output_folder, f"visualization.{state['visualization_format']}")
+            with open(chart_path, "wb") as f:
+                f.write(state['visualization'])
+        result = {"sql_query": state.get('sql_query', ""),
+                  "reports": state.get('reports') or {},
+                  "chart_path": chart_path,
+                  "sql_cache_hit": state.get('sql_cache_hit', False),
+                  "result_cache_hit": state.get('result_cache_hit', False),
+                  "elapsed_seconds": round(state['elapsed_seconds'], 3)}
+        return result, state['errors']
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the report server.
+
+    POST /jobs                submits a job (see `parse_job`), 202 with its id, or 200 with the id of the
+                              identical in-flight job
+    GET  /jobs                lists the recent jobs (?status=...&limit=...)
+    GET  /jobs/<id>           returns the status and result of a job, ?wait=<seconds> waits for it to finish
+    GET  /jobs/<id>/pdf       downloads the PDF of a finished multi-query job
+    GET  /jobs/<id>/chart     downloads the chart of a finished single-request job
+    GET  /health              returns the queue counts, the workers and the cache statistics
+    """
+
+    server_version = "ReportServer/1.0"
+
+    @property
+    def app(self) -> "ReportServer":
+        return self.server.app
+
+    def _send_json(self, status: int, body: Any) -> None:
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_file(self, path: Optional[str], content_type: str) -> None:
+        if not path or not os.path.exists(path):
+            self._send_json(404, {"error": "File not found"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            kind, payload = parse_job(body)
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        job_id, deduplicated = self.app.queue.submit(kind, payload)
+        self._send_json(200 if deduplicated else 202,
+                        {"job_id": job_id, "status": self.app.queue.get(job_id)['status'],
+                         "deduplicated": deduplicated})
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            limit = int(query.get("limit", [50])[0])
+            wait = float(query.get("wait", [0])[0])
+        except ValueError as e:
+            self._send_json(400, {"error": f"Invalid query parameter: {e}"})
+            return
+        if parts == ["health"]:
+            self._send_json(200, self.app.health())
+        elif parts == ["jobs"]:
+            status = query.get("status", [None])[0]
+            self._send_json(200, self.app.queue.list(status, limit))
+        elif len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.app.queue.wait(parts[1], wait) if wait > 0 else self.app.queue.get(parts[1])
+            if job is None:
+                self._send_json(404, {"error": f"Unknown job {parts[1]}"})
+            elif len(parts) == 2:
+                self._send_json(200, job)
+            elif parts[2] == "pdf":
+                self._send_file((job['result'] or {}).get('pdf_path'), "application/pdf")
+            elif parts[2] == "chart":
+                chart_path = (job['result'] or {}).get('chart_path')
+                self._send_file(chart_path, "image/svg+xml" if str(chart_path).endswith(".svg") else "image/png")
+            else:
+                self._send_json(404, {"error": "Not found"})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+
+class ReportServer:
+    """
+    Long-running report service: a local HTTP API in front of the job queue and its warm workers.
+    """
+
+    def __init__(self, engine: "ReportEngine", queue: Optional[JobQueue] = None, workers: int = SERVER_WORKERS,
+                 host: str = SERVER_HOST, port: int = SERVER_PORT):
+        self.engine = engine
+        self.queue = queue if queue is not None else JobQueue()
+        self.workers = ReportWorkers(engine, self.queue, workers)
+        self.httpd = ThreadingHTTPServer((host, port), ReportRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.app = self
+        self._serving = False
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    def health(self) -> Dict[str, Any]:
+        return {"jobs": self.queue.counts(),
+                "workers": self.workers.workers,
+                "sql_cache": self.engine.sql_cache.stats() if self.engine.sql_cache is not None else None,
+                "result_cache": self.engine.result_cache.stats() if self.engine.result_cache is not None else None}
+
+    def serve_forever(self) -> None:
+        """
+        Starts the workers and serves HTTP requests until interrupted, then stops the workers and the engine.
+        """
+        self.workers.start()
+        self._serving = True
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def start(self) -> None:
+        """
+        Starts the workers and serves HTTP requests in a background thread.
+        """
+        self.workers.start()
+        self._serving = True
+        threading.Thread(target=self.httpd.serve_forever, name="report-http", daemon=True).start()
+
+    def close(self) -> None:
+        """
+        Stops serving, waits for the running jobs and closes the engine.
+        """
+        # shutdown() returns once serve_forever has exited, it would block if it never ran
+        if self._serving:
+            self.httpd.shutdown()
+        self.httpd.server_close()
+        self.workers.stop()
+        self.engine.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report server: HTTP API and SQLite job queue with warm workers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="Run the HTTP API and the workers")
+    serve.add_argument("--host", default=SERVER_HOST, help="Address the HTTP API listens on")
+    serve.add_argument("--port", type=int, default=SERVER_PORT, help="Port of the HTTP API")
+    serve.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Number of jobs run at the same time")
+    serve.add_argument("--fake_llm", action="store_true", help="Generate the SQL offline with the fake LLM")
+    serve.add_argument("--storage", default=STORAGE_BACKEND, choices=["duckdb", "parquet"],
+                       help="Query the DuckDB file or its Parquet export, which needs no database file lock")
+    submit = subparsers.add_parser("submit", help="Add a job to the queue without going through the HTTP API")
+    submit.add_argument("user_request", nargs="+", help="One request for a report job, several for a PDF job")
+    status = subparsers.add_parser("status", help="Print a job")
+    status.add_argument("job_id", help="Id of the job")
+    status.add_argument("--wait", type=float, default=0, help="Wait up to this many seconds for the job to finish")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        from report_engine import ReportEngine
+        server = ReportServer(ReportEngine(llm=FakeLLM() if args.fake_llm else None, storage=args.storage),
+                              workers=args.workers, host=args.host, port=args.port)
+        host, port = server.address
+        print(f"Serving reports on http://{host}:{port} with {args.workers} workers")
+        server.serve_forever()
+    elif args.command == "submit":
+        user_requests = args.user_request
+        kind, payload = parse_job({"user_request": user_requests[0] if len(user_requests) == 1 else user_requests})
+        job_id, deduplicated = JobQueue().submit(kind, payload)
+        print(f"{job_id}{' (already in flight)' if deduplicated else ''}")
+    else:
+        job = JobQueue().wait(args.job_id, args.wait) if args.wait > 0 else JobQueue().get(args.job_id)
+        print(json.dumps(job, indent=2, default=str) if job is not None else f"Unknown job {args.job_id}")
@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import uuid
+from typing import Optional, Dict, Any, Tuple
+
+import duckdb
+import pandas as pd
+from config import RESULT_CACHE_FOLDER, RESULT_CACHE_MAX_BYTES, LOAD_METADATA_TABLE
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Normalizes a SQL query so that whitespace and a trailing semicolon do not
+    change its cache key. String literals are kept untouched.
+    """
+    parts = re.split(r"('(?:[^']|'')*')", sql_query.strip().rstrip(";").strip())
+    return "".join(part if part.startswith("'") else re.sub(r"\s+", " ", part) for part in parts)
+
+
+def get_data_version(conn: duckdb.DuckDBPyConnection, db_path: Optional[str] = None) -> str:
+    """
+    Returns a stamp that changes whenever extract_and_write_data loads new data.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        db_path (str): Path of the database file, used when there is no load metadata.
+    Returns:
+        str: The data version stamp.
+    """
+    has_metadata = conn.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [LOAD_METADATA_TABLE]
+    ).fetchone()[0]
+    if has_metadata:
+        load_id, loaded_at = conn.execute(
+            f"SELECT MAX(load_id), MAX(loaded_at) FROM {LOAD_METADATA_TABLE}"
+        ).fetchone()
+        return f"load:{load_id}:{loaded_at}"
+    if db_path is not None and os.path.exists(db_path):
+        # Databases loaded before the load metadata existed fall back to the file stamp
+        stat = os.stat(db_path)
+        return f"file:{stat.st_mtime_ns}:{stat.st_size}"
+    return "unknown"
+
+
+class ResultCache:
+    """
+    On-disk cache of query results stored as Parquet files.
+
+    Results are keyed on the normalized SQL and the data version, so a new load
+    of the data never serves stale results. Once the cache grows past
+    `max_bytes`, the least recently used files are evicted.
+    """
+
+    def __init__(self, folder: Optional[str] = None, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        if folder is None:
+            folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db', RESULT_CACHE_FOLDER)
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self) -> duckdb.DuckDBPyConnection:
+        # In-memory connection of the calling thread, used to read and write the Parquet files
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = duckdb.connect()
+        return conn
+
+    def _path(self, sql_query: str, data_version: str) -> str:
+        key = hashlib.sha256(f"{normalize_sql(sql_query)}|{data_version}".encode()).hexdigest()
+        return os.path.join(self.folder, f"{key}.parquet")
+
+    def get(self, sql_query: str, data_version: str) -> Optional[pd.DataFrame]:
+        """
+        Returns the cached result of a query, or None on a miss.
+
+        Args:
+            sql_query (str): The executed SQL query.
+            data_version (str): Version of the data the query runs against.
+        Returns:
+            Optional[pd.DataFrame]: The cached result, if any.
+        """
+        path = self._path(sql_query, data_version)
+        try:
+            result = self._connection().execute("SELECT * FROM read_parquet(?)", [path]).df()
+            # The modification time orders the files for the LRU eviction
+            os.utime(path)
+        except (duckdb.Error, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def get_metadata(self, sql_query: str, data_version: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the metadata stored with a cached result, or None if there is none.
+        """
+        try:
+            with open(self._path(sql_query, data_version)[:-len(".parquet")] + ".json", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def lookup(self, sql_query: str, data_version: str) -> Tuple[Optional[pd.DataFrame], Optional[Dict[str, Any]]]:
+        """
+        Returns the cached result of a query with its metadata, counting a miss if either is missing.
+
+        Args:
+            sql_query (str): The executed SQL query.
+            data_version (str): Version of the data the query runs against.
+        Returns:
+            tuple: The cached result and its metadata, or (None, None) on a miss.
+        """
+        metadata = self.get_metadata(sql_query, data_version)
+        if metadata is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+        result = self.get(sql_query, data_version)
+        return (result, metadata) if result is not None else (None, None)
+
+    def put(self, sql_query: str, data_version: str, result: pd.DataFrame,
+            metadata: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Stores the result of a query and evicts the least recently used results.
+
+        Args:
+            sql_query (str): The executed SQL query.
+            data_version (str): Version of the data the query ran against.
+            result (pd.DataFrame): The query result.
+            metadata (dict): JSON-serializable data stored next to the result, e.g. its statistics.
+        """
+        if len(result.columns) == 0:
+            return
+        path = self._path(sql_query, data_version)
+        if metadata is not None:
+            # Written before the result, so a cached result always finds its metadata
+            metadata_path = path[:-len(".parquet")] + ".json"
+            tmp_metadata_path = f"{metadata_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_metadata_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f, default=str)
+            os.replace(tmp_metadata_path, metadata_path)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        conn = self._connection()
+        conn.register("result", result)
+        try:
+            conn.execute("COPY result TO '{}' (FORMAT PARQUET)".format(tmp_path.replace("'", "''")))
+        finally:
+            conn.unregister("result")
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith(".parquet"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                for file_path in (path, path[:-len(".parquet")] + ".json"):
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+
+    def clear(self) -> None:
+        """
+        Removes every cached result.
+        """
+        with self._lock:
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith((".parquet", ".json")):
+                    os.remove(entry.path)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit/miss counters and the size of the cache.
+        """
+        sizes = [entry.stat().st_size for entry in os.scandir(self.folder) if entry.name.endswith(".parquet")]
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(sizes),
+            "bytes": sum(sizes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
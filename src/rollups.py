@@ -0,0 +1,404 @@
+import re
+import time
+import argparse
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+from config import TABLE_NAME, ROLLUP_METADATA_TABLE, LOAD_METADATA_TABLE, PARQUET_PARTITION_COLUMNS
+from db_connection import get_database_path
+
+
+# Summary tables maintained over the fact table. Each one keeps the same column
+# names as the fact table (InvoiceDate truncated to the grain, Quantity summed),
+# plus the pre-computed revenue and number of fact rows.
+ROLLUPS: List[Dict] = [
+    {"name": "sales_rollup_monthly_country", "grain": "month", "dimensions": ["Country"]},
+    {"name": "sales_rollup_monthly", "grain": "month", "dimensions": ["Country", "StockCode"]},
+    {"name": "sales_rollup_daily", "grain": "day", "dimensions": ["Country", "StockCode"]},
+]
+
+# Columns of the fact table that are only available as dimensions of some rollups
+DIMENSION_COLUMNS = ["Country", "StockCode"]
+# Columns that no rollup table keeps, only the shared aggregates of a batch group on them
+NON_ROLLUP_COLUMNS = ["InvoiceNo", "Description", "CustomerID"]
+# Columns only available inside the supported aggregates
+MEASURE_COLUMNS = ["Quantity", "UnitPrice"]
+
+GRAIN_ORDER = {"month": 0, "day": 1}
+
+# Aggregates over the fact table and their equivalent over a rollup
+AGGREGATE_REWRITES = [
+    (re.compile(r'SUM\(\s*"?Quantity"?\s*\*\s*"?UnitPrice"?\s*\)', re.IGNORECASE), "SUM(Revenue)"),
+    (re.compile(r'SUM\(\s*"?UnitPrice"?\s*\*\s*"?Quantity"?\s*\)', re.IGNORECASE), "SUM(Revenue)"),
+    (re.compile(r'SUM\(\s*"?Quantity"?\s*\)', re.IGNORECASE), "SUM(Quantity)"),
+    (re.compile(r'COUNT\(\s*\*\s*\)', re.IGNORECASE), "SUM(RowCount)"),
+]
+
+# The only aggregates a rollup answers like the fact table: the rewritten measures, and the
+# distinct count, min and max of a dimension. Any other one (COUNT(Country), AVG(...), ...)
+# would be computed over the rollup rows instead of the fact rows.
+ALLOWED_AGGREGATES = re.compile(
+    r'SUM\((Revenue|Quantity|RowCount)\)'
+    r'|(COUNT\(\s*DISTINCT|MIN\(|MAX\()\s*"?(' + "|".join(DIMENSION_COLUMNS + NON_ROLLUP_COLUMNS) + r')"?\s*\)',
+    re.IGNORECASE,
+)
+
+# Time expressions that give the same result over a rollup truncated to the grain,
+# with the finest grain they need. Literals are replaced by __LITn__ placeholders.
+TIME_EXPRESSIONS = [
+    re.compile(r'DATE_TRUNC\(\s*(__LIT\d+__)\s*,\s*"?InvoiceDate"?\s*\)', re.IGNORECASE),
+    re.compile(r'STRFTIME\(\s*"?InvoiceDate"?\s*,\s*(__LIT\d+__)\s*\)', re.IGNORECASE),
+    re.compile(r'EXTRACT\(\s*(\w+)\s+FROM\s+"?InvoiceDate"?\s*\)', re.IGNORECASE),
+    re.compile(r'\b(YEAR|QUARTER|MONTH|MONTHNAME|DAY|DAYOFWEEK|DAYNAME|WEEK|DATE)\(\s*"?InvoiceDate"?\s*\)', re.IGNORECASE),
+    re.compile(r'CAST\(\s*"?InvoiceDate"?\s+AS\s+(DATE)\s*\)', re.IGNORECASE),
+    re.compile(r'"?InvoiceDate"?\s*::\s*(DATE)\b', re.IGNORECASE),
+]
+
+MONTH_PARTS = {"year", "quarter", "month", "monthname"}
+DAY_PARTS = MONTH_PARTS | {"week", "day", "dayofweek", "dayname", "date"}
+MONTH_FORMATS = {"%Y", "%y", "%m", "%B", "%b"}
+DAY_FORMATS = MONTH_FORMATS | {"%d", "%e", "%A", "%a", "%j", "%F", "%x", "%w", "%u", "%V", "%W"}
+
+
+@lru_cache(maxsize=1)
+def aggregate_functions() -> frozenset:
+    """
+    Returns the names of the aggregate functions of DuckDB, in lower case.
+    """
+    conn = duckdb.connect()
+    try:
+        return frozenset(row[0].lower() for row in conn.execute(
+            "SELECT DISTINCT function_name FROM duckdb_functions() WHERE function_type = 'aggregate'"
+        ).fetchall())
+    finally:
+        conn.close()
+
+
+def aggregate_select(fact_table: str, grain: Optional[str], dimensions: List[str], where: str = "") -> str:
+    """
+    Returns the query of a rollup-shaped aggregate of the fact table.
+
+    Args:
+        fact_table (str): Name of the fact table.
+        grain (str): 'month' or 'day' to keep InvoiceDate truncated to it, None to drop InvoiceDate.
+        dimensions (list): Columns of the fact table kept as dimensions.
+        where (str): Optional WHERE clause over the fact table.
+    Returns:
+        str: The SELECT statement.
+    """
+    keys = ([f"DATE_TRUNC('{grain}', InvoiceDate) AS InvoiceDate"] if grain else []) + list(dimensions)
+    order_by = (["InvoiceDate"] if grain else []) + list(dimensions)
+    return f"""
+        SELECT {"".join(key + ", " for key in keys)}
+               SUM(Quantity) AS Quantity,
+               SUM(Quantity * UnitPrice) AS Revenue,
+               COUNT(*) AS RowCount
+        FROM {fact_table}
+        {where}
+        GROUP BY ALL
+        {"ORDER BY " + ", ".join(order_by) if order_by else ""}
+    """
+
+
+def _rollup_select(fact_table: str, rollup: Dict, where: str = "") -> str:
+    return aggregate_select(fact_table, rollup["grain"], rollup["dimensions"], where)
+
+
+def _record_rollups(conn: duckdb.DuckDBPyConnection, load_id: Optional[int]) -> None:
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TABLE {ROLLUP_METADATA_TABLE} (
+            rollup_name VARCHAR,
+            grain VARCHAR,
+            dimensions VARCHAR,
+            row_count BIGINT,
+            load_id BIGINT,
+            built_at TIMESTAMP
+        )
+        """
+    )
+    for rollup in ROLLUPS:
+        row_count = conn.execute(f"SELECT COUNT(*) FROM {rollup['name']}").fetchone()[0]
+        conn.execute(
+            f"INSERT INTO {ROLLUP_METADATA_TABLE} VALUES (?, ?, ?, ?, ?, current_localtimestamp())",
+            [rollup["name"], rollup["grain"], ",".join(rollup["dimensions"]), row_count, load_id],
+        )
+
+
+def build_rollups(conn: duckdb.DuckDBPyConnection,
+                  fact_table: str = TABLE_NAME,
+                  load_id: Optional[int] = None) -> None:
+    """
+    Builds (or rebuilds) every rollup table from the fact table.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Read-write connection to the DuckDB database.
+        fact_table (str): Name of the fact table.
+        load_id (int): Load the rollups are consistent with, see the load metadata table.
+    """
+    for rollup in ROLLUPS:
+        conn.execute(f"CREATE OR REPLACE TABLE {rollup['name']} AS {_rollup_select(fact_table, rollup)}")
+    _record_rollups(conn, load_id)
+
+
+def refresh_rollups(conn: duckdb.DuckDBPyConnection,
+                    since,
+                    fact_table: str = TABLE_NAME,
+                    load_id: Optional[int] = None) -> None:
+    """
+    Recomputes only the rollup periods touched by rows appended after `since`.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Read-write connection to the DuckDB database.
+        since (datetime): High-water mark of the fact table before the append.
+        fact_table (str): Name of the fact table.
+        load_id (int): Load the rollups are consistent with, see the load metadata table.
+    """
+    for rollup in ROLLUPS:
+        period_start = f"DATE_TRUNC('{rollup['grain']}', CAST(? AS TIMESTAMP))"
+        conn.execute(f"DELETE FROM {rollup['name']} WHERE InvoiceDate >= {period_start}", [since])
+        conn.execute(
+            f"INSERT INTO {rollup['name']} BY NAME "
+            f"{_rollup_select(fact_table, rollup, where=f'WHERE InvoiceDate >= {period_start}')}",
+            [since],
+        )
+    _record_rollups(conn, load_id)
+
+
+def rollups_supported(conn: duckdb.DuckDBPyConnection, fact_table: str = TABLE_NAME) -> bool:
+    """
+    Checks whether the fact table has the columns the rollups are built from.
+    """
+    columns = {row[0] for row in conn.execute(f"DESCRIBE {fact_table}").fetchall()}
+    return {"InvoiceDate", "Quantity", "UnitPrice", *DIMENSION_COLUMNS} <= columns
+
+
+def get_available_rollups(conn: duckdb.DuckDBPyConnection) -> List[Dict]:
+    """
+    Returns the rollups that are consistent with the latest load of the fact table,
+    smallest first.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+    Returns:
+        list: Rollups with their name, grain, dimensions and number of rows.
+    """
+    tables = {row[0] for row in conn.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+    if ROLLUP_METADATA_TABLE not in tables:
+        return []
+    rows = conn.execute(
+        f"SELECT rollup_name, grain, dimensions, row_count, load_id FROM {ROLLUP_METADATA_TABLE} ORDER BY row_count"
+    ).fetchall()
+    if LOAD_METADATA_TABLE in tables:
+        # Rollups built before the latest load are stale and must not be used
+        latest_load = conn.execute(f"SELECT MAX(load_id) FROM {LOAD_METADATA_TABLE}").fetchone()[0]
+        rows = [row for row in rows if row[4] == latest_load]
+    return [
+        {"name": name, "grain": grain, "dimensions": dimensions.split(","), "row_count": row_count}
+        for name, grain, dimensions, row_count, _ in rows
+    ]
+
+
+def _time_grain(kind: str) -> Optional[str]:
+    """
+    Returns the finest grain needed by a time part or strftime format, or None if no rollup can answer it.
+    """
+    if kind.startswith("%") or " " in kind or "-" in kind:
+        formats = set(re.findall(r"%\w", kind))
+        if formats <= MONTH_FORMATS:
+            return "month"
+        return "day" if formats <= DAY_FORMATS else None
+    kind = kind.lower()
+    if kind in MONTH_PARTS:
+        return "month"
+    return "day" if kind in DAY_PARTS else None
+
+
+def _analyze_aggregate_query(sql_query: str, fact_table: str = TABLE_NAME) -> Optional[Dict[str, Any]]:
+    """
+    Parses a simple aggregate query over the fact table into what a rollup-shaped table must keep to answer it.
+
+    Returns:
+        dict: The query with its aggregates rewritten and literals masked, the literals, the
+        FROM pattern, and the finest grain and the dimensions needed, or None if the query
+        cannot be answered from such a table.
+    """
+    sql = sql_query.strip().rstrip(";").strip()
+    literals = []
+
+    def hide_literal(match):
+        literals.append(match.group(0)[1:-1].replace("''", "'"))
+        return f"__LIT{len(literals) - 1}__"
+
+    # String literals are hidden so their content is never taken for a column
+    masked = re.sub(r"'(?:[^']|'')*'", hide_literal, sql)
+    if ";" in masked or "--" in masked or "/*" in masked:
+        return None
+    if len(re.findall(r"\bSELECT\b", masked, re.IGNORECASE)) != 1:
+        return None
+    if re.search(r"\b(JOIN|UNION|INTERSECT|EXCEPT|OVER|QUALIFY|WITH)\b|\*\s*(,|FROM)", masked, re.IGNORECASE):
+        return None
+    from_pattern = re.compile(
+        rf"\bFROM\s+{fact_table}\b(?=\s*(WHERE|GROUP|HAVING|ORDER|LIMIT|$))", re.IGNORECASE
+    )
+    if from_pattern.search(masked) is None or re.search(rf"\b{fact_table}\s*\.", masked, re.IGNORECASE):
+        return None
+    for column, expression in PARQUET_PARTITION_COLUMNS.items():
+        # A select alias named like a partition column would be ambiguous
+        if re.search(rf'\bAS\s+"?{column}\b', masked, re.IGNORECASE):
+            return None
+        masked = re.sub(rf'"?\b{column}\b"?', expression, masked, flags=re.IGNORECASE)
+
+    # Replace the measure aggregates, the query must contain at least one aggregate and only allowed ones
+    rewritten = masked
+    for pattern, replacement in AGGREGATE_REWRITES:
+        rewritten = pattern.sub(replacement, rewritten)
+    calls = [match for match in re.finditer(r'\b(\w+)\s*\(', rewritten)
+             if match.group(1).lower() in aggregate_functions()]
+    if not calls or any(ALLOWED_AGGREGATES.match(rewritten, match.start()) is None for match in calls):
+        return None
+
+    # Find the grain needed by the time expressions
+    needed_grain = None
+    checked = rewritten
+    for pattern in TIME_EXPRESSIONS:
+        for match in pattern.finditer(rewritten):
+            kind = match.group(1)
+            if kind.startswith("__LIT"):
+                kind = literals[int(kind[5:-2])]
+            grain = _time_grain(kind)
+            if grain is None:
+                return None
+            if needed_grain is None or GRAIN_ORDER[grain] > GRAIN_ORDER[needed_grain]:
+                needed_grain = grain
+        checked = pattern.sub("__TIME__", checked)
+
+    # Columns of the fact table referenced outside the rewritten expressions
+    aliases = {alias.lower() for alias in re.findall(r'\bAS\s+"?(\w+)"?', checked, re.IGNORECASE)}
+    checked = re.sub(r'\bAS\s+"?\w+"?', "", checked, flags=re.IGNORECASE)
+    checked = checked.replace("SUM(Revenue)", "").replace("SUM(Quantity)", "").replace("SUM(RowCount)", "")
+    order_match = re.search(r"\bORDER\s+BY\b(.*?)(\bLIMIT\b|$)", checked, re.IGNORECASE | re.DOTALL)
+    order_clause = order_match.group(1) if order_match else ""
+    other_clauses = checked[:order_match.start()] + checked[order_match.end(1):] if order_match else checked
+
+    def references(column):
+        # Only ORDER BY resolves select aliases before the columns of the table
+        pattern = re.compile(rf'\b{column}\b', re.IGNORECASE)
+        return bool(pattern.search(other_clauses)
+                    or (pattern.search(order_clause) and column.lower() not in aliases))
+
+    needed_dimensions = [
+        column for column in DIMENSION_COLUMNS
+        if re.search(rf'\b{column}\b', checked, re.IGNORECASE)
+    ] + [column for column in NON_ROLLUP_COLUMNS if references(column)]
+    if any(references(column) for column in MEASURE_COLUMNS + ["InvoiceDate"]):
+        return None
+    return {"rewritten": rewritten, "literals": literals, "from_pattern": from_pattern,
+            "grain": needed_grain, "dimensions": needed_dimensions}
+
+
+def aggregate_requirements(sql_query: str, fact_table: str = TABLE_NAME) -> Optional[Tuple[Optional[str], List[str]]]:
+    """
+    Returns the finest grain and the dimensions a rollup-shaped table must keep to answer a query.
+
+    Args:
+        sql_query (str): SQL query over the fact table.
+        fact_table (str): Name of the fact table.
+    Returns:
+        tuple: The grain ('month', 'day' or None if InvoiceDate is not used) and the dimension
+        columns, or None if the query cannot be answered from an aggregate.
+    """
+    analysis = _analyze_aggregate_query(sql_query, fact_table)
+    return None if analysis is None else (analysis["grain"], analysis["dimensions"])
+
+
+def rewrite_query_to_rollup(sql_query: str,
+                            rollups: List[Dict],
+                            fact_table: str = TABLE_NAME) -> Tuple[str, Optional[str]]:
+    """
+    Routes an aggregate query over the fact table to the smallest rollup able to answer it.
+
+    Only simple single-table queries are rewritten: the measures must appear in
+    SUM(Quantity), SUM(Quantity * UnitPrice) or COUNT(*), the only other
+    aggregates allowed are COUNT(DISTINCT ...), MIN and MAX of a dimension,
+    InvoiceDate only appears in time expressions no finer than the rollup grain,
+    and the other columns must be rollup dimensions. The partition columns of
+    the Parquet storage are read as the time expressions they hold. Any other
+    query is returned unchanged.
+
+    Args:
+        sql_query (str): SQL query over the fact table.
+        rollups (list): Available rollups, smallest first (see `get_available_rollups`).
+        fact_table (str): Name of the fact table.
+    Returns:
+        tuple: The SQL to execute and the name of the rollup used, or None if the query was not rewritten.
+    """
+    if not rollups:
+        return sql_query, None
+    analysis = _analyze_aggregate_query(sql_query, fact_table)
+    if analysis is None:
+        return sql_query, None
+
+    needed_grain, literals = analysis["grain"], analysis["literals"]
+    for rollup in rollups:
+        if needed_grain is not None and (rollup["grain"] is None
+                                         or GRAIN_ORDER[rollup["grain"]] < GRAIN_ORDER[needed_grain]):
+            continue
+        if not set(analysis["dimensions"]) <= set(rollup["dimensions"]):
+            continue
+        rewritten = analysis["from_pattern"].sub(f"FROM {rollup['name']}", analysis["rewritten"], count=1)
+        rewritten = re.sub(r"__LIT(\d+)__",
+                           lambda m: "'" + literals[int(m.group(1))].replace("'", "''") + "'",
+                           rewritten)
+        return rewritten, rollup["name"]
+    return sql_query, None
+
+
+def benchmark_rollups(queries: List[str], repeat: int = 5) -> None:
+    """
+    Prints the execution time of each query over the fact table and over its rollup.
+
+    Args:
+        queries (list): SQL queries over the fact table.
+        repeat (int): Number of executions averaged per query.
+    """
+    conn = duckdb.connect(database=get_database_path(), read_only=True)
+    rollups = get_available_rollups(conn)
+    for sql_query in queries:
+        rewritten, rollup_name = rewrite_query_to_rollup(sql_query, rollups)
+        timings = []
+        for query in (sql_query, rewritten):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(query).fetchall()
+            timings.append((time.perf_counter() - start) / repeat)
+        print(f"{sql_query}\n  rollup: {rollup_name or '-'} | fact table: {timings[0] * 1000:.1f} ms"
+              f" | rewritten: {timings[1] * 1000:.1f} ms | speedup: {timings[0] / timings[1]:.1f}x")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the rollup tables or benchmark the query rewrite")
+    parser.add_argument("--build", action="store_true", help="Rebuild every rollup table from the fact table")
+    parser.add_argument("--benchmark", nargs="*", metavar="SQL",
+                        help="Time SQL queries over the fact table against their rollup rewrite")
+    args = parser.parse_args()
+
+    if args.build:
+        conn = duckdb.connect(database=get_database_path())
+        latest_load = None
+        if conn.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                        [LOAD_METADATA_TABLE]).fetchone()[0]:
+            latest_load = conn.execute(f"SELECT MAX(load_id) FROM {LOAD_METADATA_TABLE}").fetchone()[0]
+        build_rollups(conn, load_id=latest_load)
+        conn.close()
+        print(f"Rollup tables built: {', '.join(rollup['name'] for rollup in ROLLUPS)}")
+    if args.benchmark is not None:
+        benchmark_rollups(args.benchmark or [
+            f"SELECT Country, SUM(Quantity) AS total_quantity FROM {TABLE_NAME} GROUP BY Country",
+            f"SELECT DATE_TRUNC('month', InvoiceDate) AS month, SUM(Quantity * UnitPrice) AS total_sales "
+            f"FROM {TABLE_NAME} GROUP BY 1 ORDER BY 1",
+            f"SELECT Country, SUM(Quantity * UnitPrice) AS total_sales FROM {TABLE_NAME} "
+            f"GROUP BY Country ORDER BY total_sales DESC LIMIT 10",
+        ])
@@ -0,0 +1,226 @@
+import re
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+from config import (TABLE_NAME, LOAD_METADATA_TABLE, ROLLUP_METADATA_TABLE, SCHEMA_MAX_DISTINCT_VALUES,
+                    SCHEMA_MAX_TABLES, SCHEMA_MAX_COLUMNS, SCHEMA_SYNONYMS, PARQUET_PARTITION_COLUMNS)
+from rollups import ROLLUPS
+from result_cache import get_data_version
+
+# Bookkeeping tables and rollups are never described to the LLM, the rollup
+# rewrite routes queries over the fact table to the rollups
+INTERNAL_TABLES = {LOAD_METADATA_TABLE, ROLLUP_METADATA_TABLE} | {rollup['name'] for rollup in ROLLUPS}
+
+RANGE_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "FLOAT", "DOUBLE", "DECIMAL",
+               "DATE", "TIMESTAMP")
+TEXT_TYPES = ("VARCHAR",)
+
+
+def name_tokens(name: str) -> List[str]:
+    """
+    Splits a table or column name into lowercase words (InvoiceDate -> invoice, date).
+    """
+    return [token.lower() for token in re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+", name)]
+
+
+def singular_forms(word: str) -> set:
+    """
+    Returns a word with its possible singular forms (countries -> country, taxes -> tax, sales -> sale).
+    """
+    forms = {word}
+    if word.endswith("ies") and len(word) > 4:
+        forms.add(word[:-3] + "y")
+    elif word.endswith(("ses", "xes", "zes", "ches", "shes")):
+        # Both are kept since the "-es" rule cannot tell "taxes" from "purchases"
+        forms.update({word[:-2], word[:-1]})
+    elif word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        forms.add(word[:-1])
+    return forms
+
+
+def request_tokens(user_request: str) -> set:
+    """
+    Returns the words of a request, with their singular forms and synonyms.
+    """
+    tokens = set()
+    for word in re.findall(r"[a-z0-9]+", user_request.lower()):
+        for token in singular_forms(word):
+            tokens.add(token)
+            tokens.update(SCHEMA_SYNONYMS.get(token, []))
+    return tokens
+
+
+def quote(identifier: str) -> str:
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+class SchemaCatalog:
+    """
+    Describes the tables of the DuckDB database for the SQL prompt.
+
+    The columns are read from information_schema and the column statistics
+    (row count, value ranges, the values of low-cardinality text columns) are
+    computed once. Both are cached and only refreshed when the schema
+    fingerprint or the data version changes, so a request only pays for two
+    small metadata queries.
+    """
+
+    def __init__(self, max_distinct_values: int = SCHEMA_MAX_DISTINCT_VALUES):
+        self.max_distinct_values = max_distinct_values
+        self.fingerprint = ""
+        self.data_version = ""
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _read_columns(self, conn: duckdb.DuckDBPyConnection) -> Dict[str, List[Tuple[str, str]]]:
+        rows = conn.execute(
+            """
+            SELECT table_name, column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = 'main'
+            ORDER BY table_name, ordinal_position
+            """
+        ).fetchall()
+        columns = {}
+        for table_name, column_name, data_type in rows:
+            if table_name not in INTERNAL_TABLES:
+                columns.setdefault(table_name, []).append((column_name, data_type))
+        return columns
+
+    def _describe_table(self, conn: duckdb.DuckDBPyConnection, table_name: str,
+                        columns: List[Tuple[str, str]]) -> Dict[str, Any]:
+        # Row count, distinct counts and ranges are computed in a single scan of the table
+        expressions = ["COUNT(*)"]
+        for name, data_type in columns:
+            expressions.append(f"approx_count_distinct({quote(name)})")
+            if data_type.startswith(RANGE_TYPES):
+                expressions.append(f"MIN({quote(name)})")
+                expressions.append(f"MAX({quote(name)})")
+        values = iter(conn.execute(f"SELECT {', '.join(expressions)} FROM {quote(table_name)}").fetchone())
+        row_count = next(values)
+
+        described = []
+        for name, data_type in columns:
+            column = {"name": name, "type": data_type, "tokens": name_tokens(name), "distinct": next(values)}
+            if data_type.startswith(RANGE_TYPES):
+                column["min"], column["max"] = next(values), next(values)
+            elif data_type.startswith(TEXT_TYPES) and column["distinct"] <= self.max_distinct_values:
+                column["values"] = [value for (value,) in conn.execute(
+                    f"SELECT DISTINCT {quote(name)} FROM {quote(table_name)} "
+                    f"WHERE {quote(name)} IS NOT NULL ORDER BY 1 LIMIT {self.max_distinct_values + 1}"
+                ).fetchall()]
+                if len(column["values"]) > self.max_distinct_values:
+                    del column["values"]
+            described.append(column)
+        return {"name": table_name, "tokens": name_tokens(table_name), "rows": row_count, "columns": described}
+
+    def refresh(self, conn: duckdb.DuckDBPyConnection, db_path: Optional[str] = None) -> str:
+        """
+        Re-reads the schema and statistics if the schema or the data changed since the last call.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+            db_path (str): Path of the database file, used to version databases without load metadata.
+        Returns:
+            str: The schema fingerprint, which keys the SQL cache.
+        """
+        columns = self._read_columns(conn)
+        description = "|".join(f"{table}:" + ";".join(f"{name}:{data_type}" for name, data_type in table_columns)
+                               for table, table_columns in sorted(columns.items()))
+        fingerprint = hashlib.sha256(description.encode()).hexdigest()[:16]
+        data_version = get_data_version(conn, db_path)
+        with self._lock:
+            if fingerprint == self.fingerprint and data_version == self.data_version:
+                return fingerprint
+            self.tables = {table: self._describe_table(conn, table, table_columns)
+                           for table, table_columns in columns.items()}
+            self.fingerprint, self.data_version = fingerprint, data_version
+        return fingerprint
+
+    def select_relevant(self, user_request: str, max_tables: int = SCHEMA_MAX_TABLES,
+                        max_columns: int = SCHEMA_MAX_COLUMNS) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """
+        Chooses the tables and columns likely needed to answer a request.
+
+        Tables are ranked by the number of their columns (or listed values)
+        mentioned by the request. Tables with up to `max_columns` columns are
+        described in full, wider ones only by their mentioned columns.
+
+        Args:
+            user_request (str): The user's natural language request.
+            max_tables (int): Maximum number of tables described.
+            max_columns (int): Number of columns up to which a table is described in full.
+        Returns:
+            list: Pairs of table description and selected columns.
+        """
+        tokens = request_tokens(user_request)
+        text = user_request.lower()
+        ranked = []
+        for table in self.tables.values():
+            matched = [column for column in table['columns']
+                       if tokens.intersection(column['tokens'])
+                       or any(re.search(rf"\b{re.escape(str(value).lower())}\b", text)
+                              for value in column.get('values', []))]
+            score = len(matched) + len(tokens.intersection(table['tokens']))
+            if score:
+                ranked.append((score, table, matched))
+        ranked.sort(key=lambda item: -item[0])
+
+        if not ranked:
+            # Nothing mentioned, describe the main fact table (or the first tables)
+            fallback = [self.tables[TABLE_NAME]] if TABLE_NAME in self.tables else list(self.tables.values())
+            ranked = [(0, table, []) for table in fallback]
+
+        selected = []
+        for _, table, matched in ranked[:max_tables]:
+            columns = table['columns'] if len(table['columns']) <= max_columns or not matched else matched
+            selected.append((table, columns))
+        return selected
+
+    def describe(self, user_request: str) -> Tuple[str, List[str]]:
+        """
+        Renders the schema section of the SQL prompt for a request.
+
+        Args:
+            user_request (str): The user's natural language request.
+        Returns:
+            tuple: The schema text and the names of the described tables.
+        """
+        with self._lock:
+            selected = self.select_relevant(user_request)
+        blocks = [format_table(table, columns) for table, columns in selected]
+        return "\n\n".join(blocks), [table['name'] for table, _ in selected]
+
+
+def format_column(column: Dict[str, Any]) -> str:
+    """
+    Formats a column and its statistics as a bullet of the SQL prompt.
+    """
+    details = [column['type']]
+    if column.get('min') is not None:
+        details.append(f"from {column['min']} to {column['max']}")
+    if 'values' in column:
+        details.append(f"{len(column['values'])} values: {', '.join(map(str, column['values']))}")
+    elif column['type'].startswith(TEXT_TYPES):
+        details.append(f"~{column['distinct']} distinct values")
+    if column['name'] in PARQUET_PARTITION_COLUMNS:
+        # Only filters on the partition columns of the Parquet storage skip whole files
+        details.append(f"equals {PARQUET_PARTITION_COLUMNS[column['name']]}, filter on it to skip partitions")
+    return f"- {column['name']} ({', '.join(details)})"
+
+
+def format_table(table: Dict[str, Any], columns: List[Dict[str, Any]]) -> str:
+    """
+    Formats a table and the given columns as a block of the SQL prompt.
+    """
+    lines = [f"Table {table['name']} ({table['rows']} rows):"]
+    lines.extend(format_column(column) for column in columns)
+    if len(columns) < len(table['columns']):
+        lines.append(f"- ... {len(table['columns']) - len(columns)} more columns not relevant to the request")
+    return "\n".join(lines)
+
+
+# Catalog shared by workflows that do not run through a ReportEngine
+default_catalog = SchemaCatalog()
@@ -0,0 +1,180 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator
+from config import SQL_CACHE_NAME, SQL_CACHE_TTL_SECONDS, SQL_CACHE_MAX_ENTRIES
+
+
+def normalize_request(user_request: str) -> str:
+    """
+    Normalizes a natural language request so that trivial differences
+    (case, whitespace, trailing punctuation) map to the same cache entry.
+    """
+    text = re.sub(r"\s+", " ", user_request.strip().lower())
+    return text.rstrip(" ?!.;")
+
+
+class SQLCache:
+    """
+    On-disk cache of the SQL generated for natural language requests.
+
+    Entries are stored in a local SQLite table and keyed on the normalized
+    request, the schema fingerprint and the model name, so the entries of
+    another schema are never served but are kept until they expire or are
+    evicted: entries expire after `ttl_seconds` and the least recently used
+    ones are evicted once the cache holds more than `max_entries`.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 ttl_seconds: float = SQL_CACHE_TTL_SECONDS,
+                 max_entries: int = SQL_CACHE_MAX_ENTRIES):
+        if path is None:
+            db_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db')
+            os.makedirs(db_folder, exist_ok=True)
+            path = os.path.join(db_folder, f"{SQL_CACHE_NAME}.sqlite")
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sql_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    user_request TEXT NOT NULL,
+                    schema_fingerprint TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    sql_query TEXT NOT NULL,
+                    llm_seconds REAL NOT NULL DEFAULT 0,
+                    llm_tokens INTEGER NOT NULL DEFAULT 0,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One short-lived connection per operation keeps the cache usable from several threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(user_request: str, fingerprint: str, model_name: str) -> str:
+        raw = f"{normalize_request(user_request)}|{fingerprint}|{model_name}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, user_request: str, fingerprint: str, model_name: str) -> Optional[str]:
+        """
+        Returns the cached SQL for a request, or None on a miss.
+
+        Args:
+            user_request (str): The user's natural language request.
+            fingerprint (str): Fingerprint of the current table schema.
+            model_name (str): Name of the model that generates the SQL.
+        Returns:
+            Optional[str]: The cached SQL query, if any.
+        """
+        key = self._key(user_request, fingerprint, model_name)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT sql_query, llm_seconds, llm_tokens, created_at FROM sql_cache WHERE cache_key = ?",
+                [key],
+            ).fetchone()
+            if row is not None and now - row[3] > self.ttl_seconds:
+                conn.execute("DELETE FROM sql_cache WHERE cache_key = ?", [key])
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE sql_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?",
+                [now, key],
+            )
+            self.hits += 1
+            self.saved_seconds += row[1]
+            self.saved_tokens += row[2]
+            return row[0]
+
+    def set(self, user_request: str, fingerprint: str, model_name: str, sql_query: str,
+            llm_seconds: float = 0.0, llm_tokens: int = 0) -> None:
+        """
+        Stores the SQL generated for a request, and evicts the expired and the least recently used entries.
+
+        Args:
+            user_request (str): The user's natural language request.
+            fingerprint (str): Fingerprint of the current table schema.
+            model_name (str): Name of the model that generated the SQL.
+            sql_query (str): The generated SQL query.
+            llm_seconds (float): Time spent by the LLM to generate the query.
+            llm_tokens (int): Tokens spent by the LLM to generate the query.
+        """
+        key = self._key(user_request, fingerprint, model_name)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO sql_cache
+                    (cache_key, user_request, schema_fingerprint, model_name, sql_query,
+                     llm_seconds, llm_tokens, hits, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+                """,
+                [key, normalize_request(user_request), fingerprint, model_name, sql_query,
+                 llm_seconds, llm_tokens, now, now],
+            )
+            conn.execute("DELETE FROM sql_cache WHERE created_at < ?", [now - self.ttl_seconds])
+            conn.execute(
+                """
+                DELETE FROM sql_cache WHERE cache_key IN (
+                    SELECT cache_key FROM sql_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                [self.max_entries],
+            )
+
+    def invalidate(self, user_request: str, fingerprint: str, model_name: str) -> None:
+        """
+        Removes the cached SQL of a request.
+        """
+        key = self._key(user_request, fingerprint, model_name)
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sql_cache WHERE cache_key = ?", [key])
+
+    def clear(self) -> None:
+        """
+        Removes every cached entry.
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sql_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit/miss counters and the LLM latency and tokens saved by the cache.
+        """
+        with self._lock, self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "saved_tokens": self.saved_tokens,
+        }
@@ -0,0 +1,58 @@
+from typing import Optional, Tuple
+
+import duckdb
+
+
+def validate_sql(conn: duckdb.DuckDBPyConnection, sql_query: str) -> Tuple[str, Optional[str]]:
+    """
+    Checks that a generated query is a single read-only statement that DuckDB can plan.
+
+    The query is planned with EXPLAIN, which binds every table, column and
+    function against the catalog without scanning any data, so an invalid
+    query fails in milliseconds instead of after a full scan.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        sql_query (str): The SQL query.
+    Returns:
+        tuple: The query without trailing semicolons, and the error message or None if it is valid.
+    """
+    sql_query = sql_query.strip().rstrip(";").strip()
+    if not sql_query:
+        return sql_query, "The SQL query is empty."
+    try:
+        statements = duckdb.extract_statements(sql_query)
+    except duckdb.Error as e:
+        return sql_query, str(e)
+    if len(statements) != 1:
+        return sql_query, f"Expected a single SQL statement, got {len(statements)}."
+    if statements[0].type != duckdb.StatementType.SELECT:
+        return sql_query, f"Only read-only SELECT queries are allowed, got a {statements[0].type.name} statement."
+    try:
+        conn.execute(f"EXPLAIN {sql_query}")
+    except duckdb.Error as e:
+        return sql_query, str(e)
+    return sql_query, None
+
+
+def execute_capped(conn: duckdb.DuckDBPyConnection, sql_query: str, row_cap: Optional[int]):
+    """
+    Executes a query, fetching at most `row_cap` rows.
+
+    The cap is applied as a LIMIT on top of the query, so DuckDB stops
+    producing rows once it is reached.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection to the DuckDB database.
+        sql_query (str): The SQL query.
+        row_cap (int): Maximum number of rows fetched, no cap when None.
+    Returns:
+        tuple: The result as a DataFrame and whether rows were dropped by the cap.
+    """
+    if row_cap is None:
+        return conn.execute(sql_query).df(), False
+    # One extra row tells whether the result was truncated
+    result = conn.sql(sql_query).limit(row_cap + 1).df()
+    if len(result) > row_cap:
+        return result.head(row_cap), True
+    return result, False
@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# State values recorded when a node changes them
+WATCHED_FIELDS = {
+    "sql_cache_hit": lambda state: state.get('sql_cache_hit'),
+    "result_cache_hit": lambda state: state.get('result_cache_hit'),
+    "sql_attempts": lambda state: state.get('sql_attempts'),
+    "rows": lambda state: (state.get('result_stats') or {}).get('rows'),
+    "chart_bytes": lambda state: len(state['visualization']) if state.get('visualization') is not None else None,
+}
+# Counters recorded as the amount a node added to them
+COUNTER_FIELDS = {
+    "prompt_tokens": lambda state: (state.get('llm_usage') or {}).get('input_tokens', 0),
+    "response_tokens": lambda state: (state.get('llm_usage') or {}).get('output_tokens', 0),
+    "total_tokens": lambda state: (state.get('llm_usage') or {}).get('total_tokens', 0),
+}
+
+
+def max_rss_mb() -> Optional[float]:
+    """
+    Returns the peak resident memory of the process in MB, or None where it is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Tracer:
+    """
+    Records the cost of each workflow node and of the PDF assembly as JSON lines.
+
+    Every span records its wall time, the CPU time of its thread and the
+    peak RSS of the process so far. That peak never decreases, so it is not
+    the memory of the span: the span only records how much it raised it
+    ('process_peak_rss_growth_mb'). The peak of the span itself is only
+    recorded with `trace_memory`, as the peak of the Python heap during the
+    span (process-wide, so concurrent spans share it). Node spans also
+    record the rows, tokens and cache hits the node produced.
+    """
+
+    def __init__(self, path: Optional[str] = None, trace_memory: bool = False):
+        self.path = path
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if self.path is None:
+            return
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    @contextmanager
+    def span(self, name: str, **fields) -> Iterator[Dict[str, Any]]:
+        """
+        Measures a block of code and writes its record; the block can add fields to the yielded record.
+
+        Args:
+            name (str): Name of the span (node name, 'pdf_build', ...).
+            **fields: Extra fields of the record, e.g. the run id.
+        """
+        record = {"span": name, "started_at": datetime.now(timezone.utc).isoformat(), **fields}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start_wall, start_cpu, start_rss = time.perf_counter(), time.thread_time(), max_rss_mb()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["wall_seconds"] = round(time.perf_counter() - start_wall, 6)
+            record["cpu_seconds"] = round(time.thread_time() - start_cpu, 6)
+            peak_rss = max_rss_mb()
+            record["process_peak_rss_mb"] = None if peak_rss is None else round(peak_rss, 3)
+            if peak_rss is not None and start_rss is not None:
+                record["process_peak_rss_growth_mb"] = round(peak_rss - start_rss, 3)
+            if self.trace_memory:
+                record["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 3)
+            self.write(record)
+
+    @staticmethod
+    def _node_record(state: Dict[str, Any]) -> Dict[str, Any]:
+        return {"run_id": state.get('run_id'), "user_request": state.get('user_request')}
+
+    def _finish_node(self, record: Dict[str, Any], before: Dict[str, Any], state: Dict[str, Any]) -> None:
+        for field, read in WATCHED_FIELDS.items():
+            value = read(state)
+            if value is not None and value != before[field]:
+                record[field] = value
+        for field, read in COUNTER_FIELDS.items():
+            if read(state) - before[field]:
+                record[field] = read(state) - before[field]
+        if state.get('errors') and len(state['errors']) > before["errors"]:
+            record["error"] = state['errors'][-1]
+
+    @staticmethod
+    def _snapshot(state: Dict[str, Any]) -> Dict[str, Any]:
+        before = {field: read(state) for field, read in {**WATCHED_FIELDS, **COUNTER_FIELDS}.items()}
+        before["errors"] = len(state.get('errors') or [])
+        return before
+
+    def wrap(self, name: str, node: Callable) -> Callable:
+        """
+        Wraps a workflow node so that each call is recorded, in the JSONL file and in state['trace'].
+        """
+        def traced_node(state):
+            before = self._snapshot(state)
+            with self.span(name, **self._node_record(state)) as record:
+                state = node(state)
+                self._finish_node(record, before, state)
+            state.setdefault('trace', []).append(record)
+            return state
+
+        traced_node.__name__ = getattr(node, '__name__', name)
+        return traced_node
+
+    def awrap(self, name: str, node: Callable) -> Callable:
+        """
+        Asynchronous version of `wrap`, for async nodes.
+        """
+        async def traced_node(state):
+            before = self._snapshot(state)
+            with self.span(name, **self._node_record(state)) as record:
+                state = await node(state)
+                self._finish_node(record, before, state)
+            state.setdefault('trace', []).append(record)
+            return state
+
+        traced_node.__name__ = getattr(node, '__name__', name)
+        return traced_node
+
+
+def summarize_trace(trace: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Returns the rows of the per-run summary table: one row per node with its time and what it produced.
+    """
+    rows = []
+    for record in trace:
+        details = [f"{field}={record[field]}" for field in (*WATCHED_FIELDS, *COUNTER_FIELDS) if field in record]
+        rows.append({"Step": record["span"],
+                     "Wall (ms)": f"{record['wall_seconds'] * 1000:.1f}",
+                     "CPU (ms)": f"{record['cpu_seconds'] * 1000:.1f}",
+                     "Details": ", ".join(details) or "-"})
+    return rows
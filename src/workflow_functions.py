@@ -1,31 +1,83 @@
-import os
-from langchain_core.prompts import ChatPromptTemplate
-from typing import TypedDict, List, Dict, Any
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-import duckdb
-from config import DATABASE_NAME, TABLE_NAME
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import TypedDict, List, Dict, Any, Iterator
+from config import TABLE_NAME, SQL_MAX_ATTEMPTS, SQL_ROW_CAP, RESULT_MODE
+
+# Value of langgraph.graph.END. pandas, DuckDB, LangGraph and the modules built on them
+# are imported by the nodes that use them, so importing the workflow functions stays cheap.
+END = "__end__"
 
 
 class State(TypedDict):
     user_request: str
     llm: Any
     sql_query: str
-    query_result: pd.DataFrame
+    query_result: Any  # pandas DataFrame
     report: str
     visualization: Any
     errors: List[str]
+    sql_cache: Any
+    sql_cache_hit: bool
+    schema_fingerprint: str
+    llm_usage: Dict[str, Any]
+    db: Any
+    chart_config: Dict[str, Any]
+    use_rollups: bool
+    original_sql_query: str
+    rollup_table: str
+    query_seconds: float
+    result_cache: Any
+    result_cache_hit: bool
+    chart_cache: Any
+    chart_spec: Dict[str, Any]
+    visualization_format: str
+    report_model: Any
+    report_formats: List[str]
+    reports: Dict[str, str]
+    schema_catalog: Any
+    prompt_tables: List[str]
+    sql_attempts: int
+    sql_validation_error: str
+    row_cap: Any
+    row_cap_hit: bool
+    result_mode: str
+    result_stats: Dict[str, Any]
+    run_id: str
+    trace: List[Dict[str, Any]]
+    trace_in_report: bool
+    shared_aggregates: List[Dict[str, Any]]
 
 
-def parse_user_request(state: State) -> State:
+@contextmanager
+def open_cursor(state: State) -> Iterator[Any]:
     """
-    Converts the user's request into an SQL query.
+    Yields the thread's cursor of the connection manager held by the state, or
+    a new connection when the state does not hold one.
     """
-    user_request = state['user_request']
+    db = state.get('db')
+    if db is not None:
+        yield db.cursor()
+        return
+    import duckdb
+    from db_connection import get_database_path
+
+    conn = duckdb.connect(database=get_database_path())
+    try:
+        yield conn
+    finally:
+        conn.close()
+
 
-    prompt = ChatPromptTemplate.from_template(
-    f"""
+def get_model_name(llm: Any) -> str:
+    """
+    Returns the model name of an LLM client, used to key the SQL cache.
+    """
+    return getattr(llm, 'model_name', None) or getattr(llm, 'model', None) or type(llm).__name__
+
+
+# Template of the SQL generation prompt, the schema and the repair feedback are filled in per request
+SQL_PROMPT_TEMPLATE = """
     You are an assistant that creates SQL queries based on natural language requests.
     From the request below, generate a valid SQL query for the provided database.
 
@@ -34,25 +86,104 @@ def parse_user_request(state: State) -> State:
 
     Available tables and their schemas:
 
-    Table {TABLE_NAME}:
-    - InvoiceNo (VARCHAR)
-    - StockCode (VARCHAR)
-    - Description (VARCHAR)
-    - Quantity (INTEGER)
-    - InvoiceDate (TIMESTAMP)
-    - UnitPrice (FLOAT)
-    - CustomerID (FLOAT)
-    - Country (VARCHAR)
-
+    {schema}
+    {feedback}
     Importante:
     - Use only the tables and columns provided.
     - Make sure the query is compatible with DuckDB.
     - Return only the pure SQL query, without markdown markers or decorations.
     - Do not use ``` or sql in your response.
     """
-    )
-    
-    response = state["llm"].invoke(prompt.format(user_request=user_request))
+
+
+@lru_cache(maxsize=1)
+def get_sql_prompt() -> Any:
+    """
+    Returns the SQL generation prompt, built on first use so that importing the workflow does not load LangChain.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_template(SQL_PROMPT_TEMPLATE)
+
+
+def get_schema_catalog(state: State) -> Any:
+    """
+    Returns the schema catalog held by the state, or the shared default catalog.
+    """
+    from schema_catalog import default_catalog
+
+    return state.get('schema_catalog') or default_catalog
+
+
+def lookup_cached_sql_query(state: State) -> State:
+    """
+    Refreshes the schema catalog and looks up the SQL of the request in the SQL cache, skipping the LLM on a hit.
+
+    A request whose SQL was already planned with the other requests of a batch is not looked up.
+    """
+    from db_connection import get_database_path
+
+    try:
+        with open_cursor(state) as conn:
+            db_path = getattr(state.get('db'), 'db_path', None) or get_database_path()
+            state['schema_fingerprint'] = get_schema_catalog(state).refresh(conn, db_path)
+    except Exception as e:
+        print(f"Schema introspection failed: {e}")
+        return state
+
+    sql_cache = state.get('sql_cache')
+    if sql_cache is None or state.get('sql_query'):
+        return state
+
+    try:
+        sql_query = sql_cache.get(state['user_request'],
+                                  state['schema_fingerprint'],
+                                  get_model_name(state['llm']))
+    except Exception as e:
+        print(f"SQL cache lookup failed, falling back to the LLM: {e}")
+        return state
+
+    if sql_query is not None:
+        state['sql_query'] = sql_query
+        state['sql_cache_hit'] = True
+    return state
+
+
+def route_after_cache_lookup(state: State) -> str:
+    """
+    Skips the LLM node when the SQL was found in the cache or planned with the other requests of a batch.
+    """
+    return "validate_sql_query" if state.get('sql_cache_hit') or state.get('sql_query') else "parse_user_request"
+
+
+def build_sql_prompt(state: State) -> str:
+    """
+    Builds the SQL generation prompt of a request, with the repair feedback of a rejected query.
+    """
+    user_request = state['user_request']
+
+    # Only the tables and columns relevant to the request are described
+    schema, state['prompt_tables'] = get_schema_catalog(state).describe(user_request)
+    feedback = ""
+    if state.get('sql_validation_error'):
+        # Repair attempt: the rejected query and its error are sent back to the LLM
+        feedback = (f"\n    The previous query was rejected, fix it:\n    {state['sql_query']}\n"
+                    f"    Error: {state['sql_validation_error']}\n")
+    return get_sql_prompt().format(user_request=user_request, schema=schema, feedback=feedback)
+
+
+def record_sql_response(state: State, response: Any, seconds: float) -> State:
+    """
+    Stores the SQL answered by the LLM and accumulates the time and tokens spent.
+    """
+    usage = getattr(response, 'usage_metadata', None) or {}
+    llm_usage = state.get('llm_usage') or {}
+    state['llm_usage'] = {
+        "seconds": llm_usage.get('seconds', 0.0) + seconds,
+        "input_tokens": llm_usage.get('input_tokens', 0) + usage.get('input_tokens', 0),
+        "output_tokens": llm_usage.get('output_tokens', 0) + usage.get('output_tokens', 0),
+        "total_tokens": llm_usage.get('total_tokens', 0) + usage.get('total_tokens', 0),
+    }
+    state['sql_attempts'] = state.get('sql_attempts', 0) + 1
     sql_query = response.content.strip()
     
     # Clean markdown if present
@@ -62,70 +193,196 @@ def parse_user_request(state: State) -> State:
     return state
 
 
+def parse_user_request(state: State) -> State:
+    """
+    Converts the user's request into an SQL query.
+    """
+    prompt = build_sql_prompt(state)
+    start = time.perf_counter()
+    response = state["llm"].invoke(prompt)
+    return record_sql_response(state, response, time.perf_counter() - start)
+
+
+async def aparse_user_request(state: State) -> State:
+    """
+    Asynchronous version of `parse_user_request`, used when the workflow runs with `ainvoke`.
+    """
+    prompt = build_sql_prompt(state)
+    start = time.perf_counter()
+    response = await state["llm"].ainvoke(prompt)
+    return record_sql_response(state, response, time.perf_counter() - start)
+
+
+def validate_sql_query(state: State) -> State:
+    """
+    Plans the SQL query without executing it, rejecting invalid or non read-only statements.
+    """
+    from sql_validation import validate_sql
+
+    try:
+        with open_cursor(state) as conn:
+            state['sql_query'], error = validate_sql(conn, state.get('sql_query', ''))
+    except Exception as e:
+        error = str(e)
+    state['sql_validation_error'] = error or ""
+    if not error:
+        return state
+
+    if state.get('sql_cache_hit'):
+        # The cached query no longer plans, it is dropped and regenerated
+        state['sql_cache_hit'] = False
+        sql_cache = state.get('sql_cache')
+        if sql_cache is not None:
+            sql_cache.invalidate(state['user_request'], state['schema_fingerprint'], get_model_name(state['llm']))
+    elif state.get('sql_attempts', 0) >= SQL_MAX_ATTEMPTS:
+        state['errors'].append(f"Invalid SQL query after {state['sql_attempts']} attempts: {error}")
+    return state
+
+
+def route_after_validation(state: State) -> str:
+    """
+    Sends invalid queries back to the LLM until SQL_MAX_ATTEMPTS is reached, and stops the workflow then.
+    """
+    if not state.get('sql_validation_error'):
+        return "rewrite_sql_query_to_rollup"
+    if state.get('sql_attempts', 0) < SQL_MAX_ATTEMPTS:
+        return "parse_user_request"
+    return END
+
+
+def rewrite_sql_query_to_rollup(state: State) -> State:
+    """
+    Routes eligible aggregate queries to the smallest matching rollup table, or else
+    to a shared aggregate computed once for the requests of a batch.
+    """
+    from rollups import get_available_rollups, rewrite_query_to_rollup
+
+    state['original_sql_query'] = state.get('sql_query', '')
+    state['rollup_table'] = ""
+    shared_aggregates = state.get('shared_aggregates') or []
+    if not state.get('use_rollups', True) and not shared_aggregates:
+        return state
+
+    try:
+        with open_cursor(state) as conn:
+            rollups = get_available_rollups(conn) if state.get('use_rollups', True) else []
+        sql_query, rollup_table = rewrite_query_to_rollup(state['original_sql_query'], rollups + shared_aggregates)
+    except Exception as e:
+        print(f"Rollup rewrite failed, querying {TABLE_NAME}: {e}")
+        return state
+
+    if rollup_table is not None:
+        state['sql_query'] = sql_query
+        state['rollup_table'] = rollup_table
+    return state
+
+
+def result_data_version(conn: Any, db_path: str, result_mode: str, row_cap: Any) -> str:
+    """
+    Returns the data version keying the result cache; results fetched in another mode
+    or under another row cap are cached separately.
+    """
+    from result_cache import get_data_version
+
+    return f"{get_data_version(conn, db_path)}|{result_mode}|cap:{row_cap}"
+
 
 def connect_and_execute_sql_query(state: State) -> State:
     """
     Execute SQL query and store the result.
+
+    In the 'preview' result mode only the first rows of the result are
+    fetched and its statistics are computed in DuckDB; in the 'full' mode
+    every row is fetched, up to the row cap.
     """
+    from db_connection import get_database_path
+    from query_results import fetch_preview, dataframe_stats
+    from sql_validation import execute_capped
+
     sql_query = state.get('sql_query', '')
     try:
-        db_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db')
-        os.makedirs(db_folder, exist_ok=True)
-        db_path = os.path.join(db_folder, f"{DATABASE_NAME}.duckdb")
-        conn = duckdb.connect(database=db_path)
-        query_result = conn.execute(sql_query).df()
+        start = time.perf_counter()
+        result_cache = state.get('result_cache')
+        result_mode = state.get('result_mode', RESULT_MODE)
+        row_cap = state.get('row_cap', SQL_ROW_CAP) if result_mode == "full" else None
+        state['result_cache_hit'] = False
+        with open_cursor(state) as conn:
+            query_result = metadata = None
+            if result_cache is not None:
+                db_path = getattr(state.get('db'), 'db_path', None) or get_database_path()
+                data_version = result_data_version(conn, db_path, result_mode, row_cap)
+                query_result, metadata = result_cache.lookup(sql_query, data_version)
+                state['result_cache_hit'] = query_result is not None
+            if query_result is None:
+                # A shared aggregate computed by the batch planner is an Arrow table, visible to this
+                # cursor only while the query runs; one that was not computed is inlined as a CTE
+                aggregate = next((aggregate for aggregate in state.get('shared_aggregates') or []
+                                  if aggregate['name'] == state.get('rollup_table')), None)
+                executed_query = sql_query
+                if aggregate is not None and aggregate['table'] is not None:
+                    conn.register(aggregate['name'], aggregate['table'])
+                elif aggregate is not None:
+                    executed_query = f"WITH {aggregate['name']} AS ({aggregate['sql']}) {sql_query}"
+                try:
+                    if result_mode == "full":
+                        query_result, row_cap_hit = execute_capped(conn, executed_query, row_cap)
+                        stats = dataframe_stats(query_result)
+                    else:
+                        query_result, stats = fetch_preview(conn, executed_query)
+                        row_cap_hit = False
+                finally:
+                    if aggregate is not None and aggregate['table'] is not None:
+                        conn.unregister(aggregate['name'])
+                metadata = {"stats": stats, "row_cap_hit": row_cap_hit}
+                if result_cache is not None:
+                    result_cache.put(sql_query, data_version, query_result, metadata)
+        state['query_seconds'] = time.perf_counter() - start
         state['query_result'] = query_result
-        conn.close()
+        state['result_stats'] = metadata['stats']
+        state['row_cap_hit'] = metadata['row_cap_hit']
     except Exception as e:
         state['errors'].append(f"Error while executing SQL query: {e}")
+        return state
+
+    # Only SQL that was validated and executed successfully is stored in the cache
+    sql_cache = state.get('sql_cache')
+    if sql_cache is not None and not state.get('sql_cache_hit') and state.get('schema_fingerprint'):
+        llm_usage = state.get('llm_usage') or {}
+        sql_cache.set(state['user_request'],
+                      state['schema_fingerprint'],
+                      get_model_name(state['llm']),
+                      state.get('original_sql_query') or sql_query,
+                      llm_seconds=llm_usage.get('seconds', 0.0),
+                      llm_tokens=llm_usage.get('total_tokens', 0))
     return state
 
 def generate_visualization(state: State) -> State:
     """
     Generates visualizations based on the obtained data.
     """
+    from charts import build_chart_spec, chart_data, render_chart_cached
+
     query_result = state.get('query_result')
     if query_result is None or query_result.empty:
         state['errors'].append("No data available to generate visualization.")
         return state
     
     try:
-        plt.figure(figsize=(10, 6))
-        numeric_cols = query_result.select_dtypes(include=['number']).columns.tolist()
-
-        # Determine visualization type based on available columns
-        if 'Description' in query_result.columns and any(col in query_result.columns for col in numeric_cols):
-            # Bar chart for products
-            value_col = next((col for col in numeric_cols if col in query_result.columns), None)
-            if value_col:
-                sns.barplot(data=query_result, x='Description', y=value_col)
-                plt.title(f'{value_col.replace("_", " ").title()} by Description')
-                plt.xlabel('description')
-                plt.ylabel(value_col.replace("_", " ").title())
-                plt.xticks(rotation=45)
-
-        elif 'Country' in query_result.columns and any(col in query_result.columns for col in numeric_cols):
-            # Bar chart for regions
-            value_col = next((col for col in numeric_cols if col in query_result.columns), None)
-            if value_col:
-                sns.barplot(data=query_result, x='Country', y=value_col)
-                plt.title(f'{value_col.replace("_", " ").title()} by Region')
-                plt.xlabel('Country')
-                plt.ylabel(value_col.replace("_", " ").title())
-
-        elif 'InvoiceDate' in query_result.columns and any(col in query_result.columns for col in numeric_cols):
-            # Line chart for time trend
-            value_col = next((col for col in numeric_cols if col in query_result.columns), None)
-            if value_col:
-                plt.plot(query_result['InvoiceDate'], query_result[value_col])
-                plt.title(f'Trend of {value_col.replace("_", " ").title()} Over Time')
-                plt.xlabel('Date')
-                plt.ylabel(value_col.replace("_", " ").title())
-                plt.xticks(rotation=45)
-        
-        plt.tight_layout()
-        state['visualization'] = plt.gcf()
-        state['visualization'].savefig("visualization.png", dpi=300, bbox_inches="tight")
+        chart_config = state.get('chart_config') or {}
+        spec = build_chart_spec(query_result, state['user_request'], tuple(chart_config.get('figsize', (10, 6))))
+        state['chart_spec'] = spec
+        # Deferred charts are rendered afterwards, e.g. in the engine's process pool
+        if spec is None or chart_config.get('defer'):
+            return state
+
+        # The chart is drawn once here and its image bytes are reused by every output
+        fmt = chart_config.get('format', 'png')
+        state['visualization'] = render_chart_cached(chart_data(query_result, spec),
+                                                     spec,
+                                                     dpi=chart_config.get('dpi', 300),
+                                                     fmt=fmt,
+                                                     cache=state.get('chart_cache'))
+        state['visualization_format'] = fmt
         
     except Exception as e:
         state['errors'].append(f"Error generating visualization: {str(e)}")
@@ -133,10 +390,24 @@ def generate_visualization(state: State) -> State:
     return state
 
 
+def render_reports(state: State) -> State:
+    """
+    Renders the report model in every text format requested by the state.
+    """
+    from report_renderers import TEXT_RENDERERS
+
+    model = state['report_model']
+    state['reports'] = {fmt: TEXT_RENDERERS[fmt](model) for fmt in state.get('report_formats') or []}
+    state['report'] = state['reports'].get('markdown', "")
+    return state
+
+
 def generate_report(state: State) -> State:
     """
-    Generates the final report based on the data and visualizations.
+    Builds the report model from the data and visualization, and renders the requested text formats.
     """
+    from report_model import build_report_model
+
     query_result = state.get('query_result')
     
     if query_result is None or query_result.empty:
@@ -144,40 +415,9 @@ def generate_report(state: State) -> State:
         return state
     
     try:
-        # Generate a summary of the data
-        num_rows = len(query_result)
-
-        report = f"# Report Generated Based on Request\n\n"
-        report += f"**Original request:** {state['user_request']}\n\n"
-        report += f"**Executed SQL query:**\n```sql\n{state['sql_query']}\n```\n\n"
-
-        report += f"## Data Summary\n\n"
-        report += f"- Total records: {num_rows}\n"
-
-        # Add specific statistics based on available columns
-        if 'total_quantity' in query_result.columns:
-            total_quantity = query_result['total_quantity'].sum()
-            avg_quantity = query_result['total_quantity'].mean()
-            report += f"- Total quantity: {total_quantity:.2f}\n"
-            report += f"- Average quantity: {avg_quantity:.2f}\n"
-
-        if 'Description' in query_result.columns and query_result['Description'].nunique() < 10:
-            report += f"- Included descriptions: {', '.join(query_result['Description'].unique())}\n"
-
-        if 'Country' in query_result.columns and query_result['Country'].nunique() < 10:
-            report += f"- Included countries: {', '.join(query_result['Country'].unique())}\n"
-
-        # Add data table
-        report += f"\n## Detailed Data\n\n"
-
-        # Limit to 10 rows to avoid overloading the report
-        sample_data = query_result.head(10)
-        report += sample_data.to_markdown() + "\n"
-
-        if len(query_result) > 10:
-            report += f"\n*Showing 10 of {len(query_result)} records*\n"
-
-        state['report'] = report
+        # PDF-only callers request no text format, so nothing is rendered here for them
+        state['report_model'] = build_report_model(state)
+        render_reports(state)
     except Exception as e:
         state['errors'].append(f"Error generating report: {str(e)}")
 
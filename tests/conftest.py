@@ -0,0 +1,74 @@
+import os
+import sys
+
+import duckdb
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# The report modules read the key at import time; the tests never call the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from config import TABLE_NAME
+from extract_and_write_data import load_file_into_duckdb
+
+SYNTHETIC_ROWS = 20000
+COUNTRIES = ["United Kingdom", "Germany", "France", "EIRE", "Spain", "Netherlands", "Belgium", "Portugal"]
+
+
+def synthetic_sales_query(rows: int) -> str:
+    """
+    Returns a query producing `rows` synthetic sales with the columns of the retail dataset.
+
+    Values are derived from a hash of the row number, invoices hold 5 lines and
+    span 2010 and 2011.
+    """
+    countries = "[" + ", ".join(f"'{country}'" for country in COUNTRIES) + "]"
+    minutes = 2 * 365 * 24 * 60
+    return f"""
+        SELECT
+            CAST(500000 + i // 5 AS VARCHAR) AS InvoiceNo,
+            CAST(10000 + hash(i * 7) % 200 AS VARCHAR) AS StockCode,
+            'Product ' || CAST(hash(i * 7) % 200 AS VARCHAR) AS Description,
+            CAST(1 + hash(i * 13) % 24 AS BIGINT) AS Quantity,
+            TIMESTAMP '2010-01-01' + TO_MINUTES(CAST((i // 5) * {minutes} // {max(rows // 5, 1)} AS BIGINT))
+                AS InvoiceDate,
+            ROUND(0.5 + (hash(i * 7) % 2000) / 100.0, 2) AS UnitPrice,
+            CAST(12000 + hash(i // 5) % 500 AS DOUBLE) AS CustomerID,
+            {countries}[1 + CAST(hash(i // 5) % {len(COUNTRIES)} AS BIGINT)] AS Country
+        FROM range({int(rows)}) t(i)
+    """
+
+
+@pytest.fixture(scope="session")
+def sales_parquet(tmp_path_factory):
+    """
+    Path of a Parquet file holding the synthetic sales.
+    """
+    path = str(tmp_path_factory.mktemp("data") / "sales.parquet")
+    duckdb.execute(f"COPY ({synthetic_sales_query(SYNTHETIC_ROWS)}) TO '{path}' (FORMAT PARQUET)")
+    return path
+
+
+@pytest.fixture(scope="session")
+def sales_db(tmp_path_factory, sales_parquet):
+    """
+    Path of a DuckDB database loaded from the synthetic sales, with its rollup tables.
+    """
+    path = str(tmp_path_factory.mktemp("db") / "sales.duckdb")
+    conn = duckdb.connect(path)
+    try:
+        load_file_into_duckdb(sales_parquet, conn)
+    finally:
+        conn.close()
+    return path
+
+
+@pytest.fixture
+def sales_conn(sales_db):
+    """
+    Read-only connection to the synthetic database.
+    """
+    conn = duckdb.connect(sales_db, read_only=True)
+    yield conn
+    conn.close()
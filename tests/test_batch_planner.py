@@ -0,0 +1,85 @@
+import pytest
+
+from batch_planner import parse_batch_response, plan_batch, plan_shared_scans
+from config import TABLE_NAME
+from db_connection import DuckDBConnectionManager
+from llm_client import FakeLLM
+from rollups import rewrite_query_to_rollup
+from schema_catalog import SchemaCatalog
+from sql_cache import SQLCache
+from workflow_functions import get_model_name
+
+from test_rollups import sorted_rows
+
+SHARED_QUERIES = [
+    f"SELECT Description, SUM(Quantity) AS units FROM {TABLE_NAME} GROUP BY Description ORDER BY units DESC LIMIT 10",
+    f"SELECT Description, SUM(Quantity * UnitPrice) AS revenue FROM {TABLE_NAME} GROUP BY Description",
+    f"SELECT Description, COUNT(*) FROM {TABLE_NAME} "
+    f"WHERE YEAR(InvoiceDate) = 2022 GROUP BY Description",
+    f"SELECT Description, Country, MIN(StockCode) FROM {TABLE_NAME} GROUP BY Description, Country",
+    f"SELECT Country, Description, MAX(StockCode), COUNT(DISTINCT StockCode), SUM(Quantity) FROM {TABLE_NAME} GROUP BY ALL",
+]
+
+FACT_ONLY_QUERIES = [
+    f"SELECT Description, COUNT(InvoiceNo) FROM {TABLE_NAME} GROUP BY Description",
+    f"SELECT Description, COUNT(CustomerID) FROM {TABLE_NAME} GROUP BY Description",
+    f"SELECT Description, AVG(UnitPrice) FROM {TABLE_NAME} GROUP BY Description",
+]
+
+
+def test_shared_aggregates_answer_like_the_fact_table(sales_conn, sales_db):
+    sql_queries = SHARED_QUERIES + FACT_ONLY_QUERIES
+    shared_aggregates = plan_shared_scans(sales_conn, sales_db, sql_queries, min_queries=2)
+    shared = sorted(index for aggregate in shared_aggregates for index in aggregate['queries'])
+    assert shared == list(range(len(SHARED_QUERIES)))
+
+    for aggregate in shared_aggregates:
+        sales_conn.register(aggregate['name'], aggregate['table'])
+        for index in aggregate['queries']:
+            rewritten, table = rewrite_query_to_rollup(sql_queries[index], [aggregate])
+            assert table == aggregate['name']
+            assert sorted_rows(sales_conn, rewritten) == sorted_rows(sales_conn, sql_queries[index])
+
+
+def test_other_aggregates_are_not_shared(sales_conn, sales_db):
+    assert plan_shared_scans(sales_conn, sales_db, FACT_ONLY_QUERIES, min_queries=2) == []
+
+
+def test_single_query_does_not_share_a_scan(sales_conn, sales_db):
+    assert plan_shared_scans(sales_conn, sales_db, SHARED_QUERIES[:1], min_queries=2) == []
+
+
+@pytest.mark.parametrize("content, expected", [
+    ('["SELECT 1", " SELECT 2 "]', ["SELECT 1", "SELECT 2"]),
+    ('```json\n["SELECT 1", "SELECT 2"]\n```', ["SELECT 1", "SELECT 2"]),
+    ('["SELECT 1", 2]', ["SELECT 1", ""]),
+    ('["SELECT 1"]', ["", ""]),
+    ('{"sql": "SELECT 1"}', ["", ""]),
+    ("SELECT 1; SELECT 2", ["", ""]),
+])
+def test_parse_batch_response(content, expected):
+    assert parse_batch_response(content, 2) == expected
+
+
+def test_plan_batch_uses_one_llm_call_and_the_sql_cache(sales_db, tmp_path):
+    llm = FakeLLM()
+    sql_cache = SQLCache(str(tmp_path / "sql_cache.sqlite"))
+    user_requests = ["Top products by quantity", "Top products by revenue", "Revenue by country"]
+    with DuckDBConnectionManager(sales_db, storage="duckdb") as db:
+        catalog = SchemaCatalog()
+        fingerprint = catalog.refresh(db.cursor(), db.db_path)
+        sql_cache.set(user_requests[2], fingerprint, get_model_name(llm), "SELECT 1")
+        plan = plan_batch(user_requests, llm, db, catalog, sql_cache)
+
+    assert (llm.calls, plan.llm_calls, plan.sql_cache_hits) == (1, 1, [False, False, True])
+    assert plan.sql_queries[:2] == [llm.sql_for_request(user_request) for user_request in user_requests[:2]]
+    assert plan.sql_queries[2] == "SELECT 1"
+    assert [aggregate["queries"] for aggregate in plan.shared_aggregates] == [[0, 1]]
+
+
+def test_shared_scans_read_the_partition_columns_as_time_expressions(sales_conn, sales_db):
+    # Queries over the Parquet storage may filter on its partition columns
+    queries = [f"SELECT Description, SUM(Quantity) FROM {TABLE_NAME} WHERE InvoiceYear = 2011 GROUP BY Description",
+               f"SELECT Description, COUNT(*) FROM {TABLE_NAME} WHERE InvoiceYear = 2011 GROUP BY Description"]
+    (aggregate,) = plan_shared_scans(sales_conn, sales_db, queries, min_queries=2)
+    assert "InvoiceYear" not in aggregate["sql"]
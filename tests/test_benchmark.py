@@ -0,0 +1,50 @@
+import json
+
+import duckdb
+import pytest
+
+from benchmark import YEARS, benchmark_queries, compare_results, generate_sales_data, run_pipeline_benchmark
+
+
+def test_synthetic_data_is_deterministic(tmp_path):
+    first, second = str(tmp_path / "first.parquet"), str(tmp_path / "second.parquet")
+    generate_sales_data(first, 1000)
+    generate_sales_data(second, 1000)
+
+    conn = duckdb.connect()
+    assert conn.execute(f"SELECT COUNT(*) FROM (SELECT * FROM '{first}' EXCEPT ALL SELECT * FROM '{second}')"
+                        ).fetchone()[0] == 0
+    rows, years = conn.execute(f"SELECT COUNT(*), LIST(DISTINCT YEAR(InvoiceDate) ORDER BY 1) FROM '{first}'"
+                               ).fetchone()
+    assert rows == 1000 and years == YEARS
+
+
+def test_benchmark_queries_are_distinct_and_valid(sales_conn):
+    queries = benchmark_queries(40)
+
+    assert len({request for request, _ in queries}) == 40
+    for _, sql_query in queries:
+        sales_conn.execute(sql_query).fetchall()
+
+
+@pytest.mark.parametrize("batch_plan, llm_calls", [(False, 3), (True, 1)])
+def test_pipeline_benchmark_traces_every_query(sales_db, tmp_path, batch_plan, llm_calls):
+    run = run_pipeline_benchmark(sales_db, benchmark_queries(3), str(tmp_path), 2, False, True, 0.0,
+                                 batch_plan=batch_plan)
+
+    assert (run["queries"], run["errors"], run["llm_calls"]) == (3, 0, llm_calls)
+    assert run["pdf_bytes"] > 0
+    assert run["nodes"] and all(node["calls"] >= 1 for node in run["nodes"].values())
+
+
+def test_compare_prints_the_change_against_the_baseline(tmp_path, capsys):
+    paths = []
+    for commit, seconds in [("base", 2.0), ("head", 1.0)]:
+        paths.append(str(tmp_path / f"{commit}.json"))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            json.dump({"commit": commit, "dirty": False, "datasets": [
+                {"rows": 1000, "ingest_seconds": seconds, "runs": []}]}, f)
+
+    compare_results(paths)
+
+    assert "-50.0%" in capsys.readouterr().out
@@ -0,0 +1,98 @@
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+import pytest
+
+from charts import ChartCache, ChartRenderPool, build_chart_spec, chart_data, chart_key, render_chart_cached
+
+BY_COUNTRY = pd.DataFrame({"Country": ["France", "Spain", "EIRE"], "total_sales": [3.0, 2.0, 1.0]})
+# Pie charts cannot draw negative wedges, so this chart fails to render
+NEGATIVE_SHARES = pd.DataFrame({"Country": ["France", "Spain"], "returns": [-3.0, -1.0]})
+BY_MONTH = pd.DataFrame({"month": pd.to_datetime(["2011-01-01", "2011-02-01"]), "total_sales": [1.0, 2.0]})
+
+
+@pytest.mark.parametrize("result, request_text, kind", [
+    (BY_COUNTRY, "total sales per country", "bar"),
+    (BY_COUNTRY, "total sales per country as a pie chart", "pie"),
+    (BY_MONTH, "total sales per month", "line"),
+    (BY_MONTH, "total sales per month in a bar chart", "bar"),
+    (pd.DataFrame({"Quantity": [1, 2], "UnitPrice": [0.5, 1.5]}), "price against quantity", "scatter"),
+])
+def test_chart_kind_follows_the_columns_and_the_request(result, request_text, kind):
+    spec = build_chart_spec(result, request_text)
+    assert spec["kind"] == kind
+    assert spec["y"] == "total_sales" or kind == "scatter"
+
+
+def test_results_without_a_measure_are_not_charted():
+    assert build_chart_spec(pd.DataFrame({"Country": ["France"], "StockCode": ["1"]}), "countries") is None
+    assert build_chart_spec(pd.DataFrame(), "anything") is None
+
+
+def test_chart_key_depends_on_data_and_settings():
+    spec = build_chart_spec(BY_COUNTRY, "total sales per country")
+    data = chart_data(BY_COUNTRY, spec)
+    assert chart_key(data, spec, 100, "png") == chart_key(data.copy(), spec, 100, "png")
+    assert chart_key(data, spec, 100, "png") != chart_key(data, spec, 300, "png")
+    assert chart_key(data, spec, 100, "png") != chart_key(data.assign(total_sales=[3.0, 2.0, 0.5]), spec, 100, "png")
+
+
+def test_charts_are_rendered_once():
+    cache = ChartCache()
+    spec = build_chart_spec(BY_COUNTRY, "total sales per country")
+    data = chart_data(BY_COUNTRY, spec)
+
+    image = render_chart_cached(data, spec, dpi=50, cache=cache)
+    assert image.startswith(b"\x89PNG")
+    assert render_chart_cached(data, spec, dpi=50, cache=cache) is image
+    assert render_chart_cached(data, spec, dpi=50, fmt="svg", cache=cache).lstrip().startswith(b"<?xml")
+    assert (cache.stats()["hits"], cache.stats()["misses"], cache.stats()["entries"]) == (1, 2, 2)
+
+
+def test_least_recently_used_images_are_evicted():
+    cache = ChartCache(max_entries=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    cache.get("a")
+    cache.put("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1" and cache.get("c") == b"3"
+
+
+def chart_job(result, request_text):
+    spec = build_chart_spec(result, request_text)
+    return chart_data(result, spec), spec
+
+
+@pytest.fixture
+def pool():
+    pool = ChartRenderPool(2)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_a_failing_chart_does_not_affect_the_others(pool, workers):
+    cache = ChartCache()
+    jobs = [chart_job(BY_COUNTRY, "total sales per country"), chart_job(NEGATIVE_SHARES, "returns as a pie"),
+            chart_job(BY_MONTH, "total sales per month")]
+
+    images = pool.render_many(jobs, dpi=50, cache=cache, workers=workers)
+
+    assert images[0].startswith(b"\x89PNG") and images[2].startswith(b"\x89PNG")
+    assert isinstance(images[1], ValueError)
+    assert cache.stats()["entries"] == 2
+
+
+def test_a_broken_pool_is_replaced_on_the_next_call(pool):
+    jobs = [chart_job(BY_COUNTRY, "total sales per country"), chart_job(BY_MONTH, "total sales per month")]
+    executor = pool._get_executor(2)
+    pool.render_many(jobs, dpi=50)
+    for process in list(executor._processes.values()):
+        process.kill()
+
+    images = pool.render_many([chart_job(BY_COUNTRY, "sales by country"), chart_job(BY_MONTH, "sales by month")],
+                              dpi=50)
+    assert all(isinstance(image, BrokenProcessPool) for image in images)
+    assert all(image.startswith(b"\x89PNG") for image in pool.render_many(jobs, dpi=50))
+    assert pool._executor is not executor
@@ -0,0 +1,57 @@
+import subprocess
+import sys
+import threading
+
+import duckdb
+import pytest
+
+from db_connection import DuckDBConnectionManager
+
+WRITER = "import duckdb, sys; conn = duckdb.connect(sys.argv[1]); conn.execute(sys.argv[2]); conn.close()"
+
+
+def write_from_another_process(path, sql_query="INSERT INTO t VALUES (2)"):
+    return subprocess.run([sys.executable, "-c", WRITER, path, sql_query], capture_output=True, text=True)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "test.duckdb")
+    conn = duckdb.connect(path)
+    conn.execute("CREATE TABLE t AS SELECT 1 AS x")
+    conn.close()
+    return path
+
+
+def test_each_thread_reuses_its_own_cursor(db_path):
+    with DuckDBConnectionManager(db_path) as db:
+        cursor = db.cursor()
+        other = []
+        thread = threading.Thread(target=lambda: other.append(db.cursor()))
+        thread.start()
+        thread.join()
+
+        assert db.cursor() is cursor
+        assert other[0] is not cursor
+        with pytest.raises(duckdb.Error):
+            cursor.execute("INSERT INTO t VALUES (3)")
+
+
+def test_open_connection_blocks_writers_until_refresh(db_path):
+    with DuckDBConnectionManager(db_path) as db:
+        assert db.cursor().execute("SELECT COUNT(*) FROM t").fetchone()[0] == 1
+        assert "lock" in write_from_another_process(db_path).stderr.lower()
+
+        db.refresh()
+        assert write_from_another_process(db_path).returncode == 0
+        assert db.cursor().execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+
+
+def test_refresh_replaces_the_cursors_of_every_thread(db_path):
+    with DuckDBConnectionManager(db_path) as db:
+        cursor = db.cursor()
+        db.refresh()
+        assert db.cursor() is not cursor
+        db.refresh()
+    with pytest.raises(RuntimeError):
+        db.cursor()
@@ -0,0 +1,148 @@
+import csv
+
+import duckdb
+import pytest
+from openpyxl import Workbook
+
+from config import LOAD_METADATA_TABLE, TABLE_NAME
+from extract_and_write_data import convert_excel_to_csv, load_file_into_duckdb, write_to_table
+from rollups import get_available_rollups
+
+from test_rollups import sorted_rows
+
+
+@pytest.fixture
+def conn(tmp_path, sales_parquet):
+    conn = duckdb.connect(str(tmp_path / "load.duckdb"))
+    conn.execute(f"CREATE TEMP VIEW source AS SELECT * FROM read_parquet('{sales_parquet}')")
+    yield conn
+    conn.close()
+
+
+def assert_rollups_match_fact_table(conn):
+    rollups = get_available_rollups(conn)
+    assert len(rollups) == 3
+    for rollup in rollups:
+        dimensions = ", ".join(rollup["dimensions"])
+        expected = f"""
+            SELECT DATE_TRUNC('{rollup["grain"]}', InvoiceDate), {dimensions},
+                   SUM(Quantity), SUM(Quantity * UnitPrice), COUNT(*)
+            FROM {TABLE_NAME} GROUP BY ALL
+        """
+        actual = f"SELECT InvoiceDate, {dimensions}, Quantity, Revenue, RowCount FROM {rollup['name']}"
+        assert sorted_rows(conn, actual) == sorted_rows(conn, expected)
+
+
+def test_csv_and_parquet_files_load_the_same_rows(tmp_path, sales_parquet):
+    csv_path = str(tmp_path / "sales.csv")
+    duckdb.execute(f"COPY (SELECT * FROM read_parquet('{sales_parquet}')) TO '{csv_path}' (HEADER)")
+    conn = duckdb.connect()
+    try:
+        assert load_file_into_duckdb(sales_parquet, conn, "from_parquet") == load_file_into_duckdb(csv_path, conn)
+        assert conn.execute(
+            f"SELECT COUNT(*) FROM (SELECT * FROM from_parquet EXCEPT SELECT * FROM {TABLE_NAME})"
+        ).fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_csv_types_are_inferred_from_every_row(tmp_path):
+    # A cancelled invoice ('C' prefix) after many numeric ones must not break the load
+    csv_path = tmp_path / "invoices.csv"
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["InvoiceNo", "Quantity"])
+        writer.writerows([[536365 + i, 1] for i in range(30000)])
+        writer.writerow(["C536379", -1])
+    conn = duckdb.connect()
+    try:
+        assert load_file_into_duckdb(str(csv_path), conn) == 30001
+        assert conn.execute(f"SELECT typeof(InvoiceNo) FROM {TABLE_NAME} LIMIT 1").fetchone()[0] == "VARCHAR"
+    finally:
+        conn.close()
+
+
+def test_excel_sheets_are_converted_in_chunks(tmp_path):
+    workbook = Workbook()
+    first = workbook.active
+    first.append(["InvoiceNo", "Quantity"])
+    for i in range(5):
+        first.append([f"5000{i}", i])
+    same = workbook.create_sheet("same")
+    same.append(["InvoiceNo", "Quantity"])
+    same.append(["60000", 7])
+    other = workbook.create_sheet("other")
+    other.append(["Something", "Else"])
+    other.append(["x", 1])
+    excel_path = str(tmp_path / "sales.xlsx")
+    workbook.save(excel_path)
+
+    csv_path = str(tmp_path / "sales.csv")
+    assert convert_excel_to_csv(excel_path, csv_path, chunk_rows=2) == 6
+    with open(csv_path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["InvoiceNo", "Quantity"]
+    assert [row[0] for row in rows[1:]] == ["50000", "50001", "50002", "50003", "50004", "60000"]
+
+
+def test_unsupported_files_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        load_file_into_duckdb(str(tmp_path / "sales.json"), duckdb.connect())
+
+
+def test_append_only_inserts_rows_past_the_high_water_mark(conn):
+    cutoff = conn.execute("SELECT quantile_disc(InvoiceDate, 0.5) FROM source").fetchone()[0]
+    # Prepared parameters are not allowed in a view definition
+    conn.execute(f"CREATE TEMP VIEW first_half AS SELECT * FROM source WHERE InvoiceDate <= TIMESTAMP '{cutoff}'")
+    first = write_to_table(conn, "first_half", mode="append")
+    second = write_to_table(conn, "source", mode="append")
+
+    total, newer = conn.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE InvoiceDate > ?) FROM source",
+                                [cutoff]).fetchone()
+    assert (first, second) == (total - newer, newer)
+    assert conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] == total
+    assert write_to_table(conn, "source", mode="append") == 0
+    assert conn.execute(f"SELECT mode, rows_loaded FROM {LOAD_METADATA_TABLE} ORDER BY load_id").fetchall() == [
+        ("append", total - newer), ("append", newer), ("append", 0)]
+    assert_rollups_match_fact_table(conn)
+
+
+def test_upsert_replaces_rows_with_the_same_keys(conn):
+    write_to_table(conn, "source", mode="create")
+    total = conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+    # Changed copies of the rows of one invoice, and one row with a new key
+    conn.execute(f"""
+        CREATE TEMP TABLE changes AS
+        SELECT * REPLACE (Quantity * 100 AS Quantity) FROM source WHERE InvoiceNo = '500000'
+        UNION ALL
+        (SELECT * REPLACE ('999999' AS InvoiceNo) FROM source LIMIT 1)
+    """)
+    changed = conn.execute("SELECT COUNT(*) FROM changes").fetchone()[0]
+
+    assert write_to_table(conn, "changes", mode="upsert") == changed
+    assert conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] == total + 1
+    updated = conn.execute(f"SELECT SUM(Quantity) FROM {TABLE_NAME} WHERE InvoiceNo = '500000'").fetchone()[0]
+    assert updated == conn.execute("SELECT SUM(Quantity) FROM changes WHERE InvoiceNo = '500000'").fetchone()[0]
+    assert_rollups_match_fact_table(conn)
+
+
+@pytest.mark.parametrize("key_columns", [["InvoiceNo", "StockCode"], ["StockCode"]])
+def test_upsert_matches_null_and_duplicate_keys(conn, key_columns):
+    # Two lines of the same item on one invoice, and a line without StockCode
+    conn.execute("""
+        CREATE TEMP TABLE lines AS
+        SELECT * FROM (VALUES ('1', 'A', 1), ('1', 'A', 2), ('1', NULL, 3), ('2', 'B', 4))
+            t(InvoiceNo, StockCode, Quantity)
+    """)
+    write_to_table(conn, "lines", mode="create")
+    conn.execute("CREATE TEMP TABLE reloaded AS SELECT * REPLACE (Quantity * 10 AS Quantity) FROM lines "
+                 "WHERE InvoiceNo = '1'")
+
+    assert write_to_table(conn, "reloaded", mode="upsert", key_columns=key_columns) == 3
+    assert conn.execute(f"SELECT InvoiceNo, StockCode, Quantity FROM {TABLE_NAME} ORDER BY Quantity").fetchall() == [
+        ("2", "B", 4), ("1", "A", 10), ("1", "A", 20), ("1", None, 30)]
+
+
+def test_unknown_mode_is_rejected(conn):
+    with pytest.raises(ValueError):
+        write_to_table(conn, "source", mode="merge")
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+from pypdf import PdfReader
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph
+
+from generate_multiple_business_report import merge_pdfs, stream_multi_query_report, write_pdf
+from report_engine import ReportEngine
+from result_cache import ResultCache
+from sql_cache import SQLCache
+
+from test_report_engine import QUERIES, StubLLM
+
+REQUESTS = ["total quantity per country", "total sales per month"]
+CHART_CONFIG = {"format": "png", "dpi": 50}
+
+
+@pytest.fixture
+def engine(sales_db, tmp_path):
+    engine = ReportEngine(llm=StubLLM(), sql_cache=SQLCache(str(tmp_path / "sql_cache.sqlite")),
+                          result_cache=ResultCache(str(tmp_path / "result_cache")), db_path=sales_db,
+                          chart_workers=1)
+    yield engine
+    engine.close()
+
+
+def pdf_text(path):
+    return [page.extract_text() for page in PdfReader(path).pages]
+
+
+def test_merge_keeps_the_order_of_the_files(tmp_path):
+    styles = getSampleStyleSheet()
+    paths = []
+    for name in ["first", "second", "third"]:
+        paths.append(str(tmp_path / f"{name}.pdf"))
+        write_pdf(paths[-1], [Paragraph(f"{name} file", styles["Normal"])])
+
+    merge_pdfs(paths, str(tmp_path / "merged.pdf"))
+
+    assert [text.strip() for text in pdf_text(str(tmp_path / "merged.pdf"))] == [
+        "first file", "second file", "third file"]
+
+
+def test_stream_writes_every_section_and_keeps_slim_states(engine, tmp_path):
+    pdf_path = str(tmp_path / "report.pdf")
+    states = stream_multi_query_report(REQUESTS + ["something unknown"], pdf_path, "Streamed report", 2, engine,
+                                       True, CHART_CONFIG)
+
+    text = "\n".join(pdf_text(pdf_path))
+    assert text.index("Streamed report") < text.index("Analysis 1: total quantity per country") \
+        < text.index("Analysis 2: total sales per month")
+    assert "Analysis 3" not in text
+    assert [state["user_request"] for state in states] == REQUESTS + ["something unknown"]
+    assert states[0]["row_count"] > 0 and states[0]["errors"] == []
+    assert "unknown request" in states[2]["errors"][0]
+    assert all("query_result" not in state and "report_model" not in state for state in states)
+    assert not os.path.exists(str(tmp_path / "report_sections"))
+
+
+def test_resume_only_reruns_the_missing_sections(engine, tmp_path):
+    pdf_path = str(tmp_path / "report.pdf")
+    requests = REQUESTS + ["total revenue per country"]
+    # The third request fails on the first run
+    stream_multi_query_report(requests, pdf_path, "Report", 2, engine, True, CHART_CONFIG, keep_sections=True)
+    assert len(os.listdir(str(tmp_path / "report_sections"))) == 3
+
+    engine.llm = StubLLM({**QUERIES, "total revenue per country": QUERIES["total quantity per country"]})
+    states = stream_multi_query_report(requests, pdf_path, "Report", 2, engine, True, CHART_CONFIG, resume=True)
+
+    assert [state.get("resumed", False) for state in states] == [True, True, False]
+    assert engine.llm.calls == 1
+    text = "\n".join(pdf_text(pdf_path))
+    assert "Analysis 1" in text and "Analysis 2" in text and "Analysis 3: total revenue per country" in text
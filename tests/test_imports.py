@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_workflow_functions_import_is_light():
+    code = ("import sys, workflow_functions; "
+            "print(sorted(m for m in ('pandas', 'duckdb', 'langgraph', 'langchain_core') if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=SRC_FOLDER, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
+
+
+def test_end_matches_langgraph():
+    from langgraph.graph import END
+    from workflow_functions import END as WORKFLOW_END
+    assert WORKFLOW_END == END
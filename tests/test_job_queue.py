@@ -0,0 +1,59 @@
+import pytest
+
+from job_queue import JobQueue, job_key
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite"))
+
+
+def test_identical_in_flight_jobs_are_deduplicated(queue):
+    job_id, deduplicated = queue.submit("report", {"user_request": "Revenue by country", "draft": False})
+    assert not deduplicated
+    assert queue.submit("report", {"user_request": "  revenue BY country?", "draft": False}) == (job_id, True)
+    assert queue.submit("report", {"user_request": "Revenue by country", "draft": True})[0] != job_id
+
+    assert queue.claim()["job_id"] == job_id
+    assert queue.submit("report", {"user_request": "Revenue by country", "draft": False}) == (job_id, True)
+    assert queue.get(job_id)["submissions"] == 3
+
+    queue.complete(job_id, {"rows": 1})
+    new_id, deduplicated = queue.submit("report", {"user_request": "Revenue by country", "draft": False})
+    assert new_id != job_id and not deduplicated
+
+
+def test_jobs_are_claimed_once_in_submission_order(queue):
+    first, _ = queue.submit("report", {"user_request": "first"})
+    second, _ = queue.submit("multi", {"user_request": ["second", "third"]})
+    claimed = [queue.claim(), queue.claim(), queue.claim()]
+    assert [job["job_id"] for job in claimed[:2]] == [first, second]
+    assert claimed[2] is None
+    assert claimed[1]["status"] == "running" and claimed[1]["payload"] == {"user_request": ["second", "third"]}
+
+
+def test_finished_jobs_keep_their_result_and_error(queue):
+    job_id, _ = queue.submit("report", {"user_request": "revenue"})
+    queue.claim()
+    queue.fail(job_id, "Invalid SQL query", {"sql_query": "SELEC"})
+    job = queue.wait(job_id, 1)
+    assert (job["status"], job["error"], job["result"]) == ("failed", "Invalid SQL query", {"sql_query": "SELEC"})
+    assert queue.counts() == {"queued": 0, "running": 0, "done": 0, "failed": 1}
+
+
+def test_recover_requeues_jobs_of_dead_workers_and_drops_expired_jobs(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), retention_seconds=0)
+    running, _ = queue.submit("report", {"user_request": "running"})
+    done, _ = queue.submit("report", {"user_request": "done"})
+    queue.claim()
+    queue.claim()
+    queue.complete(done, {})
+    # The worker of the running job has died
+    monkeypatch.setattr("job_queue.process_alive", lambda pid: False)
+    assert queue.recover() == (1, [done])
+    assert queue.get(running)["status"] == "queued"
+
+
+def test_job_key_ignores_request_formatting():
+    assert job_key("multi", {"user_request": ["A ", "b?"]}) == job_key("multi", {"user_request": ["a", "B"]})
+    assert job_key("multi", {"user_request": ["a", "b"]}) != job_key("multi", {"user_request": ["b", "a"]})
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llm_client import get_http_clients
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_async_client_survives_several_event_loops(url):
+    _, async_client = get_http_clients()
+
+    async def fetch():
+        # Keep-alive connections of the first loop must not be reused by the next one
+        return [(await async_client.get(url)).text for _ in range(2)]
+
+    for _ in range(3):
+        assert asyncio.run(fetch()) == ["ok", "ok"]
@@ -0,0 +1,122 @@
+import glob
+import os
+import shutil
+
+import duckdb
+import pytest
+
+from config import PARQUET_PARTITION_COLUMNS, TABLE_NAME
+from db_connection import DuckDBConnectionManager
+from extract_and_write_data import write_to_table
+from parquet_storage import current_version, export_to_parquet, load_manifest, stale_export_warning
+from rollups import get_available_rollups, rewrite_query_to_rollup
+from schema_catalog import SchemaCatalog
+
+from test_rollups import sorted_rows
+
+
+@pytest.fixture
+def db_copy(sales_db, tmp_path):
+    path = str(tmp_path / "sales.duckdb")
+    shutil.copy(sales_db, path)
+    return path
+
+
+def export(db_path, folder, **kwargs):
+    conn = duckdb.connect(db_path, read_only=True)
+    try:
+        return export_to_parquet(conn, folder, **kwargs)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def parquet_db(db_copy, tmp_path):
+    folder = str(tmp_path / "parquet")
+    export(db_copy, folder)
+    with DuckDBConnectionManager(db_copy, storage="parquet", parquet_folder=folder) as db:
+        yield db
+
+
+def test_views_match_the_database(parquet_db, sales_conn):
+    conn = parquet_db.cursor()
+    fact_columns = [row[0] for row in sales_conn.execute(f"DESCRIBE {TABLE_NAME}").fetchall()]
+
+    assert [row[0] for row in conn.execute(f"DESCRIBE {TABLE_NAME}").fetchall()] == \
+        fact_columns + list(PARQUET_PARTITION_COLUMNS)
+    sql_query = f"SELECT Country, SUM(Quantity), COUNT(*) FROM {TABLE_NAME} GROUP BY Country"
+    assert sorted_rows(conn, sql_query) == sorted_rows(sales_conn, sql_query)
+    assert load_manifest(parquet_db.parquet_folder)["load_id"] == \
+        sales_conn.execute("SELECT MAX(load_id) FROM load_metadata").fetchone()[0]
+
+
+def test_partition_filters_skip_the_other_files(parquet_db):
+    conn = parquet_db.cursor()
+    version_folder = os.path.join(parquet_db.parquet_folder, parquet_db.parquet_version, TABLE_NAME)
+    expected = conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE YEAR(InvoiceDate) = 2011").fetchone()[0]
+    # A corrupted file fails the query that opens it; the first file is always read for the schema
+    files = sorted(glob.glob(os.path.join(version_folder, "**", "*.parquet"), recursive=True))
+    for path in [path for path in files[1:] if "InvoiceYear=2010" in path]:
+        with open(path, "wb") as f:
+            f.write(b"not parquet")
+
+    assert conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE InvoiceYear = 2011").fetchone()[0] == expected
+    with pytest.raises(duckdb.Error):
+        conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()
+
+
+def test_partition_columns_are_described_and_rewritten_to_rollups(parquet_db):
+    conn = parquet_db.cursor()
+    catalog = SchemaCatalog()
+    catalog.refresh(conn, parquet_db.db_path)
+    schema, _ = catalog.describe("quantity per year")
+    assert "- InvoiceYear (BIGINT, from 2010 to 2011, equals YEAR(InvoiceDate), filter on it to skip partitions)" \
+        in schema
+
+    sql_query = (f"SELECT InvoiceYear, Country, SUM(Quantity) AS quantity FROM {TABLE_NAME} "
+                 f"WHERE InvoiceMonth <= 6 GROUP BY InvoiceYear, Country")
+    rewritten, rollup = rewrite_query_to_rollup(sql_query, get_available_rollups(conn))
+    assert rollup is not None and "InvoiceYear" not in rewritten
+    assert sorted_rows(conn, rewritten) == sorted_rows(conn, sql_query)
+
+    aliased = f"SELECT MONTH(InvoiceDate) AS InvoiceMonth, SUM(Quantity) FROM {TABLE_NAME} GROUP BY 1"
+    assert rewrite_query_to_rollup(aliased, get_available_rollups(conn)) == (aliased, None)
+
+
+def test_new_version_is_attached_to_a_new_database(parquet_db, db_copy):
+    previous_version = parquet_db.parquet_version
+    cursor = parquet_db.cursor()
+    rows = cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+
+    conn = duckdb.connect(db_copy)
+    conn.execute(f"DELETE FROM {TABLE_NAME} WHERE Country = 'France'")
+    conn.close()
+    export(db_copy, parquet_db.parquet_folder)
+
+    # A query started on the previous version still reads it
+    assert cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] == rows
+    new_cursor = parquet_db.cursor()
+    assert new_cursor is not cursor
+    assert parquet_db.parquet_version != previous_version
+    assert new_cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] < rows
+    with pytest.raises(duckdb.Error):
+        cursor.execute("SELECT 1")
+
+
+def test_old_versions_are_pruned(db_copy, tmp_path):
+    folder = str(tmp_path / "parquet")
+    versions = [export(db_copy, folder, keep_versions=2)["version"] for _ in range(3)]
+
+    assert sorted(name for name in os.listdir(folder) if name != "CURRENT") == sorted(versions[1:])
+    assert current_version(folder) == versions[-1]
+
+
+def test_stale_export_is_reported(db_copy, tmp_path):
+    manifest = export(db_copy, str(tmp_path / "parquet"))
+    assert stale_export_warning(manifest, db_copy) is None
+
+    conn = duckdb.connect(db_copy)
+    write_to_table(conn, TABLE_NAME, table_name="more_sales", mode="create")
+    conn.close()
+
+    assert manifest["version"] in stale_export_warning(manifest, db_copy)
@@ -0,0 +1,34 @@
+import duckdb
+import pytest
+
+from query_results import dataframe_stats, fetch_dataframe, fetch_preview
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE t AS SELECT i, 'v' || (i % 3) AS s, CAST(i % 7 AS DECIMAL(10, 2)) AS d FROM range(500) t(i)")
+    yield conn
+    conn.close()
+
+
+@pytest.mark.filterwarnings("error::DeprecationWarning")
+@pytest.mark.parametrize("preview_rows", [1, 10, 499, 500, 1000])
+def test_preview_keeps_the_query_order_and_full_stats(conn, preview_rows):
+    sql_query = "SELECT * FROM t ORDER BY i DESC"
+    preview, stats = fetch_preview(conn, sql_query, preview_rows)
+    full = conn.execute(sql_query).df()
+    assert preview["i"].tolist() == full["i"].tolist()[:preview_rows]
+    assert stats == dataframe_stats(full)
+
+
+def test_preview_leaves_no_temporary_table(conn):
+    fetch_preview(conn, "SELECT * FROM t", 10)
+    assert conn.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE temporary").fetchone()[0] == 0
+
+
+@pytest.mark.filterwarnings("error::DeprecationWarning")
+def test_fetch_dataframe_converts_decimals_to_floats(conn):
+    df = fetch_dataframe(conn, "SELECT s, SUM(d) AS total FROM t GROUP BY s ORDER BY s")
+    assert df["s"].tolist() == ["v0", "v1", "v2"]
+    assert df["total"].dtype == "float64"
@@ -0,0 +1,132 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from config import TABLE_NAME
+from report_engine import ReportEngine
+from result_cache import ResultCache
+from sql_cache import SQLCache
+
+QUERIES = {
+    "total quantity per country":
+        f"SELECT Country, SUM(Quantity) AS total_quantity FROM {TABLE_NAME} GROUP BY Country ORDER BY Country",
+    "total sales per month":
+        f"SELECT DATE_TRUNC('month', InvoiceDate) AS InvoiceDate, SUM(Quantity * UnitPrice) AS total_sales "
+        f"FROM {TABLE_NAME} GROUP BY 1 ORDER BY 1",
+}
+
+
+class StubLLM:
+    """
+    Answers the SQL prompt with the query of the first known request it contains.
+    """
+
+    model_name = "stub"
+
+    def __init__(self, queries=QUERIES):
+        self.queries = queries
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        for request, sql_query in self.queries.items():
+            if request in prompt:
+                return SimpleNamespace(content=sql_query)
+        raise ValueError("unknown request")
+
+
+@pytest.fixture
+def engine(sales_db, tmp_path):
+    engine = ReportEngine(llm=StubLLM(), sql_cache=SQLCache(str(tmp_path / "sql_cache.sqlite")),
+                          result_cache=ResultCache(str(tmp_path / "result_cache")), db_path=sales_db)
+    yield engine
+    engine.close()
+
+
+def test_run_reuses_the_workflow_and_the_cached_sql(engine):
+    app = engine.app
+    first = engine.run("total quantity per country")
+    second = engine.run("total quantity per country")
+
+    assert first["errors"] == [] and second["errors"] == []
+    assert list(first["query_result"]["Country"]) == list(second["query_result"]["Country"])
+    assert (first["sql_cache_hit"], second["sql_cache_hit"]) == (False, True)
+    assert "## Data Summary" in first["reports"]["markdown"]
+    assert engine.llm.calls == 1
+    assert engine.app is app
+
+
+def test_run_serves_the_cached_result_of_the_same_sql(engine):
+    first = engine.run("total sales per month", use_sql_cache=False)
+    second = engine.run("total sales per month", use_sql_cache=False)
+
+    assert (first["result_cache_hit"], second["result_cache_hit"]) == (False, True)
+    assert second["query_result"].equals(first["query_result"])
+    assert engine.llm.calls == 2
+
+
+def test_batch_keeps_order_and_isolates_failures(engine):
+    requests = ["total sales per month", "something unknown", "total quantity per country"]
+    states = engine.batch(requests, max_concurrency=3)
+
+    assert [state["user_request"] for state in states] == requests
+    assert states[0]["errors"] == [] and states[2]["errors"] == []
+    assert "unknown request" in states[1]["errors"][0]
+    assert all(state["elapsed_seconds"] > 0 for state in states)
+
+
+def test_batch_bounds_the_concurrency(engine, monkeypatch):
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def fake_run(user_request, *args, **kwargs):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.05)
+        with lock:
+            running["now"] -= 1
+        return {"user_request": user_request, "errors": []}
+
+    monkeypatch.setattr(engine, "run", fake_run)
+    states = engine.batch([f"request {i}" for i in range(6)], max_concurrency=2)
+
+    assert [state["user_request"] for state in states] == [f"request {i}" for i in range(6)]
+    assert running["max"] == 2
+
+
+def test_a_failing_chart_only_marks_its_own_state(engine):
+    states = engine.batch(["total quantity per country", "total sales per month"])
+    for state in states:
+        state["visualization"] = None
+    # Pie charts cannot draw negative wedges
+    states[0]["query_result"]["total_quantity"] *= -1
+    states[0]["chart_spec"]["kind"] = "pie"
+
+    engine.render_charts(states, {"dpi": 50}, workers=2)
+
+    assert states[0]["visualization"] is None
+    assert "Error generating visualization" in states[0]["errors"][0]
+    assert states[1]["visualization"].startswith(b"\x89PNG") and states[1]["errors"] == []
+
+
+def test_iter_batch_bounds_the_requests_in_flight(engine, monkeypatch):
+    started, release = [], threading.Event()
+
+    def fake_run(user_request, *args, **kwargs):
+        started.append(user_request)
+        if user_request != "request 0":
+            release.wait(5)
+        return {"user_request": user_request, "errors": []}
+
+    monkeypatch.setattr(engine, "run", fake_run)
+    results = engine.iter_batch([f"request {i}" for i in range(6)], max_concurrency=2)
+
+    assert next(results)[0] == 0
+    time.sleep(0.2)
+    # The two first requests, and the one submitted when the first state was yielded
+    assert sorted(started) == ["request 0", "request 1", "request 2"]
+    release.set()
+    assert sorted(index for index, _ in results) == [1, 2, 3, 4, 5]
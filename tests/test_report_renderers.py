@@ -0,0 +1,63 @@
+import base64
+
+import pandas as pd
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Image, Paragraph
+
+from charts import build_chart_spec, chart_data, render_chart
+from report_model import build_report_model
+from report_renderers import render_html, render_markdown, render_pdf_section
+
+RESULT = pd.DataFrame({"Country": ["France", "Spain", "EIRE", "Germany", "Belgium"],
+                       "total_quantity": [5.0, 4.0, 3.0, 2.0, 1.0]})
+
+
+def report_state(request="Total quantity per <country>", chart_format="png"):
+    spec = build_chart_spec(RESULT, request)
+    return {
+        "user_request": request,
+        "sql_query": "SELECT Country, SUM(Quantity) AS total_quantity FROM sales_data GROUP BY Country",
+        "query_result": RESULT,
+        "rollup_table": "sales_rollup_monthly_country",
+        "chart_spec": spec,
+        "visualization": render_chart(chart_data(RESULT, spec), spec, dpi=50, fmt=chart_format),
+        "visualization_format": chart_format,
+    }
+
+
+def test_model_holds_the_summary_and_a_slice_of_the_result():
+    model = build_report_model(report_state(), table_rows=2)
+
+    assert len(model.table) == 2 and model.total_rows == 5 and model.truncated
+    summary = dict(model.summary)
+    assert summary["Total records"] == "5"
+    assert summary["Total quantity"] == "15.00"
+    assert summary["Answered from rollup table"] == "sales_rollup_monthly_country"
+    assert summary["Included countries"] == "France, Spain, EIRE, Germany, Belgium"
+
+
+def test_markdown_report():
+    report = render_markdown(build_report_model(report_state(), table_rows=2))
+
+    assert "```sql\nSELECT Country, SUM(Quantity)" in report
+    assert "- Total quantity: 15.00\n" in report
+    assert "*Showing 2 of 5 records*" in report
+
+
+def test_html_report_escapes_text_and_embeds_the_chart():
+    state = report_state()
+    report = render_html(build_report_model(state))
+
+    assert "Total quantity per &lt;country&gt;" in report and "<country>" not in report
+    assert base64.b64encode(state["visualization"]).decode() in report
+    assert "<svg" in render_html(build_report_model(report_state(chart_format="svg")))
+
+
+def test_pdf_section_embeds_png_charts_only():
+    styles = getSampleStyleSheet()
+    png = render_pdf_section(build_report_model(report_state()), 0, styles)
+    svg = render_pdf_section(build_report_model(report_state(chart_format="svg")), 0, styles)
+
+    assert png[0].getPlainText() == "Analysis 1: Total quantity per <country>"
+    assert isinstance(png[-1], Image)
+    assert isinstance(svg[-1], Paragraph) and "only embed PNG" in svg[-1].getPlainText()
@@ -0,0 +1,53 @@
+import json
+import shutil
+import urllib.error
+import urllib.request
+
+import pytest
+
+from job_queue import JobQueue
+from llm_client import FakeLLM
+from report_engine import ReportEngine
+from report_server import ReportServer
+
+from test_db_connection import write_from_another_process
+
+
+@pytest.fixture
+def server(tmp_path, sales_db):
+    db_path = str(tmp_path / "sales.duckdb")
+    shutil.copy(sales_db, db_path)
+    engine = ReportEngine(llm=FakeLLM(), use_sql_cache=False, use_result_cache=False, db_path=db_path,
+                          storage="duckdb", chart_workers=1)
+    server = ReportServer(engine, JobQueue(str(tmp_path / "jobs.sqlite")), workers=1, host="127.0.0.1", port=0)
+    server.start()
+    yield server
+    server.close()
+
+
+def request(server, method, path, body=None):
+    host, port = server.address
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(f"http://{host}:{port}{path}", data=data, method=method,
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_database_is_released_between_jobs(server):
+    status, submitted = request(server, "POST", "/jobs", {"user_request": "Total revenue by country"})
+    assert status == 202
+    status, job = request(server, "GET", f"/jobs/{submitted['job_id']}?wait=60")
+    assert job["status"] == "done", job
+
+    writer = write_from_another_process(server.engine.db.db_path, "CREATE TABLE loaded AS SELECT 1 AS x")
+    assert writer.returncode == 0, writer.stderr
+
+
+@pytest.mark.parametrize("path", ["/jobs?limit=ten", "/jobs/some-job?wait=soon"])
+def test_invalid_query_parameters_are_rejected(server, path):
+    status, body = request(server, "GET", path)
+    assert status == 400 and "error" in body
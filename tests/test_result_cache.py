@@ -0,0 +1,57 @@
+import time
+
+import duckdb
+import pandas as pd
+
+from extract_and_write_data import write_to_table
+from result_cache import ResultCache, get_data_version, normalize_sql
+from workflow_functions import result_data_version
+
+
+def test_normalize_sql_keeps_literals():
+    assert normalize_sql("SELECT  *\n FROM t WHERE c = 'a  b';") == "SELECT * FROM t WHERE c = 'a  b'"
+
+
+def test_lookup_counts_hits_and_misses(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.lookup("SELECT 1", "v1") == (None, None)
+    cache.put("SELECT 1", "v1", pd.DataFrame({"x": [1]}), {"stats": {}, "row_cap_hit": False})
+    result, metadata = cache.lookup("SELECT  1;", "v1")
+    assert result["x"].tolist() == [1] and metadata == {"stats": {}, "row_cap_hit": False}
+    assert cache.lookup("SELECT 1", "v2") == (None, None)
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 2)
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("SELECT 1", "v1", pd.DataFrame({"x": [1]}), {})
+    cache.max_bytes = cache.stats()["bytes"]
+    # The eviction orders the files by modification time
+    time.sleep(0.05)
+    cache.put("SELECT 2", "v1", pd.DataFrame({"x": [2]}), {})
+    assert cache.stats()["entries"] == 1
+    assert cache.lookup("SELECT 1", "v1")[0] is None
+    assert cache.lookup("SELECT 2", "v1")[0]["x"].tolist() == [2]
+
+
+def test_data_version_changes_with_every_load(sales_db, tmp_path):
+    path = str(tmp_path / "copy.duckdb")
+    conn = duckdb.connect(path)
+    try:
+        conn.execute(f"ATTACH '{sales_db}' AS source (READ_ONLY)")
+        conn.execute("COPY FROM DATABASE source TO copy")
+        conn.execute("DETACH source")
+        before = get_data_version(conn, path)
+        write_to_table(conn, "sales_data", table_name="more_sales", mode="create")
+        assert get_data_version(conn, path) != before
+        assert before.startswith("load:")
+    finally:
+        conn.close()
+
+
+def test_result_key_depends_on_mode_and_row_cap(sales_conn, sales_db):
+    keys = {result_data_version(sales_conn, sales_db, "preview", None),
+            result_data_version(sales_conn, sales_db, "full", 100),
+            result_data_version(sales_conn, sales_db, "full", 1000)}
+    assert len(keys) == 3
+    assert all(key.startswith("load:") for key in keys)
@@ -0,0 +1,47 @@
+import pytest
+
+from config import TABLE_NAME
+from rollups import get_available_rollups, rewrite_query_to_rollup
+
+REWRITTEN_QUERIES = [
+    "SELECT Country, SUM(Quantity * UnitPrice) AS revenue FROM {table} GROUP BY Country",
+    "SELECT Country, SUM(Quantity), COUNT(*) FROM {table} GROUP BY Country",
+    "SELECT YEAR(InvoiceDate) AS year, SUM(UnitPrice * Quantity) FROM {table} GROUP BY year",
+    "SELECT Country, COUNT(DISTINCT StockCode) FROM {table} GROUP BY Country",
+    "SELECT Country, MIN(StockCode), MAX(StockCode) FROM {table} WHERE Country <> 'Spain' GROUP BY Country",
+]
+
+UNCHANGED_QUERIES = [
+    "SELECT Country, COUNT(Country) FROM {table} GROUP BY Country",
+    "SELECT Country, COUNT(StockCode) FROM {table} GROUP BY Country",
+    "SELECT Country, AVG(Quantity) FROM {table} GROUP BY Country",
+    "SELECT Country, COUNT(*), AVG(UnitPrice) FROM {table} GROUP BY Country",
+    "SELECT Country, SUM(Quantity), MEDIAN(Quantity) FROM {table} GROUP BY Country",
+    "SELECT Country, STRING_AGG(StockCode, ',') FROM {table} GROUP BY Country",
+    "SELECT Country, Quantity FROM {table}",
+]
+
+
+def fact_query(sql_query):
+    return sql_query.format(table=TABLE_NAME)
+
+
+def sorted_rows(conn, sql_query):
+    # Sums of doubles depend on the order of the rows, compare them rounded
+    rows = conn.execute(sql_query).fetchall()
+    return sorted((tuple(round(value, 6) if isinstance(value, float) else value for value in row) for row in rows),
+                  key=repr)
+
+
+@pytest.mark.parametrize("sql_query", REWRITTEN_QUERIES)
+def test_rewritten_queries_match_the_fact_table(sales_conn, sql_query):
+    sql_query = fact_query(sql_query)
+    rewritten, rollup = rewrite_query_to_rollup(sql_query, get_available_rollups(sales_conn))
+    assert rollup is not None
+    assert sorted_rows(sales_conn, rewritten) == sorted_rows(sales_conn, sql_query)
+
+
+@pytest.mark.parametrize("sql_query", UNCHANGED_QUERIES)
+def test_other_aggregates_stay_on_the_fact_table(sales_conn, sql_query):
+    sql_query = fact_query(sql_query)
+    assert rewrite_query_to_rollup(sql_query, get_available_rollups(sales_conn)) == (sql_query, None)
@@ -0,0 +1,62 @@
+import duckdb
+import pytest
+
+from config import SCHEMA_MAX_COLUMNS, TABLE_NAME
+from schema_catalog import SchemaCatalog, name_tokens, request_tokens
+
+
+@pytest.mark.parametrize("word, singular", [
+    ("countries", "country"),
+    ("categories", "category"),
+    ("taxes", "tax"),
+    ("purchases", "purchase"),
+    ("sales", "sale"),
+    ("invoices", "invoice"),
+    ("customers", "customer"),
+])
+def test_request_tokens_include_the_singular(word, singular):
+    assert singular in request_tokens(f"total by {word}")
+
+
+def test_request_tokens_keep_words_and_add_synonyms():
+    tokens = request_tokens("Monthly sales per country, top products")
+
+    assert {"monthly", "sales", "country", "top", "products", "product"} <= tokens
+    assert {"quantity", "price", "description", "stock"} <= tokens
+    assert "countrie" not in request_tokens("sales by countries")
+    assert "addres" not in request_tokens("customer address")
+
+
+def test_name_tokens_split_camel_case():
+    assert name_tokens("InvoiceDate") == ["invoice", "date"]
+    assert name_tokens("CustomerID") == ["customer", "id"]
+
+
+def test_catalog_describes_the_fact_table(sales_conn):
+    catalog = SchemaCatalog()
+    fingerprint = catalog.refresh(sales_conn)
+    schema, tables = catalog.describe("quantity per country")
+
+    assert catalog.refresh(sales_conn) == fingerprint
+    assert tables == [TABLE_NAME]
+    assert "- Country (VARCHAR, 8 values: " in schema
+    assert "- InvoiceDate (TIMESTAMP, from 2010-" in schema
+
+
+def test_wide_tables_are_described_by_their_mentioned_columns():
+    conn = duckdb.connect()
+    columns = [f"Metric{i} DOUBLE" for i in range(SCHEMA_MAX_COLUMNS)]
+    conn.execute(f"CREATE TABLE wide (Country VARCHAR, Quantity INTEGER, {', '.join(columns)})")
+    conn.execute("INSERT INTO wide (Country, Quantity) VALUES ('France', 1), ('Germany', 2)")
+    catalog = SchemaCatalog()
+    catalog.refresh(conn)
+
+    (table, selected), = catalog.select_relevant("quantity by countries")
+    schema, _ = catalog.describe("quantity by countries")
+
+    assert table["name"] == "wide"
+    assert [column["name"] for column in selected] == ["Country", "Quantity"]
+    assert f"- ... {SCHEMA_MAX_COLUMNS} more columns not relevant to the request" in schema
+    # Values of low-cardinality columns are matched too
+    assert [column["name"] for _, columns in catalog.select_relevant("sales in France") for column in columns] \
+        == ["Country", "Quantity"]
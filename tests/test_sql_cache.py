@@ -0,0 +1,51 @@
+import time
+
+from sql_cache import SQLCache
+
+
+def test_requests_are_normalized(tmp_path):
+    cache = SQLCache(str(tmp_path / "cache.sqlite"))
+    cache.set("Total revenue by country?", "schema-a", "model", "SELECT 1")
+    assert cache.get("  total REVENUE by   country ", "schema-a", "model") == "SELECT 1"
+    assert cache.get("Total revenue by country", "schema-a", "other-model") is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_schemas_do_not_evict_each_other(tmp_path):
+    cache = SQLCache(str(tmp_path / "cache.sqlite"))
+    cache.set("revenue", "duckdb-schema", "model", "SELECT 1")
+    cache.set("revenue", "parquet-schema", "model", "SELECT 2")
+    assert cache.get("revenue", "duckdb-schema", "model") == "SELECT 1"
+    assert cache.get("revenue", "parquet-schema", "model") == "SELECT 2"
+    assert cache.get("revenue", "new-schema", "model") is None
+    assert cache.get("revenue", "duckdb-schema", "model") == "SELECT 1"
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = SQLCache(str(tmp_path / "cache.sqlite"), ttl_seconds=0.05)
+    cache.set("old", "schema", "model", "SELECT 1")
+    time.sleep(0.1)
+    assert cache.get("old", "schema", "model") is None
+    cache.set("older", "other-schema", "model", "SELECT 2")
+    time.sleep(0.1)
+    cache.set("new", "schema", "model", "SELECT 3")
+    assert cache.stats()["entries"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = SQLCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.set("a", "schema", "model", "SELECT 1")
+    cache.set("b", "other-schema", "model", "SELECT 2")
+    cache.get("a", "schema", "model")
+    cache.set("c", "schema", "model", "SELECT 3")
+    assert cache.get("b", "other-schema", "model") is None
+    assert cache.get("a", "schema", "model") == "SELECT 1"
+
+
+def test_invalidate_removes_one_entry(tmp_path):
+    cache = SQLCache(str(tmp_path / "cache.sqlite"))
+    cache.set("a", "schema", "model", "SELECT 1")
+    cache.set("b", "schema", "model", "SELECT 2")
+    cache.invalidate("a", "schema", "model")
+    assert cache.get("a", "schema", "model") is None
+    assert cache.get("b", "schema", "model") == "SELECT 2"
@@ -0,0 +1,41 @@
+import duckdb
+import pytest
+
+from sql_validation import execute_capped, validate_sql
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE t AS SELECT i, 'v' || i AS s FROM range(100) t(i)")
+    yield conn
+    conn.close()
+
+
+def test_valid_query_loses_its_trailing_semicolons(conn):
+    assert validate_sql(conn, "  SELECT i FROM t;; ") == ("SELECT i FROM t", None)
+
+
+@pytest.mark.parametrize("sql_query, message", [
+    ("", "empty"),
+    ("SELECT 1; SELECT 2", "single SQL statement"),
+    ("DELETE FROM t", "read-only"),
+    ("DROP TABLE t", "read-only"),
+    ("SELECT missing FROM t", "missing"),
+    ("SELEC i FROM t", "syntax"),
+])
+def test_invalid_queries_are_rejected(conn, sql_query, message):
+    _, error = validate_sql(conn, sql_query)
+    assert error is not None and message.lower() in error.lower()
+
+
+def test_validation_does_not_run_the_query(conn):
+    validate_sql(conn, "SELECT * FROM t")
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 100
+
+
+@pytest.mark.parametrize("row_cap, rows, capped", [(None, 100, False), (100, 100, False), (10, 10, True)])
+def test_row_cap(conn, row_cap, rows, capped):
+    result, cap_hit = execute_capped(conn, "SELECT * FROM t ORDER BY i", row_cap)
+    assert (len(result), cap_hit) == (rows, capped)
+    assert result["i"].tolist() == list(range(rows))
@@ -0,0 +1,24 @@
+import tracemalloc
+
+from tracing import Tracer
+
+
+def test_span_memory_fields(tmp_path):
+    tracer = Tracer(str(tmp_path / "trace.jsonl"))
+    with tracer.span("step") as record:
+        pass
+    assert "max_rss_mb" not in record and "peak_traced_mb" not in record
+    assert record["process_peak_rss_mb"] > 0 and record["process_peak_rss_growth_mb"] >= 0
+
+
+def test_traced_memory_is_the_peak_of_the_span(tmp_path):
+    tracer = Tracer(str(tmp_path / "trace.jsonl"), trace_memory=True)
+    try:
+        with tracer.span("large") as large:
+            data = bytearray(20 * 1024 * 1024)
+            del data
+        with tracer.span("small") as small:
+            pass
+    finally:
+        tracemalloc.stop()
+    assert large["peak_traced_mb"] >= 20 > small["peak_traced_mb"]